@@ -1,3 +1,6 @@
+import time
+STARTED = time.perf_counter()
+
 from flask import Flask
 from flask_socketio import SocketIO
 import os
@@ -7,17 +10,37 @@ from src.config import Config
 from src.logging_config import setup_logging, display_startup_banner
 from src.routes import setup_routes
 from src.socket_events import setup_socket_events
+from src.library import movie_library
+from src.probe import media_prober
+from src.assets import setup_assets, build_if_stale
+from src.metrics import MeteredManager
+from src.startup import StartupTimer
+
+startup = StartupTimer(STARTED)
+startup.mark('imports')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = Config.SECRET_KEY
 app.config['MOVIE_FOLDER'] = Config.MOVIE_FOLDER
 
-socketio = SocketIO(app, cors_allowed_origins="*", logger=False, engineio_logger=False)
-
 app_logger = setup_logging()
 
 setup_routes(app, app_logger)
-setup_socket_events(socketio, app_logger)
+setup_assets(app)
+
+socketio = None
+asgi_app = None
+if Config.SERVER_MODE == 'asgi':
+    from src.asgi import create_asgi_app
+    asgi_app = create_asgi_app(app, app_logger)
+else:
+    client_manager = MeteredManager()
+    if Config.STATE_BACKEND == 'sqlite':
+        from src.pubsub import SQLitePubSubManager
+        client_manager = SQLitePubSubManager(Config.STATE_DB_PATH)
+
+    socketio = SocketIO(app, cors_allowed_origins="*", logger=False, engineio_logger=False, client_manager=client_manager)
+    setup_socket_events(socketio, app_logger)
 
 if __name__ == '__main__':
     if not os.path.exists(Config.MOVIE_FOLDER):
@@ -28,12 +51,25 @@ if __name__ == '__main__':
         os.makedirs(Config.AVATAR_FOLDER)
         app_logger.info(f"Created avatars folder: {Config.AVATAR_FOLDER}")
     
+    if Config.ASSETS_BUILD_ON_START:
+        build_if_stale()
+
+    movie_library.start_watching()
+    app_logger.info(f"Indexed {len(movie_library.get_movies())} movies")
+    media_prober.lookup(movie_library.get_movies())
+
     display_startup_banner(Config)
+    startup.mark('app setup')
+    startup.wait_for_bind(Config.HOST, Config.PORT, lambda timer: app_logger.info(timer.report()))
     app_logger.info("SynCinema server is ready!")
     print("")
     
     try:
-        socketio.run(app, debug=Config.DEBUG, host=Config.HOST, port=Config.PORT, log_output=False)
+        if asgi_app is not None:
+            import uvicorn
+            uvicorn.run(asgi_app, host=Config.HOST, port=Config.PORT, log_level='warning')
+        else:
+            socketio.run(app, debug=Config.DEBUG, host=Config.HOST, port=Config.PORT, log_output=False)
     except KeyboardInterrupt:
         print(f"\n{Fore.YELLOW} Server stopped by user{Style.RESET_ALL}")
     except Exception as e:
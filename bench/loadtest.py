@@ -0,0 +1,429 @@
+import os
+import sys
+import json
+import time
+import random
+import signal
+import struct
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+
+import requests
+import socketio
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench'
+ROOM = 'bench'
+MOVIE = 'bench.mp4'
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload):
+    return box(box_type, b'\0\0\0\0' + payload)
+
+
+def write_test_movie(path, size_mb, fps=24, sample_size=64 * 1024, keyframe_interval=48):
+    # One video track with the moov at the end, so the faststart layout and
+    # the keyframe index are used the same way as for a real encode
+    chunks = max(1, size_mb * 1024 * 1024 // (sample_size * keyframe_interval))
+    count = chunks * keyframe_interval
+    ftyp = box(b'ftyp', b'isom\0\0\2\0isomiso2mp41')
+    data_start = len(ftyp) + 8
+    with open(path, 'wb') as f:
+        f.write(ftyp)
+        f.write(struct.pack('>I4s', 8 + count * sample_size, b'mdat'))
+        sample = os.urandom(sample_size)
+        for _ in range(count):
+            f.write(sample)
+        offsets = [data_start + i * keyframe_interval * sample_size for i in range(chunks)]
+        keyframes = [i * keyframe_interval + 1 for i in range(chunks)]
+        stbl = box(b'stbl', b''.join([
+            full_box(b'stsd', struct.pack('>I', 0)),
+            full_box(b'stts', struct.pack('>III', 1, count, 1000)),
+            full_box(b'stss', struct.pack(f'>I{chunks}I', chunks, *keyframes)),
+            full_box(b'stsc', struct.pack('>IIII', 1, 1, keyframe_interval, 1)),
+            full_box(b'stsz', struct.pack('>II', sample_size, count)),
+            full_box(b'stco', struct.pack(f'>I{chunks}I', chunks, *offsets))
+        ]))
+        mdhd = full_box(b'mdhd', struct.pack('>IIIIHH', 0, 0, fps * 1000, count * 1000, 0, 0))
+        hdlr = full_box(b'hdlr', struct.pack('>I4s12s', 0, b'vide', b'') + b'bench\0')
+        trak = box(b'trak', full_box(b'tkhd', b'\0' * 80) + box(b'mdia', mdhd + hdlr + box(b'minf', stbl)))
+        f.write(box(b'moov', full_box(b'mvhd', b'\0' * 96) + trak))
+    return count / fps
+
+
+def percentiles(values, scale=1000.0):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(pct):
+        return round(values[min(len(values) - 1, int(pct / 100 * len(values)))] * scale, 3)
+
+    return {'count': len(values), 'p50': at(50), 'p90': at(90), 'p99': at(99), 'max': round(values[-1] * scale, 3)}
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = Counter()
+        self.received = Counter()
+        self.fanout = []
+        self.connect_errors = 0
+        self.ranges = 0
+        self.range_errors = 0
+        self.bytes = 0
+        self.first_byte = []
+        self.range_time = []
+
+
+class ResourceSampler:
+    # Uses psutil when it is installed and falls back to /proc on Linux
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read(self):
+        if psutil is not None:
+            process = psutil.Process(self.pid)
+            times = process.cpu_times()
+            return times.user + times.system, process.memory_info().rss
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{self.pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+        ticks = os.sysconf('SC_CLK_TCK')
+        return (int(fields[11]) + int(fields[12])) / ticks, rss_pages * os.sysconf('SC_PAGE_SIZE')
+
+    def _run(self):
+        try:
+            last_cpu, _ = self._read()
+        except (OSError, IndexError, ValueError):
+            return
+        last_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            try:
+                cpu, rss = self._read()
+            except (OSError, IndexError, ValueError):
+                return
+            now = time.monotonic()
+            self.cpu.append(100 * (cpu - last_cpu) / (now - last_time))
+            self.rss.append(rss)
+            last_cpu, last_time = cpu, now
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        if not self.cpu:
+            return None
+        return {
+            'cpu_percent_avg': round(sum(self.cpu) / len(self.cpu), 1),
+            'cpu_percent_max': round(max(self.cpu), 1),
+            'rss_mb_max': round(max(self.rss) / 1024 / 1024, 1),
+            'rss_mb_end': round(self.rss[-1] / 1024 / 1024, 1)
+        }
+
+
+def login(url, username):
+    session = requests.Session()
+    response = session.post(f'{url}/api/login', json={'username': username, 'password': PASSWORD}, timeout=10)
+    response.raise_for_status()
+    return session
+
+
+class SocketClient:
+    def __init__(self, index, url, stats, args, duration):
+        self.username = f'bench{index}'
+        self.index = index
+        self.url = url
+        self.stats = stats
+        self.args = args
+        self.duration = duration
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('*', self.on_event)
+
+    def connect(self):
+        session = login(self.url, self.username)
+        cookie = '; '.join(f'{name}={value}' for name, value in session.cookies.items())
+        self.sio.connect(f'{self.url}?room={ROOM}', headers={'Cookie': cookie}, wait_timeout=10)
+
+    def on_event(self, event, data=None):
+        now = time.perf_counter()
+        with self.stats.lock:
+            self.stats.received[event] += 1
+            if event == 'new_message' and isinstance(data, dict):
+                parts = str(data.get('message', '')).split()
+                if len(parts) == 3 and parts[0] == 'bench' and parts[1] != self.username:
+                    self.stats.fanout.append(now - float(parts[2]))
+
+    def emit(self, event, data=None):
+        self.sio.emit(event, data)
+        with self.stats.lock:
+            self.stats.sent[event] += 1
+
+    def run(self, deadline):
+        args = self.args
+        now = time.monotonic()
+        # Random phases keep the clients from firing in lockstep
+        due = {
+            'heartbeat': now + random.uniform(0, args.heartbeat_interval),
+            'chat': now + random.uniform(0, args.chat_interval),
+            'seek': now + random.uniform(0, args.seek_interval) if args.seek_interval > 0 else float('inf')
+        }
+        while True:
+            action = min(due, key=due.get)
+            wait = due[action] - time.monotonic()
+            if due[action] >= deadline:
+                return
+            if wait > 0:
+                time.sleep(wait)
+            if not self.sio.connected:
+                return
+            if action == 'heartbeat':
+                self.emit('heartbeat', {'time': random.uniform(0, self.duration), 'is_watching': True})
+                due[action] += args.heartbeat_interval
+            elif action == 'chat':
+                self.emit('typing')
+                self.emit('send_message', {'message': f'bench {self.username} {time.perf_counter():.6f}'})
+                due[action] += args.chat_interval
+            else:
+                self.emit('seek', {'time': random.uniform(0, self.duration)})
+                due[action] += args.seek_interval
+
+    def close(self):
+        if self.sio.connected:
+            self.sio.disconnect()
+
+
+def stream_worker(index, url, stats, args, deadline):
+    # Plays through the movie like a browser: sequential ranges from a random
+    # starting point
+    session = login(url, f'bench{index}')
+    movie_url = f'{url}/movies/{MOVIE}'
+    size = int(session.head(movie_url, timeout=10).headers['Content-Length'])
+    position = random.randrange(0, max(1, size - args.range_size))
+    while time.monotonic() < deadline:
+        end = min(size, position + args.range_size) - 1
+        start = time.perf_counter()
+        first_byte = None
+        received = 0
+        try:
+            with session.get(movie_url, headers={'Range': f'bytes={position}-{end}'}, stream=True, timeout=30) as response:
+                ok = response.status_code == 206
+                for data in response.iter_content(64 * 1024):
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - start
+                    received += len(data)
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with stats.lock:
+            stats.ranges += 1
+            stats.bytes += received
+            if not ok:
+                stats.range_errors += 1
+            elif first_byte is not None:
+                stats.first_byte.append(first_byte)
+                stats.range_time.append(elapsed)
+        position = end + 1 if end + 1 < size else 0
+
+
+def serve():
+    sys.path.insert(0, ROOT)
+    import app
+    from src.config import Config
+    app.movie_library.start_watching()
+    if app.asgi_app is not None:
+        import uvicorn
+        uvicorn.run(app.asgi_app, host=Config.HOST, port=Config.PORT, log_level='warning')
+    else:
+        app.socketio.run(app.app, host=Config.HOST, port=Config.PORT, log_output=False, allow_unsafe_werkzeug=True)
+
+
+def start_server(args, workdir, users):
+    movies = os.path.join(workdir, 'movies')
+    os.makedirs(movies, exist_ok=True)
+    duration = write_test_movie(os.path.join(movies, MOVIE), args.movie_mb)
+    users_file = os.path.join(workdir, 'users.json')
+    with open(users_file, 'w') as f:
+        json.dump({f'bench{i}': PASSWORD for i in range(users)}, f)
+    env = dict(os.environ)
+    env.update({
+        'SECRET_KEY': 'bench',
+        'HOST': '127.0.0.1',
+        'PORT': str(args.port),
+        'MOVIE_FOLDER': movies,
+        'AVATAR_FOLDER': os.path.join(workdir, 'pfp'),
+        'USERS_FILE': users_file,
+        'SERVER_MODE': args.server_mode,
+        'STATE_BACKEND': args.backend,
+        'STATE_DB_PATH': os.path.join(workdir, 'state.db'),
+        'PROGRESS_DB_PATH': os.path.join(workdir, 'progress.db'),
+        'MEDIA_INFO_CACHE_FILE': os.path.join(workdir, 'media_info.json'),
+        'LOG_FORMAT': 'plain',
+        'MAX_ROOMS': '1000'
+    })
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'], env=env,
+                               stdout=log, stderr=subprocess.STDOUT, cwd=ROOT)
+    url = f'http://127.0.0.1:{args.port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with code {process.returncode}, see {log.name}')
+        try:
+            requests.get(f'{url}/login', timeout=1)
+            return process, url, duration
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('server did not start within 30 seconds')
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    stats = Stats()
+    users = max(args.clients, args.streamers, 1)
+    with tempfile.TemporaryDirectory(prefix='syncinema-bench-') as workdir:
+        process, url, duration = start_server(args, workdir, users)
+        sampler = ResourceSampler(process.pid)
+        clients = []
+        try:
+            for index in range(args.clients):
+                client = SocketClient(index, url, stats, args, duration)
+                try:
+                    client.connect()
+                    clients.append(client)
+                except (socketio.exceptions.ConnectionError, requests.RequestException):
+                    stats.connect_errors += 1
+            if clients:
+                clients[0].emit('change_movie', {'movie': MOVIE})
+                clients[0].emit('play', {'time': 0})
+            time.sleep(0.5)
+            with stats.lock:
+                stats.sent.clear()
+                stats.received.clear()
+
+            sampler.start()
+            started = time.monotonic()
+            deadline = started + args.duration
+            threads = [threading.Thread(target=client.run, args=(deadline,)) for client in clients]
+            threads += [threading.Thread(target=stream_worker, args=(index, url, stats, args, deadline))
+                        for index in range(args.streamers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - started
+            time.sleep(0.5)
+            sampler.stop()
+        finally:
+            for client in clients:
+                client.close()
+            stop_server(process)
+
+    sent = sum(stats.sent.values())
+    received = sum(stats.received.values())
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {
+            'clients': args.clients,
+            'streamers': args.streamers,
+            'duration': args.duration,
+            'server_mode': args.server_mode,
+            'backend': args.backend,
+            'movie_mb': args.movie_mb,
+            'range_size': args.range_size,
+            'heartbeat_interval': args.heartbeat_interval,
+            'chat_interval': args.chat_interval,
+            'seek_interval': args.seek_interval
+        },
+        'socket': {
+            'connected': len(clients),
+            'connect_errors': stats.connect_errors,
+            'events_sent': sent,
+            'events_received': received,
+            'sent_per_second': round(sent / elapsed, 1),
+            'received_per_second': round(received / elapsed, 1),
+            'sent_by_event': dict(stats.sent),
+            'received_by_event': dict(stats.received),
+            'chat_fanout_latency_ms': percentiles(stats.fanout)
+        },
+        'streaming': {
+            'ranges': stats.ranges,
+            'errors': stats.range_errors,
+            'bytes': stats.bytes,
+            'bytes_per_second': round(stats.bytes / elapsed),
+            'first_byte_ms': percentiles(stats.first_byte),
+            'range_ms': percentiles(stats.range_time)
+        },
+        'server': sampler.summary()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test a local SynCinema server.')
+    parser.add_argument('--clients', type=int, default=20, help='Socket.IO clients in the room')
+    parser.add_argument('--streamers', type=int, default=4, help='clients streaming the test movie')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run the load')
+    parser.add_argument('--port', type=int, default=17799)
+    parser.add_argument('--server-mode', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--movie-mb', type=int, default=64, help='size of the generated test movie')
+    parser.add_argument('--range-size', type=int, default=2 * 1024 * 1024, help='bytes per Range request')
+    parser.add_argument('--heartbeat-interval', type=float, default=5)
+    parser.add_argument('--chat-interval', type=float, default=2)
+    parser.add_argument('--seek-interval', type=float, default=10, help='0 disables seeks')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve()
+    random.seed(args.seed)
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import threading
+from src.config import Config
+from src.timeline import timeline_payload
+
+
+class ControlArbiter:
+    def __init__(self, socketio, state, room):
+        self.socketio = socketio
+        self.state = state
+        self.room = room
+        self._lock = threading.Lock()
+        self._pending_seek = None
+        self._seek_scheduled = False
+
+    def apply(self, at, **fields):
+        playback_state, applied = self.state.update_playback(at, **fields)
+        if applied:
+            # The play/pause broadcast carries the latest position already
+            with self._lock:
+                self._pending_seek = None
+        return playback_state, applied
+
+    def seek(self, position, at, username, sid):
+        playback_state, applied = self.state.update_playback(at, current_time=position)
+        if not applied:
+            return playback_state, applied
+        with self._lock:
+            self._pending_seek = (username, sid)
+            if self._seek_scheduled:
+                return playback_state, applied
+            self._seek_scheduled = True
+        self.socketio.start_background_task(self._flush_seek)
+        return playback_state, applied
+
+    def _flush_seek(self):
+        self.socketio.sleep(Config.SEEK_COALESCE_WINDOW)
+        with self._lock:
+            pending = self._pending_seek
+            self._pending_seek = None
+            self._seek_scheduled = False
+        if pending is None:
+            return
+        username, sid = pending
+        payload = dict(timeline_payload(self.state.playback_state), username=username)
+        self.socketio.emit('seek_video', payload, to=self.room, skip_sid=sid)
@@ -0,0 +1,301 @@
+import time
+import asyncio
+import threading
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+import socketio
+from itsdangerous import BadSignature
+from werkzeug.http import parse_etags, quote_etag
+from src.config import Config
+from src.rooms import room_manager
+from src.socket_events import SocketContext, create_event_handlers
+from src.streaming import (if_range_matches, plan_partial_content, full_content_headers, send_range,
+                           RangeNotSatisfiable)
+from src.moviefiles import movie_files, MovieNotFound, AccessDenied
+from src.mp4 import mp4_index_cache
+from src.throttle import open_stream
+from src.metrics import AsyncMeteredManager
+from src.utils import get_video_mime_type
+
+ZEROCOPY_EXTENSION = 'http.response.zerocopysend'
+
+
+class AsyncSocketContext(SocketContext):
+    def __init__(self, sio, sid, username, remote_addr, args):
+        super().__init__(sid, username, remote_addr, args)
+        self.sio = sio
+        self.operations = []
+        self.disconnected = False
+
+    def emit(self, event, data, room=None, include_self=True):
+        if room is None:
+            self.operations.append(lambda: self.sio.emit(event, data, to=self.sid))
+        else:
+            skip_sid = None if include_self else self.sid
+            self.operations.append(lambda: self.sio.emit(event, data, room=room, skip_sid=skip_sid))
+
+    def join(self, channel):
+        self.operations.append(lambda: self.sio.enter_room(self.sid, channel))
+
+    def leave(self, channel):
+        self.operations.append(lambda: self.sio.leave_room(self.sid, channel))
+
+    def disconnect(self):
+        self.disconnected = True
+
+    async def flush(self):
+        for operation in self.operations:
+            result = operation()
+            if asyncio.iscoroutine(result):
+                await result
+        self.operations = []
+
+
+class AsyncServerBridge:
+    # RoomManager and PresenceBroadcaster are written against the blocking
+    # Flask-SocketIO API; the bridge runs their work on threads and hands
+    # emits back to the event loop.
+    def __init__(self, sio):
+        self.sio = sio
+        self.loop = None
+
+    def emit(self, event, data, to=None, **kwargs):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.sio.emit(event, data, to=to, **kwargs), self.loop)
+
+    def disconnect(self, sid):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.sio.disconnect(sid), self.loop)
+
+    def start_background_task(self, target, *args, **kwargs):
+        thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+def load_session_username(flask_app, cookie_header):
+    if not cookie_header:
+        return None
+    cookie = SimpleCookie()
+    cookie.load(cookie_header)
+    morsel = cookie.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(morsel.value, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('username')
+
+
+def get_header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def create_socket_server(flask_app, app_logger):
+    client_manager = AsyncMeteredManager()
+    if Config.STATE_BACKEND == 'sqlite':
+        from src.pubsub import AsyncSQLitePubSubManager
+        client_manager = AsyncSQLitePubSubManager(Config.STATE_DB_PATH)
+
+    sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', logger=False,
+                               engineio_logger=False, client_manager=client_manager)
+    bridge = AsyncServerBridge(sio)
+    room_manager.init_app(bridge)
+    handlers = create_event_handlers(app_logger)
+
+    async def run_handler(event, sid, session, data):
+        ctx = AsyncSocketContext(sio, sid, session.get('username'), session.get('remote_addr'),
+                                 session.get('args', {}))
+        await asyncio.to_thread(handlers[event], ctx, data if isinstance(data, dict) else {})
+        await ctx.flush()
+        return ctx
+
+    @sio.event
+    async def connect(sid, environ, auth=None):
+        bridge.loop = asyncio.get_running_loop()
+        scope = environ['asgi.scope']
+        session = {
+            'username': load_session_username(flask_app, environ.get('HTTP_COOKIE')),
+            'remote_addr': scope['client'][0] if scope.get('client') else environ.get('REMOTE_ADDR'),
+            'args': dict(parse_qsl(environ.get('QUERY_STRING', '')))
+        }
+        await sio.save_session(sid, session)
+        ctx = await run_handler('connect', sid, session, auth)
+        if ctx.disconnected:
+            return False
+
+    @sio.event
+    async def disconnect(sid):
+        await run_handler('disconnect', sid, await sio.get_session(sid), None)
+
+    def register(event):
+        async def handler(sid, data=None):
+            await run_handler(event, sid, await sio.get_session(sid), data)
+        sio.on(event, handler)
+
+    for event in handlers:
+        if event not in ('connect', 'disconnect'):
+            register(event)
+    return sio
+
+
+def open_viewer_stream(username, filename, movie):
+    # Reads room state and may parse the MP4 index, so it runs on a thread
+    room = room_manager.room_for_viewer(username, filename)
+    return open_stream(username, room.name if room else None, filename, movie.path, movie.stat)
+
+
+async def serve_movie(flask_app, app_logger, scope, receive, send):
+    filename = scope['path'][len('/movies/'):]
+    username = load_session_username(flask_app, get_header(scope, b'cookie'))
+    if username is None:
+        app_logger.warning(f"Unauthorized movie access attempt for: {filename}")
+        return await send_text(send, 401, 'Unauthorized')
+    app_logger.info(f"Movie request from {username}: {filename}")
+    try:
+        movie = await asyncio.to_thread(movie_files.get, filename)
+    except MovieNotFound:
+        app_logger.error(f"Movie file not found: {filename}")
+        return await send_text(send, 404, 'File not found')
+    except AccessDenied:
+        app_logger.warning(f"Security violation - path traversal attempt: {filename}")
+        return await send_text(send, 403, 'Access denied')
+    file_size = movie.size
+    mtime = movie.mtime
+    mime_type = get_video_mime_type(filename)
+    app_logger.info(f"Serving movie: {filename} (size: {file_size} bytes)")
+    etag = movie.etag
+    layout = None
+    if Config.MP4_FASTSTART:
+        layout = await asyncio.to_thread(mp4_index_cache.layout, movie.path, movie.stat)
+    if layout is not None:
+        etag = f"{etag}-fs"
+        file_size = layout.size
+    if parse_etags(get_header(scope, b'if-none-match')).contains(etag):
+        return await send_text(send, 304, '', {'ETag': quote_etag(etag)})
+
+    plan = None
+    range_header = get_header(scope, b'range')
+    if range_header and if_range_matches(get_header(scope, b'if-range'), etag, mtime):
+        try:
+            plan = plan_partial_content(range_header, mime_type, file_size, mtime, etag)
+        except RangeNotSatisfiable:
+            return await send_text(send, 416, 'Requested range not satisfiable',
+                                   {'Content-Range': f'bytes */{file_size}', 'Accept-Ranges': 'bytes'})
+    if plan is not None:
+        status = 206
+        headers, segments = plan
+    else:
+        status = 200
+        headers = full_content_headers(mime_type, file_size, mtime, etag)
+        segments = [(0, file_size)]
+    if layout is not None:
+        segments = layout.map_segments(segments)
+    stream = await asyncio.to_thread(open_viewer_stream, username, filename, movie)
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]
+    })
+    if scope['method'] == 'HEAD':
+        return await send({'type': 'http.response.body', 'body': b''})
+    try:
+        await send_segments(movie, segments, scope, receive, send, stream)
+    finally:
+        stream.close()
+
+
+async def send_segments(movie, segments, scope, receive, send, stream=None):
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    zerocopy = ZEROCOPY_EXTENSION in scope.get('extensions', {})
+    try:
+        with movie.open() as fd:
+            for segment in segments:
+                if disconnected.done():
+                    return
+                if isinstance(segment, bytes):
+                    if stream is not None:
+                        await asyncio.sleep(stream.reserve(len(segment)))
+                    await send({'type': 'http.response.body', 'body': segment, 'more_body': True})
+                    continue
+                offset, length = segment
+                if zerocopy:
+                    await send_zerocopy(send, fd, offset, length, disconnected, stream)
+                    continue
+                chunks = send_range(fd, movie.key, offset, length, stream=stream)
+                try:
+                    while not disconnected.done():
+                        chunk = await asyncio.to_thread(next, chunks, None)
+                        if chunk is None:
+                            break
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                finally:
+                    chunks.close()
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+
+
+async def send_zerocopy(send, fd, offset, length, disconnected, stream=None):
+    if stream is None or not stream.limited:
+        if stream is not None:
+            stream.reserve(length)
+        return await send({'type': ZEROCOPY_EXTENSION, 'file': fd, 'offset': offset,
+                           'count': length, 'more_body': True})
+    end = offset + length
+    while offset < end and not disconnected.done():
+        count = min(Config.STREAM_CHUNK_SIZE, end - offset)
+        delay = stream.reserve(count)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await send({'type': ZEROCOPY_EXTENSION, 'file': fd, 'offset': offset, 'count': count, 'more_body': True})
+        offset += count
+
+
+async def send_text(send, status, text, headers=None):
+    body = text.encode()
+    headers = dict(headers or {})
+    headers['Content-Type'] = 'text/html; charset=utf-8'
+    headers['Content-Length'] = str(len(body))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def create_asgi_app(flask_app, app_logger):
+    from a2wsgi import WSGIMiddleware
+    wsgi_app = WSGIMiddleware(flask_app)
+
+    async def http_app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] == 'http' and scope['path'].startswith('/movies/') and scope['method'] in ('GET', 'HEAD'):
+            await serve_movie(flask_app, app_logger, scope, receive, send)
+            return
+        await wsgi_app(scope, receive, send)
+
+    sio = create_socket_server(flask_app, app_logger)
+    return socketio.ASGIApp(sio, other_asgi_app=http_app)
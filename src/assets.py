@@ -0,0 +1,165 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import mimetypes
+from flask import abort, request, send_file, url_for
+from src.config import Config
+
+# Only these folders are published; static/user holds the accounts file
+ASSET_DIRS = ('css', 'js', 'img')
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.svg', '.json', '.txt', '.html')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _load_brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _hashed_name(name, digest):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def source_assets(static_folder):
+    for folder in ASSET_DIRS:
+        root = os.path.join(static_folder, folder)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                if not filename.startswith('.'):
+                    path = os.path.join(dirpath, filename)
+                    yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def build_assets(static_folder, output_folder):
+    # Files are named after their content, so a build can run while another
+    # worker serves the previous one, and unchanged files are not rewritten
+    brotli = _load_brotli()
+    manifest = {}
+    for name, path in source_assets(static_folder):
+        with open(path, 'rb') as f:
+            data = f.read()
+        hashed = _hashed_name(name, hashlib.sha256(data).hexdigest()[:Config.ASSET_HASH_LENGTH])
+        manifest[name] = hashed
+        target = os.path.join(output_folder, hashed)
+        if os.path.exists(target):
+            continue
+        _write_atomic(target, data)
+        if name.endswith(COMPRESSIBLE_EXTENSIONS):
+            _write_atomic(f"{target}.gz", gzip.compress(data, 9, mtime=0))
+            if brotli is not None:
+                _write_atomic(f"{target}.br", brotli.compress(data, quality=11))
+    _write_atomic(os.path.join(output_folder, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def manifest_is_stale(static_folder, output_folder):
+    try:
+        built = os.stat(os.path.join(output_folder, 'manifest.json')).st_mtime
+    except OSError:
+        return True
+    return any(os.stat(path).st_mtime > built for _, path in source_assets(static_folder))
+
+
+class AssetManifest:
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self._files = {}
+        self._hashed = set()
+        self._mtime = None
+        self._checked = 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < Config.ASSET_MANIFEST_CHECK_INTERVAL:
+            return
+        self._checked = now
+        path = os.path.join(self.output_folder, 'manifest.json')
+        try:
+            mtime = os.stat(path).st_mtime
+            if mtime == self._mtime:
+                return
+            with open(path, 'r', encoding='utf-8') as f:
+                files = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._files = files
+        self._hashed = set(files.values())
+        self._mtime = mtime
+
+    def url(self, filename):
+        self._refresh()
+        hashed = self._files.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('serve_asset', filename=hashed)
+
+    def is_built(self, filename):
+        self._refresh()
+        return filename in self._hashed
+
+
+def _accepted_encodings():
+    accepted = request.accept_encodings
+    candidates = [(encoding, suffix) for encoding, suffix in ENCODINGS if accepted[encoding] > 0]
+    return sorted(candidates, key=lambda candidate: -accepted[candidate[0]])
+
+
+def setup_assets(app):
+    app.jinja_env.globals['asset_url'] = asset_manifest.url
+
+    @app.route('/assets/<path:filename>')
+    def serve_asset(filename):
+        if not asset_manifest.is_built(filename):
+            abort(404)
+        path = os.path.join(asset_manifest.output_folder, filename)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for candidate, suffix in _accepted_encodings():
+            if os.path.exists(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        try:
+            response = send_file(path, mimetype=mimetype, conditional=False, etag=False)
+        except FileNotFoundError:
+            abort(404)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+            response.vary.add('Accept-Encoding')
+        # The name changes whenever the content does, so the hash doubles as the ETag
+        response.set_etag(f"{os.path.splitext(filename)[0].rsplit('.', 1)[-1]}-{encoding or 'identity'}")
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response.make_conditional(request)
+
+
+def build_if_stale():
+    if manifest_is_stale(Config.ASSET_SOURCE_FOLDER, Config.ASSET_FOLDER):
+        manifest = build_assets(Config.ASSET_SOURCE_FOLDER, Config.ASSET_FOLDER)
+        logging.getLogger('MovieApp').info(f"Built {len(manifest)} static assets into {Config.ASSET_FOLDER}")
+
+
+asset_manifest = AssetManifest(Config.ASSET_FOLDER)
+
+
+if __name__ == '__main__':
+    built = build_assets(Config.ASSET_SOURCE_FOLDER, Config.ASSET_FOLDER)
+    if _load_brotli() is None:
+        print("Brotli is not installed; only gzip variants were written")
+    print(f"Wrote {len(built)} assets and manifest.json to {Config.ASSET_FOLDER}")
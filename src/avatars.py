@@ -0,0 +1,73 @@
+import os
+import time
+import threading
+from src.config import Config
+
+AVATAR_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+class Avatar:
+    __slots__ = ('filename', 'size', 'mtime', 'etag')
+
+    def __init__(self, filename, size, mtime_ns):
+        self.filename = filename
+        self.size = size
+        self.mtime = mtime_ns / 1e9
+        self.etag = f"{mtime_ns:x}-{size:x}"
+
+
+class AvatarRegistry:
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._avatars = {}
+        self._last_check = None
+
+    def refresh(self):
+        # Every file is stat'ed: replacing an avatar in place changes its
+        # mtime and size but not the folder's mtime
+        avatars = {}
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    username, ext = os.path.splitext(entry.name)
+                    ext = ext.lower()
+                    if ext not in AVATAR_EXTENSIONS or not entry.is_file():
+                        continue
+                    existing = avatars.get(username)
+                    if existing and AVATAR_EXTENSIONS.index(os.path.splitext(existing.filename)[1].lower()) <= AVATAR_EXTENSIONS.index(ext):
+                        continue
+                    stat_result = entry.stat()
+                    avatars[username] = Avatar(entry.name, stat_result.st_size, stat_result.st_mtime_ns)
+        except OSError:
+            pass
+        self._avatars = avatars
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < Config.AVATAR_REFRESH_INTERVAL:
+            return
+        with self._lock:
+            if self._last_check is not None and now - self._last_check < Config.AVATAR_REFRESH_INTERVAL:
+                return
+            self.refresh()
+            self._last_check = now
+
+    def get(self, username):
+        self._ensure_fresh()
+        return self._avatars.get(username)
+
+    def get_url(self, username):
+        avatar = self.get(username)
+        if avatar is None:
+            return None
+        return f"/avatars/{username}?v={avatar.etag}"
+
+    def get_display(self, username):
+        avatar_url = self.get_url(username)
+        if avatar_url:
+            return avatar_url
+        return Config.USER_AVATARS.get(username, Config.USER_AVATARS['default'])
+
+
+avatar_registry = AvatarRegistry(Config.AVATAR_FOLDER)
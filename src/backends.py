@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import sqlite3
+import threading
+from contextlib import contextmanager
+from src.config import Config
+
+
+class RingBuffer:
+    # Fixed-capacity log addressed by a sequence number that keeps growing,
+    # so the slot of any item, and of any item id, is found without a scan.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._index = {}
+        self._next_seq = 1
+
+    def __len__(self):
+        return self._next_seq - self._oldest_seq()
+
+    def _oldest_seq(self):
+        return max(1, self._next_seq - self.capacity)
+
+    def append(self, item):
+        seq = self._next_seq
+        self._next_seq += 1
+        slot = seq % self.capacity
+        evicted = self._slots[slot]
+        if evicted is not None:
+            self._index.pop(evicted.get('id'), None)
+        item = dict(item, seq=seq)
+        self._slots[slot] = item
+        if item.get('id') is not None:
+            self._index[item['id']] = seq
+        return item
+
+    def get(self, item_id):
+        seq = self._index.get(item_id)
+        return None if seq is None else self._slots[seq % self.capacity]
+
+    def page(self, before=None, limit=None):
+        oldest = self._oldest_seq()
+        end = self._next_seq if before is None else max(oldest, min(before, self._next_seq))
+        start = max(oldest, end - limit) if limit else oldest
+        return [self._slots[seq % self.capacity] for seq in range(start, end)], start > oldest
+
+    def items(self):
+        return self.page()[0]
+
+
+class MemoryBackend:
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rooms = {}
+        self._docs = {}
+        self._logs = {}
+
+    def add_room(self, room):
+        with self._lock:
+            if room in self._rooms:
+                return False
+            self._rooms[room] = time.time()
+            return True
+
+    def has_room(self, room):
+        return room in self._rooms
+
+    def heartbeat(self):
+        pass
+
+    def rooms(self):
+        return list(self._rooms)
+
+    def touch_room(self, room):
+        if room in self._rooms:
+            self._rooms[room] = time.time()
+
+    def room_updated_at(self, room):
+        return self._rooms.get(room)
+
+    def delete_room(self, room):
+        with self._lock:
+            self._rooms.pop(room, None)
+            for store in (self._docs, self._logs):
+                for key in [k for k in store if k[0] == room]:
+                    del store[key]
+
+    def get(self, room, key, default=None):
+        return self._docs.get((room, key), default)
+
+    def update(self, room, key, fn, default=None):
+        with self._lock:
+            value = fn(self._docs.get((room, key), default))
+            self._docs[(room, key)] = value
+            return value
+
+    def append(self, room, key, item, max_items):
+        with self._lock:
+            log = self._logs.get((room, key))
+            if log is None:
+                log = self._logs[(room, key)] = RingBuffer(max_items)
+            return log.append(item)
+
+    def items(self, room, key):
+        with self._lock:
+            log = self._logs.get((room, key))
+            return log.items() if log is not None else []
+
+    def page(self, room, key, before=None, limit=None):
+        with self._lock:
+            log = self._logs.get((room, key))
+            return log.page(before, limit) if log is not None else ([], False)
+
+    def update_item(self, room, key, item_id, fn):
+        with self._lock:
+            log = self._logs.get((room, key))
+            item = log.get(item_id) if log is not None else None
+            return fn(item) if item is not None else None
+
+
+def _pid_alive(pid):
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SQLiteBackend:
+    # Users, typing and presence describe live connections. They are dropped
+    # when a worker starts and finds no other live worker, so a restart does
+    # not bring back users who are long gone; playback and chat are kept.
+    shared = True
+    CONNECTION_KEYS = ('users', 'typing', 'presence')
+
+    def __init__(self, path):
+        self.path = path
+        self.worker_id = uuid.uuid4().hex
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS rooms (name TEXT PRIMARY KEY, updated_at REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS docs (room TEXT, key TEXT, value TEXT, PRIMARY KEY (room, key))')
+            conn.execute('CREATE TABLE IF NOT EXISTS logs (seq INTEGER PRIMARY KEY AUTOINCREMENT, room TEXT, key TEXT, item_id TEXT, value TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS logs_room_key ON logs (room, key, seq)')
+            conn.execute('CREATE INDEX IF NOT EXISTS logs_item ON logs (room, key, item_id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, pid INTEGER, seen REAL)')
+            if not self._prune_workers(conn):
+                placeholders = ', '.join('?' for _ in self.CONNECTION_KEYS)
+                conn.execute(f'DELETE FROM docs WHERE key IN ({placeholders})', self.CONNECTION_KEYS)
+                conn.execute("DELETE FROM logs WHERE key = 'reactions'")
+            conn.execute('INSERT INTO workers (id, pid, seen) VALUES (?, ?, ?)', (self.worker_id, os.getpid(), time.time()))
+        atexit.register(self._unregister)
+
+    def _prune_workers(self, conn):
+        # A row whose process is gone or that stopped checking in belongs to
+        # a worker that died without unregistering. Returns the live count.
+        now = time.time()
+        live = 0
+        for worker_id, pid, seen in conn.execute('SELECT id, pid, seen FROM workers').fetchall():
+            if worker_id == self.worker_id:
+                live += 1
+            elif now - seen > Config.WORKER_TIMEOUT or pid == os.getpid() or not _pid_alive(pid):
+                conn.execute('DELETE FROM workers WHERE id = ?', (worker_id,))
+            else:
+                live += 1
+        return live
+
+    def heartbeat(self):
+        with self._transaction() as conn:
+            self._prune_workers(conn)
+            conn.execute('INSERT OR REPLACE INTO workers (id, pid, seen) VALUES (?, ?, ?)',
+                         (self.worker_id, os.getpid(), time.time()))
+
+    def _unregister(self):
+        try:
+            with self._transaction() as conn:
+                conn.execute('DELETE FROM workers WHERE id = ?', (self.worker_id,))
+        except sqlite3.Error:
+            pass
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=Config.STATE_DB_TIMEOUT, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        local = self._local
+        if local.depth == 0:
+            conn.execute('BEGIN IMMEDIATE')
+        local.depth += 1
+        try:
+            yield conn
+        except Exception:
+            local.depth -= 1
+            if local.depth == 0:
+                conn.execute('ROLLBACK')
+            raise
+        local.depth -= 1
+        if local.depth == 0:
+            conn.execute('COMMIT')
+
+    def add_room(self, room):
+        with self._transaction() as conn:
+            cursor = conn.execute('INSERT OR IGNORE INTO rooms (name, updated_at) VALUES (?, ?)', (room, time.time()))
+            return cursor.rowcount == 1
+
+    def has_room(self, room):
+        return self._connection().execute('SELECT 1 FROM rooms WHERE name = ?', (room,)).fetchone() is not None
+
+    def rooms(self):
+        return [row[0] for row in self._connection().execute('SELECT name FROM rooms ORDER BY rowid')]
+
+    def touch_room(self, room):
+        with self._transaction() as conn:
+            conn.execute('UPDATE rooms SET updated_at = ? WHERE name = ?', (time.time(), room))
+
+    def room_updated_at(self, room):
+        row = self._connection().execute('SELECT updated_at FROM rooms WHERE name = ?', (room,)).fetchone()
+        return row[0] if row else None
+
+    def delete_room(self, room):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM rooms WHERE name = ?', (room,))
+            conn.execute('DELETE FROM docs WHERE room = ?', (room,))
+            conn.execute('DELETE FROM logs WHERE room = ?', (room,))
+
+    def get(self, room, key, default=None):
+        row = self._connection().execute('SELECT value FROM docs WHERE room = ? AND key = ?', (room, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def update(self, room, key, fn, default=None):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT value FROM docs WHERE room = ? AND key = ?', (room, key)).fetchone()
+            value = fn(json.loads(row[0]) if row else default)
+            conn.execute('INSERT OR REPLACE INTO docs (room, key, value) VALUES (?, ?, ?)', (room, key, json.dumps(value)))
+            return value
+
+    def append(self, room, key, item, max_items):
+        with self._transaction() as conn:
+            cursor = conn.execute('INSERT INTO logs (room, key, item_id, value) VALUES (?, ?, ?, ?)',
+                                  (room, key, item.get('id'), json.dumps(item)))
+            conn.execute('DELETE FROM logs WHERE room = ? AND key = ? AND seq <= '
+                         '(SELECT seq FROM logs WHERE room = ? AND key = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)',
+                         (room, key, room, key, max_items))
+            return dict(item, seq=cursor.lastrowid)
+
+    def items(self, room, key):
+        rows = self._connection().execute('SELECT seq, value FROM logs WHERE room = ? AND key = ? ORDER BY seq', (room, key))
+        return [dict(json.loads(value), seq=seq) for seq, value in rows]
+
+    def page(self, room, key, before=None, limit=None):
+        query = 'SELECT seq, value FROM logs WHERE room = ? AND key = ?'
+        params = [room, key]
+        if before is not None:
+            query += ' AND seq < ?'
+            params.append(before)
+        query += ' ORDER BY seq DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+        rows = self._connection().execute(query, params).fetchall()
+        has_more = bool(limit) and len(rows) > limit
+        rows = rows[:limit] if limit else rows
+        return [dict(json.loads(value), seq=seq) for seq, value in reversed(rows)], has_more
+
+    def update_item(self, room, key, item_id, fn):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT seq, value FROM logs WHERE room = ? AND key = ? AND item_id = ?',
+                               (room, key, item_id)).fetchone()
+            if row is None:
+                return None
+            item = fn(json.loads(row[1]))
+            conn.execute('UPDATE logs SET value = ? WHERE seq = ?', (json.dumps(item), row[0]))
+            return dict(item, seq=row[0])
+
+
+def create_backend():
+    if Config.STATE_BACKEND == 'sqlite':
+        return SQLiteBackend(Config.STATE_DB_PATH)
+    return MemoryBackend()
+
+
+state_backend = create_backend()
@@ -0,0 +1,153 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from src.config import Config
+
+FADVISE_AVAILABLE = hasattr(os, 'posix_fadvise')
+
+
+def read_block(fd, offset, size):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+class BlockCache:
+    # Viewers of a room request nearly the same ranges at nearly the same
+    # time, so blocks are shared between streams and a block that is being
+    # read is waited for instead of being read again.
+    def __init__(self, max_bytes, block_size, readahead_blocks):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.readahead_blocks = readahead_blocks
+        self.enabled = max_bytes >= block_size > 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._size = 0
+        self._loading = {}
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=256)
+        self._queued = set()
+        self._worker = None
+
+    @staticmethod
+    def file_key(file_path, stat_result):
+        return os.path.realpath(file_path), stat_result.st_size, stat_result.st_mtime_ns
+
+    def _store(self, cache_key, block):
+        if cache_key in self._blocks:
+            return
+        self._blocks[cache_key] = block
+        self._size += len(block)
+        while self._size > self.max_bytes and self._blocks:
+            _, evicted = self._blocks.popitem(last=False)
+            self._size -= len(evicted)
+
+    def get_block(self, key, fd, block_no):
+        cache_key = (key, block_no)
+        while True:
+            with self._lock:
+                block = self._blocks.get(cache_key)
+                if block is not None:
+                    self._blocks.move_to_end(cache_key)
+                    self.hits += 1
+                    return block
+                event = self._loading.get(cache_key)
+                loading = event is None
+                if loading:
+                    event = self._loading[cache_key] = threading.Event()
+            if not loading:
+                # Another stream is reading this block; if it fails we retry
+                event.wait()
+                continue
+            try:
+                block = read_block(fd, block_no * self.block_size, self.block_size)
+                with self._lock:
+                    self.misses += 1
+                    self._store(cache_key, block)
+                return block
+            finally:
+                with self._lock:
+                    self._loading.pop(cache_key, None)
+                event.set()
+
+    def iter_range(self, fd, key, start, length):
+        self._recent[key[0]] = time.monotonic()
+        position = start
+        end = start + length
+        while position < end:
+            block_no = position // self.block_size
+            block = self.get_block(key, fd, block_no)
+            if not block:
+                break
+            if self.readahead_blocks:
+                self.prefetch(key[0], (block_no + 1) * self.block_size, self.readahead_blocks * self.block_size)
+            within = position - block_no * self.block_size
+            take = min(len(block) - within, end - position)
+            if take <= 0:
+                break
+            yield block if within == 0 and take == len(block) else block[within:within + take]
+            position += take
+
+    def prefetch(self, file_path, offset, length):
+        if not self.enabled:
+            return
+        first = offset // self.block_size
+        last = (offset + length - 1) // self.block_size
+        job = (file_path, first, last)
+        with self._lock:
+            if job in self._queued:
+                return
+            self._queued.add(job)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run_prefetch, daemon=True)
+                self._worker.start()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._queued.discard(job)
+
+    def _run_prefetch(self):
+        while True:
+            job = self._queue.get()
+            file_path, first, last = job
+            try:
+                self._prefetch_blocks(file_path, first, last)
+            except OSError as e:
+                logging.warning(f"Read-ahead failed for {file_path}: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(job)
+
+    def _prefetch_blocks(self, file_path, first, last):
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            stat_result = os.fstat(fd)
+            # Streams sent with sendfile never pass through the block cache;
+            # for those warming the page cache is enough
+            if FADVISE_AVAILABLE:
+                os.posix_fadvise(fd, first * self.block_size, (last - first + 1) * self.block_size,
+                                 os.POSIX_FADV_WILLNEED)
+            key = self.file_key(file_path, stat_result)
+            if time.monotonic() - self._recent.get(key[0], 0) > Config.BLOCK_CACHE_RECENT_WINDOW:
+                return
+            last = min(last, (stat_result.st_size - 1) // self.block_size)
+            for block_no in range(first, last + 1):
+                if (key, block_no) not in self._blocks:
+                    self.get_block(key, fd, block_no)
+        finally:
+            os.close(fd)
+
+    def stats(self):
+        with self._lock:
+            return {'blocks': len(self._blocks), 'bytes': self._size, 'hits': self.hits, 'misses': self.misses}
+
+
+block_cache = BlockCache(Config.BLOCK_CACHE_SIZE, Config.BLOCK_CACHE_BLOCK_SIZE, Config.STREAM_READAHEAD_BLOCKS)
@@ -0,0 +1,79 @@
+import os
+import json
+import threading
+from src.config import Config
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ChatArchive:
+    # One append-only JSON-lines file per room. New messages and reaction
+    # changes are both written as a full copy of the message, so the newest
+    # record for an id always wins and restoring only needs the file's tail.
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def _path(self, room):
+        return os.path.join(self.folder, f"{room}.jsonl")
+
+    def append(self, room, op, message):
+        message = {k: v for k, v in message.items() if k != 'seq'}
+        line = json.dumps({'op': op, 'message': message}) + '\n'
+        with self._lock:
+            f = self._files.get(room)
+            if f is None:
+                os.makedirs(self.folder, exist_ok=True)
+                f = self._files[room] = open(self._path(room), 'a', encoding='utf-8')
+            f.write(line)
+            f.flush()
+
+    def _reverse_lines(self, room):
+        try:
+            f = open(self._path(room), 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            tail = b''
+            while position > 0:
+                size = min(READ_BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + tail).split(b'\n')
+                tail = lines.pop(0)
+                for line in reversed(lines):
+                    if line:
+                        yield line
+            if tail:
+                yield tail
+
+    def load(self, room, limit):
+        latest = {}
+        added = []
+        for line in self._reverse_lines(room):
+            try:
+                record = json.loads(line)
+                message = record['message']
+            except (ValueError, KeyError, TypeError):
+                continue
+            message_id = message.get('id')
+            if message_id not in latest:
+                latest[message_id] = message
+            if record.get('op') == 'add':
+                added.append(message_id)
+                if len(added) >= limit:
+                    break
+        return [latest[message_id] for message_id in reversed(added)]
+
+    def close(self, room=None):
+        with self._lock:
+            rooms = list(self._files) if room is None else [room]
+            for name in rooms:
+                f = self._files.pop(name, None)
+                if f is not None:
+                    f.close()
+
+
+chat_archive = ChatArchive(Config.CHAT_LOG_FOLDER) if Config.CHAT_LOG_ENABLED else None
@@ -16,12 +16,93 @@ class Config:
 
     DEBUG = get_bool_env('DEBUG', False)
     VPN_DETECTION_ENABLED = get_bool_env('VPN_DETECTION_ENABLED', False)
+    VPN_DETECTION_MODE = os.getenv('VPN_DETECTION_MODE', 'online').lower()
+    VPN_CIDR_FILE = os.path.join(BASE_DIR, os.getenv('VPN_CIDR_FILE', 'vpn_ranges.txt'))
+    VPN_CIDR_RELOAD_INTERVAL = 60
+    VPN_CACHE_TTL = float(os.getenv('VPN_CACHE_TTL', 24 * 3600))
+    VPN_NEGATIVE_CACHE_TTL = float(os.getenv('VPN_NEGATIVE_CACHE_TTL', 3600))
+    VPN_ERROR_CACHE_TTL = 60
+    VPN_CACHE_SIZE = 10000
+    VPN_LOOKUP_WORKERS = 4
     MOVIE_FOLDER = os.path.join(BASE_DIR, os.getenv('MOVIE_FOLDER', 'movies'))
     AVATAR_FOLDER = os.path.join(BASE_DIR, os.getenv('AVATAR_FOLDER', 'pfp'))
     USERS_FILE = os.path.join(BASE_DIR, os.getenv('USERS_FILE', 'static/user/acc.json'))
     MAX_CHAT_MESSAGES = 100
     MAX_REACTIONS = 50
+    REACTION_WINDOW = float(os.getenv('REACTION_WINDOW', 0.5))
+    REACTION_MAX_USERS = 10
+    REACTION_MAX_EMOJI_LENGTH = 16
+    REACTION_TIMELINE_RESOLUTION = float(os.getenv('REACTION_TIMELINE_RESOLUTION', 1))
+    REACTION_MAX_VIDEO_TIME = 24 * 3600
     MIN_SAVE_TIME = 10
+    STREAM_USE_SENDFILE = get_bool_env('STREAM_USE_SENDFILE', True)
+    STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 256 * 1024))
+    STREAM_SENDFILE_CHUNK_SIZE = 4 * 1024 * 1024
+    STREAM_MAX_RANGES = 16
+    MOVIE_FILE_CACHE_SIZE = 1024
+    MOVIE_FD_CACHE_SIZE = int(os.getenv('MOVIE_FD_CACHE_SIZE', 64))
+    MOVIE_FILE_REVALIDATE_INTERVAL = float(os.getenv('MOVIE_FILE_REVALIDATE_INTERVAL', 2))
+    BLOCK_CACHE_SIZE = int(os.getenv('BLOCK_CACHE_MB', 128)) * 1024 * 1024
+    BLOCK_CACHE_BLOCK_SIZE = 1024 * 1024
+    BLOCK_CACHE_RECENT_WINDOW = 30
+    STREAM_READAHEAD_BLOCKS = int(os.getenv('STREAM_READAHEAD_BLOCKS', 4))
+    ROOM_READAHEAD_BYTES = int(os.getenv('ROOM_READAHEAD_MB', 16)) * 1024 * 1024
+    STREAM_TOTAL_MBPS = float(os.getenv('STREAM_TOTAL_MBPS', 0))
+    STREAM_SESSION_MBPS = float(os.getenv('STREAM_SESSION_MBPS', 0))
+    STREAM_ROOM_MBPS = float(os.getenv('STREAM_ROOM_MBPS', 0))
+    STREAM_BITRATE_MULTIPLE = float(os.getenv('STREAM_BITRATE_MULTIPLE', 0))
+    STREAM_BURST_SECONDS = float(os.getenv('STREAM_BURST_SECONDS', 2))
+    STREAM_ACTIVE_WINDOW = 2
+    LIBRARY_USE_INOTIFY = get_bool_env('LIBRARY_USE_INOTIFY', True)
+    LIBRARY_POLL_INTERVAL = float(os.getenv('LIBRARY_POLL_INTERVAL', 10))
+    AVATAR_REFRESH_INTERVAL = float(os.getenv('AVATAR_REFRESH_INTERVAL', 5))
+    AVATAR_CACHE_MAX_AGE = 365 * 24 * 3600
+    USER_AVATARS = {'default': '👤'}
+    PRESENCE_TICK_INTERVAL = float(os.getenv('PRESENCE_TICK_INTERVAL', 0.5))
+    DEFAULT_ROOM = os.getenv('DEFAULT_ROOM', 'movie_room')
+    MAX_ROOMS = int(os.getenv('MAX_ROOMS', 50))
+    ROOM_IDLE_TIMEOUT = float(os.getenv('ROOM_IDLE_TIMEOUT', 900))
+    ROOM_SWEEP_INTERVAL = 30
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory').lower()
+    STATE_DB_PATH = os.path.join(BASE_DIR, os.getenv('STATE_DB_PATH', 'syncinema_state.db'))
+    STATE_DB_TIMEOUT = 5
+    WORKER_TIMEOUT = 120
+    PROGRESS_DB_PATH = os.path.join(BASE_DIR, os.getenv('PROGRESS_DB_PATH', 'syncinema_progress.db'))
+    PROGRESS_FLUSH_INTERVAL = float(os.getenv('PROGRESS_FLUSH_INTERVAL', 15))
+    PUBSUB_POLL_INTERVAL = float(os.getenv('PUBSUB_POLL_INTERVAL', 0.02))
+    PUBSUB_RETENTION = 60
+    LIBRARY_PAGE_SIZE = 100
+    LIBRARY_MAX_PAGE_SIZE = 500
+    LIBRARY_CHANGE_HISTORY = int(os.getenv('LIBRARY_CHANGE_HISTORY', 64))
+    SERVER_MODE = os.getenv('SERVER_MODE', 'flask').lower()
+    CLOCK_MAX_EVENT_AGE = 2
+    MP4_FASTSTART = get_bool_env('MP4_FASTSTART', True)
+    MP4_INDEX_CACHE_SIZE = int(os.getenv('MP4_INDEX_CACHE_SIZE', 32))
+    MEDIA_INFO_CACHE_FILE = os.path.join(BASE_DIR, os.getenv('MEDIA_INFO_CACHE_FILE', 'media_info.json'))
+    MEDIA_PROBE_WORKERS = int(os.getenv('MEDIA_PROBE_WORKERS', 2))
+    MEDIA_INFO_SAVE_INTERVAL = 5
+    MEDIA_INFO_RECHECK_INTERVAL = int(os.getenv('MEDIA_INFO_RECHECK_INTERVAL', 60))
+    ASSET_SOURCE_FOLDER = os.path.join(BASE_DIR, 'static')
+    ASSET_FOLDER = os.path.join(BASE_DIR, os.getenv('ASSET_FOLDER', 'static/dist'))
+    ASSETS_BUILD_ON_START = get_bool_env('ASSETS_BUILD_ON_START', True)
+    ASSET_HASH_LENGTH = 12
+    ASSET_MANIFEST_CHECK_INTERVAL = 5
+    MP4_MAX_MOOV_SIZE = 64 * 1024 * 1024
+    SEEK_COALESCE_WINDOW = float(os.getenv('SEEK_COALESCE_WINDOW', 0.25))
+    CHAT_PAGE_SIZE = int(os.getenv('CHAT_PAGE_SIZE', 30))
+    CHAT_LOG_ENABLED = get_bool_env('CHAT_LOG_ENABLED', False)
+    CHAT_LOG_FOLDER = os.path.join(BASE_DIR, os.getenv('CHAT_LOG_FOLDER', 'chat_logs'))
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'color').lower()
+    LOG_QUEUE = get_bool_env('LOG_QUEUE', True)
+    LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', 5))
+    LOG_RATE_LIMIT_INTERVAL = float(os.getenv('LOG_RATE_LIMIT_INTERVAL', 10))
+    METRICS_ENABLED = get_bool_env('METRICS_ENABLED', False)
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    METRICS_MAX_SERIES = int(os.getenv('METRICS_MAX_SERIES', 256))
+    REQUEST_LOG_MAX_MOVIES = 256
+    WIRE_COMPACT_ENABLED = get_bool_env('WIRE_COMPACT_ENABLED', True)
+    WIRE_COMPRESS_MIN_BYTES = int(os.getenv('WIRE_COMPRESS_MIN_BYTES', 2048))
+    WIRE_COMPRESS_LEVEL = 6
     VIDEO_MIME_TYPES = {
         '.mp4': 'video/mp4',
         '.mkv': 'video/x-matroska',
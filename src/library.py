@@ -0,0 +1,280 @@
+import os
+import time
+import bisect
+import select
+import struct
+import logging
+import threading
+from collections import deque
+from src.config import Config
+
+PREFERRED_FORMATS = ('.mp4', '.webm', '.m4v', '.mkv')
+
+IN_MODIFY_MASK = 0x00000100 | 0x00000200 | 0x00000040 | 0x00000080 | 0x00000400 | 0x00000800
+IN_ONLYDIR = 0x01000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _load_inotify():
+    if not Config.LIBRARY_USE_INOTIFY or not hasattr(os, 'uname') or os.uname().sysname != 'Linux':
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class MovieLibrary:
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.RLock()
+        self._dirs = {}
+        self._movies = ()
+        self._path_index = []
+        self._name_index = []
+        self._loaded = False
+        self._last_refresh = 0
+        self._watcher = None
+        self._libc = None
+        self._inotify_fd = None
+        self._watches = {}
+        self._watch_dirs = {}
+        self.version = 0
+        self._changes = deque(maxlen=Config.LIBRARY_CHANGE_HISTORY)
+        self._listeners = []
+
+    def _scan_dir(self, rel_dir):
+        abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        files = set()
+        subdirs = set()
+        try:
+            mtime = os.stat(abs_dir).st_mtime
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.add(rel_path)
+                        elif entry.name.lower().endswith(Config.VIDEO_EXTENSIONS) and entry.is_file():
+                            files.add(rel_path)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return mtime, files, subdirs
+
+    def _update_dir(self, rel_dir):
+        result = self._scan_dir(rel_dir)
+        if result is None:
+            self._drop_dir(rel_dir)
+            return
+        mtime, files, subdirs = result
+        previous = self._dirs.get(rel_dir)
+        self._dirs[rel_dir] = (mtime, files, subdirs)
+        self._add_watch(rel_dir)
+        known_subdirs = previous[2] if previous else set()
+        for removed in known_subdirs - subdirs:
+            self._drop_dir(removed)
+        for added in subdirs - known_subdirs:
+            self._update_dir(added)
+
+    def _drop_dir(self, rel_dir):
+        entry = self._dirs.pop(rel_dir, None)
+        self._remove_watch(rel_dir)
+        if entry:
+            for subdir in entry[2]:
+                self._drop_dir(subdir)
+
+    def _rebuild_index(self):
+        all_files = set()
+        for _, files, _ in self._dirs.values():
+            all_files |= files
+        previous = set(self._movies)
+        supported = sorted(f for f in all_files if f.lower().endswith(PREFERRED_FORMATS))
+        other = sorted(f for f in all_files if not f.lower().endswith(PREFERRED_FORMATS))
+        movies = tuple(supported + other)
+        self._path_index = sorted((path.lower(), i) for i, path in enumerate(movies))
+        self._name_index = sorted((path.rsplit('/', 1)[-1].lower(), i) for i, path in enumerate(movies))
+        self._movies = movies
+        added = all_files - previous
+        removed = previous - all_files
+        if added or removed or not self._loaded:
+            # Seeded from the clock so a restarted worker does not hand out
+            # a version a client already holds for a different listing
+            previous_version = self.version
+            self.version = max(self.version + 1, int(time.time() * 1000))
+            if self._loaded:
+                self._changes.append((previous_version, self.version, added, removed))
+                logging.getLogger('MovieApp').info(f"Library updated: {len(added)} added, {len(removed)} removed ({len(movies)} total)")
+            else:
+                self._changes.clear()
+        return added, removed
+
+    def refresh(self, rel_dirs=None):
+        with self._lock:
+            if not os.path.isdir(self.root):
+                self._dirs.clear()
+            elif not self._dirs:
+                self._update_dir('')
+            else:
+                targets = rel_dirs if rel_dirs is not None else list(self._dirs)
+                for rel_dir in targets:
+                    entry = self._dirs.get(rel_dir)
+                    if entry is None:
+                        continue
+                    abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+                    try:
+                        mtime = os.stat(abs_dir).st_mtime
+                    except OSError:
+                        mtime = None
+                    if rel_dirs is not None or mtime != entry[0]:
+                        self._update_dir(rel_dir)
+            previous_version = self.version
+            was_loaded = self._loaded
+            added, removed = self._rebuild_index()
+            self._loaded = True
+            self._last_refresh = time.monotonic()
+            version = self.version
+        if was_loaded and (added or removed):
+            for listener in self._listeners:
+                try:
+                    listener(previous_version, version, sorted(added), sorted(removed))
+                except Exception as e:
+                    logging.getLogger('MovieApp').error(f"Library listener failed: {e}")
+        return added, removed
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def changes_since(self, version):
+        # Net additions and removals since the given version, or None when
+        # it is older than the kept history and the client needs the full list
+        self._ensure_fresh()
+        with self._lock:
+            if version == self.version:
+                return self.version, [], []
+            entries = list(self._changes)
+            start = next((i for i, entry in enumerate(entries) if entry[0] == version), None)
+            if start is None:
+                return None
+            added = set()
+            removed = set()
+            for _, _, entry_added, entry_removed in entries[start:]:
+                for path in entry_added:
+                    if path in removed:
+                        removed.discard(path)
+                    else:
+                        added.add(path)
+                for path in entry_removed:
+                    if path in added:
+                        added.discard(path)
+                    else:
+                        removed.add(path)
+            return self.version, sorted(added), sorted(removed)
+
+    def _ensure_fresh(self):
+        watching = self._watcher is not None and self._watcher.is_alive()
+        if not self._loaded or (not watching and time.monotonic() - self._last_refresh > Config.LIBRARY_POLL_INTERVAL):
+            self.refresh()
+
+    def get_movies(self):
+        self._ensure_fresh()
+        return list(self._movies)
+
+    def current_version(self):
+        self._ensure_fresh()
+        return self.version
+
+    def snapshot(self):
+        self._ensure_fresh()
+        with self._lock:
+            return self.version, list(self._movies)
+
+    def search(self, prefix='', offset=0, limit=None):
+        self._ensure_fresh()
+        with self._lock:
+            movies = self._movies
+            if prefix:
+                key = prefix.lower()
+                matches = set()
+                for index in (self._path_index, self._name_index):
+                    position = bisect.bisect_left(index, (key, -1))
+                    while position < len(index) and index[position][0].startswith(key):
+                        matches.add(index[position][1])
+                        position += 1
+                ordered = [movies[i] for i in sorted(matches)]
+            else:
+                ordered = movies
+        end = None if limit is None else offset + limit
+        return len(ordered), list(ordered[offset:end])
+
+    def _add_watch(self, rel_dir):
+        if self._inotify_fd is None or rel_dir in self._watch_dirs:
+            return
+        abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        wd = self._libc.inotify_add_watch(self._inotify_fd, os.fsencode(abs_dir), IN_MODIFY_MASK | IN_ONLYDIR)
+        if wd >= 0:
+            self._watches[wd] = rel_dir
+            self._watch_dirs[rel_dir] = wd
+
+    def _remove_watch(self, rel_dir):
+        wd = self._watch_dirs.pop(rel_dir, None)
+        if wd is not None:
+            self._libc.inotify_rm_watch(self._inotify_fd, wd)
+            self._watches.pop(wd, None)
+
+    def _read_inotify_events(self):
+        try:
+            buf = os.read(self._inotify_fd, 64 * 1024)
+        except OSError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(buf):
+            wd, _, _, name_len = INOTIFY_EVENT.unpack_from(buf, offset)
+            offset += INOTIFY_EVENT.size + name_len
+            if wd in self._watches:
+                changed.add(self._watches[wd])
+        return changed
+
+    def _watch_loop(self):
+        while True:
+            if self._inotify_fd is not None:
+                readable, _, _ = select.select([self._inotify_fd], [], [], Config.LIBRARY_POLL_INTERVAL)
+                if readable:
+                    # Let bursts of events (e.g. a copy in progress) settle before rescanning
+                    time.sleep(0.5)
+                    changed = self._read_inotify_events()
+                    with self._lock:
+                        changed = [d for d in changed if d in self._dirs]
+                    self.refresh(changed)
+                    continue
+            else:
+                time.sleep(Config.LIBRARY_POLL_INTERVAL)
+            # Network mounts do not deliver inotify events, so fall back to mtime polling
+            self.refresh()
+
+    def start_watching(self):
+        if self._watcher is not None:
+            return
+        self._libc = _load_inotify()
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._inotify_fd = fd
+        with self._lock:
+            self._dirs.clear()
+            self.refresh()
+        self._watcher = threading.Thread(target=self._watch_loop, name='library-watcher', daemon=True)
+        self._watcher.start()
+
+
+movie_library = MovieLibrary(Config.MOVIE_FOLDER)
@@ -1,8 +1,17 @@
+import copy
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 import colorama
 from colorama import Fore, Style
 import socket
-import requests
+from src.config import Config
 
 colorama.init(autoreset=True)
 
@@ -18,11 +27,91 @@ def get_network_ip():
 
 def get_external_ip():
     try:
+        import requests
         response = requests.get('https://api.ipify.org', timeout=3)
         return response.text
     except Exception:
         return "Unable to detect"
 
+class ColoredFormatter(logging.Formatter):
+    COLORS = {
+        'DEBUG': Fore.CYAN,
+        'INFO': Fore.GREEN,
+        'WARNING': Fore.YELLOW,
+        'ERROR': Fore.RED,
+        'CRITICAL': Fore.MAGENTA
+    }
+
+    def format(self, record):
+        # Other handlers share the record, so the colored level goes on a copy
+        colored = copy.copy(record)
+        colored.levelname = f"{self.COLORS.get(record.levelname, '')}{record.levelname}{Style.RESET_ALL}"
+        return super().format(colored)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    # Video players send a Range request every few seconds per viewer and
+    # each one logs the same lines, so identical messages below WARNING are
+    # let through a few times per interval and the rest are counted.
+    def __init__(self, limit, interval, max_keys=1024):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                self._windows.move_to_end(key)
+                if len(self._windows) > self.max_keys:
+                    self._windows.popitem(last=False)
+                if suppressed:
+                    record.suppressed = suppressed
+                    record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+                    record.args = None
+                return True
+            if window[1] < self.limit:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def create_formatter(log_format):
+    if log_format == 'json':
+        return JsonFormatter()
+    if log_format == 'plain':
+        return logging.Formatter('[%(asctime)s] %(levelname)s %(message)s', datefmt='%H:%M:%S')
+    return ColoredFormatter(
+        f'{Fore.BLUE}[%(asctime)s]{Style.RESET_ALL} %(levelname)s {Fore.WHITE}%(message)s{Style.RESET_ALL}',
+        datefmt='%H:%M:%S'
+    )
+
+
 def setup_logging():
     logging.getLogger('werkzeug').setLevel(logging.CRITICAL)
     logging.getLogger('socketio').setLevel(logging.CRITICAL)
@@ -33,61 +122,68 @@ def setup_logging():
     logger.setLevel(logging.INFO)
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
+    for log_filter in logger.filters[:]:
+        logger.removeFilter(log_filter)
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
-    class ColoredFormatter(logging.Formatter):
-        COLORS = {
-            'DEBUG': Fore.CYAN,
-            'INFO': Fore.GREEN,
-            'WARNING': Fore.YELLOW,
-            'ERROR': Fore.RED,
-            'CRITICAL': Fore.MAGENTA
-        }
-        def format(self, record):
-            color = self.COLORS.get(record.levelname, '')
-            record.levelname = f"{color}{record.levelname}{Style.RESET_ALL}"
-            return super().format(record)
-    formatter = ColoredFormatter(
-        f'{Fore.BLUE}[%(asctime)s]{Style.RESET_ALL} %(levelname)s {Fore.WHITE}%(message)s{Style.RESET_ALL}',
-        datefmt='%H:%M:%S'
-    )
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    console_handler.setFormatter(create_formatter(Config.LOG_FORMAT))
+    if Config.LOG_RATE_LIMIT > 0:
+        logger.addFilter(RateLimitFilter(Config.LOG_RATE_LIMIT, Config.LOG_RATE_LIMIT_INTERVAL))
+    if Config.LOG_QUEUE:
+        # Handlers run on the listener thread, so request and socket threads
+        # only pay for putting the record on the queue
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(QueueHandler(log_queue))
+    else:
+        logger.addHandler(console_handler)
     return logger
 
 class CustomRequestLogger:
     def __init__(self, logger):
         self.logger = logger
         self.ignored_paths = ['/socket.io/', '/static/', '/avatars/', '/favicon.ico']
-        self.movie_requests = {}
+        self.movie_requests = OrderedDict()
     def log_request(self, request, response):
         if any(ignored in request.path for ignored in self.ignored_paths):
             return
         if '/movies/' in request.path:
             movie_name = request.path.split('/movies/')[-1]
-            if movie_name not in self.movie_requests:
+            if movie_name in self.movie_requests:
+                self.movie_requests.move_to_end(movie_name)
+            else:
                 self.movie_requests[movie_name] = True
+                if len(self.movie_requests) > Config.REQUEST_LOG_MAX_MOVIES:
+                    self.movie_requests.popitem(last=False)
                 self.logger.info(f"Started streaming: {movie_name}")
             return
         if request.method == 'GET':
             if request.path == '/':
-                self.logger.info(f"User accessed main page")
+                self.logger.info("User accessed main page")
             elif request.path == '/login':
-                self.logger.info(f"Login page accessed")
+                self.logger.info("Login page accessed")
         elif request.method == 'POST':
             if request.path == '/login':
                 pass
 
 def display_startup_banner(config):
-    network_ip = get_network_ip()
-    external_ip = get_external_ip()
-    print(f"\n{Fore.CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{Style.RESET_ALL}")
+    print(f"\n{Fore.CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{Style.RESET_ALL}")
     print(f"{Fore.MAGENTA} SynCinema{Style.RESET_ALL}")
-    print(f"{Fore.CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{Style.RESET_ALL}")
+    print(f"{Fore.CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{Style.RESET_ALL}")
     print(f"{Fore.GREEN} Server starting on port {config.PORT}...{Style.RESET_ALL}")
     print(f"{Fore.YELLOW} Movies folder: {config.MOVIE_FOLDER}{Style.RESET_ALL}")
     print(f"{Fore.BLUE} Local: http://127.0.0.1:{config.PORT}{Style.RESET_ALL}")
+    print(f"{Fore.BLUE} Network and external addresses will be shown once detected{Style.RESET_ALL}")
+    print(f"{Fore.RED} Press CTRL+C to stop the server{Style.RESET_ALL}")
+    print("")
+    # The external address needs a request to ipify, which must not delay binding
+    threading.Thread(target=display_network_addresses, args=(config,), daemon=True).start()
+
+
+def display_network_addresses(config):
+    network_ip = get_network_ip()
     print(f"{Fore.BLUE} Network: http://{network_ip}:{config.PORT}{Style.RESET_ALL}")
+    external_ip = get_external_ip()
     print(f"{Fore.BLUE} External: http://{external_ip}:{config.PORT}{Style.RESET_ALL}")
-    print(f"{Fore.RED} Press CTRL+C to stop the server{Style.RESET_ALL}")
-    print("")
\ No newline at end of file
@@ -0,0 +1,196 @@
+import time
+import threading
+from src.config import Config
+from src.wire import WireManager, AsyncWireManager
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+OVERFLOW_LABEL = '_other'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        # Label values such as movie names come from the outside world, so the
+        # number of series is capped and the rest are folded into one.
+        key = tuple(str(value) for value in labels)
+        if key not in self._series and len(self._series) >= Config.METRICS_MAX_SERIES:
+            key = (OVERFLOW_LABEL,) * len(self.label_names)
+        return key
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            series = list(self._series.items())
+        for key, value in sorted(series):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _render_series(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.label_names, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge(Metric):
+    # Gauges describe current state, so they are read from a callback at
+    # scrape time instead of being updated on the hot path.
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=(), collect=None):
+        super().__init__(name, description, labels)
+        self.collect = collect
+
+    def render(self):
+        if self.collect is not None:
+            values = self.collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+            with self._lock:
+                self._series = {}
+                for labels, value in values.items():
+                    labels = labels if isinstance(labels, tuple) else (labels,)
+                    self._series[self._key(labels)] = value
+        return super().render()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name, description, labels=(), collect=None):
+        return self.register(Gauge(name, description, labels, collect))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+stream_bytes = registry.counter('syncinema_stream_bytes_total', 'Movie bytes sent to clients.', ('movie',))
+stream_latency = registry.histogram('syncinema_stream_first_byte_seconds',
+                                    'Time from a movie request to its first byte.', ('movie',))
+socket_events = registry.counter('syncinema_socket_events_total', 'Socket.IO events received.', ('event',))
+socket_event_latency = registry.histogram('syncinema_socket_event_seconds', 'Time spent handling Socket.IO events.',
+                                          ('event',))
+emit_fanout = registry.histogram('syncinema_emit_recipients', 'Clients reached by one emit.', ('event',),
+                                 FANOUT_BUCKETS)
+emit_latency = registry.histogram('syncinema_emit_seconds', 'Time spent delivering one emit to its recipients.',
+                                  ('event',))
+
+
+def metered_handler(event, handler):
+    def wrapper(ctx, data):
+        start = time.perf_counter()
+        try:
+            return handler(ctx, data)
+        finally:
+            socket_events.inc(event)
+            socket_event_latency.observe(time.perf_counter() - start, event)
+    return wrapper
+
+
+def count_recipients(manager, namespace, room, skip_sid):
+    if namespace not in manager.rooms:
+        return 0
+    skip = skip_sid if isinstance(skip_sid, list) else [skip_sid]
+    return sum(1 for sid, _ in manager.get_participants(namespace, room) if sid not in skip)
+
+
+def observe_emit(event, recipients, seconds):
+    emit_fanout.observe(recipients, event)
+    emit_latency.observe(seconds, event)
+
+
+class MeteredManager(WireManager):
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        start = time.perf_counter()
+        recipients = count_recipients(self, namespace, room, skip_sid)
+        super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs)
+        observe_emit(event, recipients, time.perf_counter() - start)
+
+
+class AsyncMeteredManager(AsyncWireManager):
+    async def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        start = time.perf_counter()
+        recipients = count_recipients(self, namespace, room, skip_sid)
+        await super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs)
+        observe_emit(event, recipients, time.perf_counter() - start)
@@ -0,0 +1,155 @@
+import os
+import stat
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from src.config import Config
+
+
+class MovieNotFound(Exception):
+    pass
+
+
+class AccessDenied(Exception):
+    pass
+
+
+def make_etag(file_size, mtime):
+    return f"{int(mtime * 1000):x}-{file_size:x}"
+
+
+def _identity(stat_result):
+    return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+class MovieFile:
+    def __init__(self, cache, filename, path, stat_result):
+        self.cache = cache
+        self.filename = filename
+        self.path = path
+        self.stat = stat_result
+        self.size = stat_result.st_size
+        self.mtime = stat_result.st_mtime
+        self.etag = make_etag(self.size, self.mtime)
+        self.key = (path, self.size, stat_result.st_mtime_ns)
+        self.identity = _identity(stat_result)
+        self.checked = time.monotonic()
+        self.fd = None
+        self.refs = 0
+        self.retired = False
+
+    @contextmanager
+    def open(self):
+        # The descriptor is shared by every response for this file; reads
+        # use pread, so nobody depends on the file position
+        fd = self.cache._acquire(self)
+        try:
+            yield fd
+        finally:
+            self.cache._release(self)
+
+
+class MovieFileCache:
+    # Players send a Range request every few seconds per viewer. Resolving
+    # and checking the path is done once per file and only repeated after
+    # MOVIE_FILE_REVALIDATE_INTERVAL, when a changed file gets a new entry.
+    def __init__(self, folder, max_entries, max_open, revalidate_interval):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_open = max_open
+        self.revalidate_interval = revalidate_interval
+        self._entries = OrderedDict()
+        self._open_count = 0
+        self._lock = threading.Lock()
+
+    def _resolve(self, filename):
+        root = os.path.realpath(self.folder)
+        real_path = os.path.realpath(os.path.join(root, filename))
+        if not real_path.startswith(root + os.sep):
+            raise AccessDenied(filename)
+        try:
+            stat_result = os.stat(real_path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise MovieNotFound(filename)
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise MovieNotFound(filename)
+        return real_path, stat_result
+
+    def get(self, filename):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and now - entry.checked < self.revalidate_interval:
+                self._entries.move_to_end(filename)
+                return entry
+        try:
+            real_path, stat_result = self._resolve(filename)
+        except (MovieNotFound, AccessDenied):
+            with self._lock:
+                stale = self._entries.pop(filename, None)
+                if stale is not None:
+                    self._retire(stale)
+            raise
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry.path == real_path and entry.identity == _identity(stat_result):
+                entry.checked = now
+                self._entries.move_to_end(filename)
+                return entry
+            if entry is not None:
+                self._retire(entry)
+            entry = self._entries[filename] = MovieFile(self, filename, real_path, stat_result)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._retire(evicted)
+            return entry
+
+    def _retire(self, entry):
+        entry.retired = True
+        if entry.refs == 0:
+            self._close(entry)
+
+    def _close(self, entry):
+        if entry.fd is not None:
+            os.close(entry.fd)
+            entry.fd = None
+            self._open_count -= 1
+
+    def _acquire(self, entry):
+        with self._lock:
+            if entry.fd is None:
+                fd = os.open(entry.path, os.O_RDONLY)
+                if _identity(os.fstat(fd)) != entry.identity:
+                    os.close(fd)
+                    raise OSError(f"{entry.path} changed while it was being served")
+                entry.fd = fd
+                self._open_count += 1
+            entry.refs += 1
+            self._close_idle()
+            return entry.fd
+
+    def _release(self, entry):
+        with self._lock:
+            entry.refs -= 1
+            if entry.refs == 0 and entry.retired:
+                self._close(entry)
+
+    def _close_idle(self):
+        # Least recently requested files give up their descriptors first;
+        # descriptors that responses are still reading from stay open
+        if self._open_count <= self.max_open:
+            return
+        for entry in list(self._entries.values()):
+            if entry.fd is not None and entry.refs == 0:
+                self._close(entry)
+                if self._open_count <= self.max_open:
+                    return
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'open': self._open_count}
+
+
+movie_files = MovieFileCache(Config.MOVIE_FOLDER, Config.MOVIE_FILE_CACHE_SIZE, Config.MOVIE_FD_CACHE_SIZE,
+                             Config.MOVIE_FILE_REVALIDATE_INTERVAL)
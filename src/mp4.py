@@ -0,0 +1,349 @@
+import os
+import sys
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from src.config import Config
+
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+CONTAINER_BOXES = {'moov', 'trak', 'mdia', 'minf', 'stbl', 'edts', 'dinf', 'mvex'}
+MAX_UINT32 = 0xFFFFFFFF
+
+
+class Mp4Error(Exception):
+    pass
+
+
+class Box:
+    __slots__ = ('type', 'children', 'payload')
+
+    def __init__(self, box_type, children=None, payload=b''):
+        self.type = box_type
+        self.children = children
+        self.payload = payload
+
+    def find(self, *path):
+        box = self
+        for box_type in path:
+            box = next((c for c in box.children or () if c.type == box_type), None)
+            if box is None:
+                return None
+        return box
+
+    def serialize(self):
+        if self.children is not None:
+            body = b''.join(child.serialize() for child in self.children)
+        else:
+            body = self.payload
+        size = len(body) + 8
+        if size > MAX_UINT32:
+            return struct.pack('>I4sQ', 1, self.type.encode('latin-1'), size + 8) + body
+        return struct.pack('>I4s', size, self.type.encode('latin-1')) + body
+
+
+def _read_header(data, offset, end):
+    if offset + 8 > end:
+        raise Mp4Error('truncated box header')
+    size, box_type = struct.unpack_from('>I4s', data, offset)
+    header_size = 8
+    if size == 1:
+        if offset + 16 > end:
+            raise Mp4Error('truncated box header')
+        size = struct.unpack_from('>Q', data, offset + 8)[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+    if size < header_size or offset + size > end:
+        raise Mp4Error(f'invalid size for box {box_type!r}')
+    return box_type.decode('latin-1'), size, header_size
+
+
+def parse_boxes(data, start, end):
+    boxes = []
+    while start < end:
+        box_type, size, header_size = _read_header(data, start, end)
+        if box_type in CONTAINER_BOXES:
+            boxes.append(Box(box_type, children=parse_boxes(data, start + header_size, start + size)))
+        else:
+            boxes.append(Box(box_type, payload=data[start + header_size:start + size]))
+        start += size
+    return boxes
+
+
+def scan_top_level(f, file_size):
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack_from('>I4s', header)
+        if size == 1:
+            if len(header) < 16:
+                raise Mp4Error('truncated box header')
+            size = struct.unpack_from('>Q', header, 8)[0]
+        elif size == 0:
+            size = file_size - offset
+        box_type = box_type.decode('latin-1')
+        if size < 8 or offset + size > file_size:
+            raise Mp4Error(f'invalid size for top-level box {box_type!r}')
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def _uint_array(typecode, payload, start, count):
+    values = array(typecode)
+    values.frombytes(bytes(payload[start:start + values.itemsize * count]))
+    if len(values) != count:
+        raise Mp4Error('truncated sample table')
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _full_box_count(box):
+    return struct.unpack_from('>I', box.payload, 4)[0]
+
+
+def read_chunk_offsets(stbl):
+    box = stbl.find('stco') or stbl.find('co64')
+    if box is None:
+        raise Mp4Error('track without chunk offsets')
+    return _uint_array('I' if box.type == 'stco' else 'Q', box.payload, 8, _full_box_count(box))
+
+
+def write_chunk_offsets(stbl, offsets):
+    box = stbl.find('stco') or stbl.find('co64')
+    wide = box.type == 'co64' or (offsets and max(offsets) > MAX_UINT32)
+    values = array('Q' if wide else 'I', offsets)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    box.type = 'co64' if wide else 'stco'
+    box.payload = box.payload[:4] + struct.pack('>I', len(offsets)) + values.tobytes()
+
+
+class Track:
+    def __init__(self, trak):
+        mdhd = trak.find('mdia', 'mdhd')
+        hdlr = trak.find('mdia', 'hdlr')
+        self.stbl = trak.find('mdia', 'minf', 'stbl')
+        if mdhd is None or hdlr is None or self.stbl is None:
+            raise Mp4Error('incomplete track')
+        version = mdhd.payload[0]
+        self.timescale = struct.unpack_from('>I', mdhd.payload, 20 if version == 1 else 12)[0] or 1
+        self.handler = bytes(hdlr.payload[8:12]).decode('latin-1')
+        self.chunk_offsets = read_chunk_offsets(self.stbl)
+
+        stsz = self.stbl.find('stsz')
+        stsc = self.stbl.find('stsc')
+        stts = self.stbl.find('stts')
+        if stsz is None or stsc is None or stts is None:
+            raise Mp4Error('incomplete sample table')
+        self.sample_size, self.sample_count = struct.unpack_from('>II', stsz.payload, 4)
+        self.sample_sizes = None if self.sample_size else _uint_array('I', stsz.payload, 12, self.sample_count)
+        self.sample_to_chunk = _uint_array('I', stsc.payload, 8, _full_box_count(stsc) * 3)
+        self.time_to_sample = _uint_array('I', stts.payload, 8, _full_box_count(stts) * 2)
+        stss = self.stbl.find('stss')
+        self.sync_samples = _uint_array('I', stss.payload, 8, _full_box_count(stss)) if stss else None
+
+    def duration(self):
+        ticks = sum(self.time_to_sample[i] * self.time_to_sample[i + 1] for i in range(0, len(self.time_to_sample), 2))
+        return ticks / self.timescale
+
+    def iter_chunks(self):
+        # Expands the stsc runs into (first sample number, sample count, file offset) per chunk
+        runs = self.sample_to_chunk
+        sample = 1
+        for run in range(0, len(runs), 3):
+            first_chunk = runs[run]
+            samples_per_chunk = runs[run + 1]
+            last_chunk = runs[run + 3] - 1 if run + 3 < len(runs) else len(self.chunk_offsets)
+            for chunk in range(first_chunk, last_chunk + 1):
+                if chunk > len(self.chunk_offsets):
+                    return
+                yield sample, samples_per_chunk, self.chunk_offsets[chunk - 1]
+                sample += samples_per_chunk
+
+    def keyframes(self):
+        sync = set(self.sync_samples) if self.sync_samples is not None else None
+        deltas = self.time_to_sample
+        run = 0
+        run_left = deltas[0] if deltas else 0
+        decode_time = 0
+        keyframes = []
+        last_time = None
+        for first_sample, count, offset in self.iter_chunks():
+            for sample in range(first_sample, first_sample + count):
+                if sample > self.sample_count:
+                    return keyframes
+                seconds = decode_time / self.timescale
+                # Without stss every sample is a sync sample; keep one per second
+                if (sync is None and (last_time is None or seconds - last_time >= 1)) or (sync is not None and sample in sync):
+                    keyframes.append((seconds, offset))
+                    last_time = seconds
+                offset += self.sample_size or self.sample_sizes[sample - 1]
+                while run_left == 0 and run + 2 < len(deltas):
+                    run += 2
+                    run_left = deltas[run]
+                if run_left:
+                    decode_time += deltas[run + 1]
+                    run_left -= 1
+        return keyframes
+
+
+class VirtualLayout:
+    # A file rearranged in memory: each segment is either a range of the
+    # original file or bytes held here (the rewritten moov).
+    def __init__(self, segments):
+        self.segments = []
+        self.starts = []
+        position = 0
+        for length, data, file_offset in segments:
+            if length <= 0:
+                continue
+            self.starts.append(position)
+            self.segments.append((position, length, data, file_offset))
+            position += length
+        self.size = position
+
+    def map_range(self, start, length):
+        pieces = []
+        index = bisect_right(self.starts, start) - 1
+        while length > 0 and index < len(self.segments):
+            segment_start, segment_length, data, file_offset = self.segments[index]
+            within = start - segment_start
+            take = min(segment_length - within, length)
+            if data is not None:
+                pieces.append(data[within:within + take])
+            else:
+                pieces.append((file_offset + within, take))
+            start += take
+            length -= take
+            index += 1
+        return pieces
+
+    def map_segments(self, segments):
+        mapped = []
+        for segment in segments:
+            if isinstance(segment, bytes):
+                mapped.append(segment)
+            else:
+                mapped.extend(self.map_range(segment[0], segment[1]))
+        return mapped
+
+
+class Mp4Index:
+    def __init__(self, file_size, mtime, boxes, moov, tracks, layout):
+        self.file_size = file_size
+        self.mtime = mtime
+        self.boxes = boxes
+        self.moov_offset, self.moov_size = moov
+        self.tracks = tracks
+        self.layout = layout
+        video = next((t for t in tracks if t.handler == 'vide'), None)
+        self.keyframes = video.keyframes() if video is not None else []
+        self._keyframe_times = [t for t, _ in self.keyframes]
+        self.duration = max((t.duration() for t in tracks), default=0)
+
+    def offset_for_time(self, seconds):
+        index = bisect_right(self._keyframe_times, seconds) - 1
+        if index < 0:
+            return None
+        return self.keyframes[index][1]
+
+    @classmethod
+    def build(cls, file_path, file_size, mtime):
+        with open(file_path, 'rb') as f:
+            boxes = scan_top_level(f, file_size)
+            moov = next(((offset, size) for box_type, offset, size in boxes if box_type == 'moov'), None)
+            if moov is None:
+                raise Mp4Error('no moov box')
+            if moov[1] > Config.MP4_MAX_MOOV_SIZE:
+                raise Mp4Error(f'moov box too large ({moov[1]} bytes)')
+            f.seek(moov[0])
+            data = f.read(moov[1])
+        tree = parse_boxes(data, 0, len(data))[0]
+        tracks = [Track(trak) for trak in tree.children if trak.type == 'trak']
+        layout = build_faststart_layout(boxes, moov, tree, tracks, file_size)
+        for track in tracks:
+            track.stbl = None
+        return cls(file_size, mtime, boxes, moov, tracks, layout)
+
+
+def build_faststart_layout(boxes, moov, tree, tracks, file_size):
+    types = {box_type for box_type, _, _ in boxes}
+    mdat_offsets = [offset for box_type, offset, _ in boxes if box_type == 'mdat']
+    # Fragmented files keep their moov up front already
+    if not mdat_offsets or 'moof' in types or moov[0] < min(mdat_offsets):
+        return None
+    first_mdat = min(mdat_offsets)
+    moov_offset, moov_size = moov
+    moov_end = moov_offset + moov_size
+    original_offsets = [list(track.chunk_offsets) for track in tracks]
+
+    # Chunk offsets depend on the rewritten moov's size, which changes when a
+    # table has to grow from stco to co64, so repeat until the size settles.
+    new_size = moov_size
+    for _ in range(3):
+        for track, offsets in zip(tracks, original_offsets):
+            write_chunk_offsets(track.stbl, [_shift_offset(o, first_mdat, moov_offset, moov_end, new_size) for o in offsets])
+        moov_data = tree.serialize()
+        if len(moov_data) == new_size:
+            break
+        new_size = len(moov_data)
+    else:
+        raise Mp4Error('could not settle the rewritten moov size')
+
+    return VirtualLayout([
+        (first_mdat, None, 0),
+        (new_size, moov_data, None),
+        (moov_offset - first_mdat, None, first_mdat),
+        (file_size - moov_end, None, moov_end)
+    ])
+
+
+def _shift_offset(offset, first_mdat, moov_offset, moov_end, new_size):
+    if first_mdat <= offset < moov_offset:
+        return offset + new_size
+    if offset >= moov_end:
+        return offset + new_size - (moov_end - moov_offset)
+    return offset
+
+
+class Mp4IndexCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path, stat_result):
+        if not file_path.lower().endswith(MP4_EXTENSIONS):
+            return None
+        key = os.path.realpath(file_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == (stat_result.st_size, stat_result.st_mtime):
+                self._entries.move_to_end(key)
+                return entry[1]
+        try:
+            index = Mp4Index.build(file_path, stat_result.st_size, stat_result.st_mtime)
+        except (Mp4Error, struct.error, IndexError, OSError) as e:
+            logging.warning(f"Could not index {file_path}: {e}")
+            index = None
+        with self._lock:
+            # Failures are cached as well so a broken file is not re-parsed on every range request
+            self._entries[key] = ((stat_result.st_size, stat_result.st_mtime), index)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def layout(self, file_path, stat_result):
+        index = self.get(file_path, stat_result)
+        return index.layout if index is not None else None
+
+
+mp4_index_cache = Mp4IndexCache(Config.MP4_INDEX_CACHE_SIZE)
@@ -0,0 +1,73 @@
+class PresenceBroadcaster:
+    def __init__(self, socketio, state, room):
+        self.socketio = socketio
+        self.state = state
+        self.room = room
+        self._dirty = False
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def is_dirty(self):
+        return self._dirty
+
+    def _current(self):
+        typing_users = self.state.typing_users
+        current = {}
+        for username, details in self.state.active_users.items():
+            entry = dict(details)
+            entry['typing'] = username in typing_users
+            current[username] = entry
+        return current
+
+    @staticmethod
+    def _diff(last, current):
+        joined = {u: d for u, d in current.items() if u not in last}
+        left = [u for u in last if u not in current]
+        changed = {}
+        for username, details in current.items():
+            previous = last.get(username)
+            if previous is None:
+                continue
+            fields = {k: v for k, v in details.items() if previous.get(k) != v}
+            if fields:
+                changed[username] = fields
+        return joined, left, changed
+
+    def flush(self):
+        self._dirty = False
+        result = {}
+
+        # The last broadcast snapshot and its version live in the state
+        # backend, so with a shared backend only the worker that actually
+        # advances the version emits the delta.
+        def apply(presence):
+            current = self._current()
+            joined, left, changed = self._diff(presence['users'], current)
+            if not (joined or left or changed):
+                return presence
+            version = presence['version'] + 1
+            result['delta'] = {
+                'version': version,
+                'joined': joined,
+                'left': left,
+                'changed': changed,
+                'count': len(current)
+            }
+            return {'version': version, 'users': current}
+
+        self.state.update_presence(apply)
+        if 'delta' in result:
+            self.socketio.emit('presence_delta', result['delta'], to=self.room)
+
+    def snapshot(self):
+        presence = self.state.get_presence()
+        users = presence['users']
+        return {
+            'users': list(users.keys()),
+            'count': len(users),
+            'user_details': users,
+            'typing_users': [u for u, d in users.items() if d['typing']],
+            'version': presence['version']
+        }
+
@@ -0,0 +1,445 @@
+import os
+import json
+import time
+import struct
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.config import Config
+from src.mp4 import scan_top_level, Mp4Error
+from src.library import movie_library
+
+MP4_PROBE_CONTAINERS = {'moov', 'trak', 'mdia', 'minf', 'stbl'}
+MP4_PROBE_BOXES = {'mvhd', 'tkhd', 'mdhd', 'hdlr', 'stsd'}
+MP4_MAX_PROBE_BOX = 64 * 1024
+MP4_CODECS = {
+    'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc', 'av01': 'av1', 'vp08': 'vp8', 'vp09': 'vp9',
+    'mp4v': 'mpeg4', 'mp4a': 'aac', 'ac-3': 'ac3', 'ec-3': 'eac3', 'Opus': 'opus', 'fLaC': 'flac', '.mp3': 'mp3'
+}
+
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_SEEKHEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+MKV_MAX_ELEMENT = 1024 * 1024
+EBML_MAX_HEADER = 4096
+MKV_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264', 'V_MPEGH/ISO/HEVC': 'hevc', 'V_VP8': 'vp8', 'V_VP9': 'vp9', 'V_AV1': 'av1',
+    'A_OPUS': 'opus', 'A_VORBIS': 'vorbis', 'A_AC3': 'ac3', 'A_EAC3': 'eac3', 'A_DTS': 'dts', 'A_FLAC': 'flac',
+    'A_MPEG/L3': 'mp3'
+}
+
+
+class ProbeError(Exception):
+    pass
+
+
+def _new_info(container):
+    return {'container': container, 'duration': None, 'bitrate': None, 'width': None, 'height': None,
+            'video_codec': None, 'audio_codec': None}
+
+
+def _iter_mp4_boxes(f, start, end):
+    # Reads box headers only; payloads are skipped by seeking past them
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise ProbeError(f'invalid size for box {box_type!r}')
+        yield box_type.decode('latin-1'), offset + header_size, size - header_size
+        offset += size
+
+
+def probe_mp4(f, file_size):
+    try:
+        top = scan_top_level(f, file_size)
+    except (Mp4Error, struct.error) as e:
+        raise ProbeError(str(e))
+    info = _new_info('mp4')
+    for box_type, offset, size in top:
+        if box_type == 'ftyp':
+            f.seek(offset + 8)
+            if f.read(4) == b'qt  ':
+                info['container'] = 'mov'
+    moov = next(((offset, size) for box_type, offset, size in top if box_type == 'moov'), None)
+    if moov is None:
+        raise ProbeError('no moov box')
+    track = {}
+
+    def walk(start, end):
+        for box_type, payload_offset, payload_size in _iter_mp4_boxes(f, start, end):
+            if box_type in MP4_PROBE_CONTAINERS:
+                if box_type == 'trak':
+                    track.clear()
+                walk(payload_offset, payload_offset + payload_size)
+                if box_type == 'trak':
+                    _finish_mp4_track(info, track)
+            elif box_type in MP4_PROBE_BOXES:
+                f.seek(payload_offset)
+                payload = f.read(min(payload_size, MP4_MAX_PROBE_BOX))
+                _read_mp4_box(info, track, box_type, payload)
+
+    walk(moov[0] + 8, moov[0] + moov[1])
+    return info
+
+
+def _read_mp4_box(info, track, box_type, payload):
+    version = payload[0] if payload else 0
+    if box_type == 'mvhd':
+        if version == 1:
+            timescale, duration = struct.unpack_from('>IQ', payload, 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', payload, 12)
+        if timescale and duration and duration != 0xFFFFFFFF:
+            info['duration'] = duration / timescale
+    elif box_type == 'tkhd':
+        # Display size in 16.16 fixed point at the end of the box
+        width, height = struct.unpack_from('>II', payload, len(payload) - 8)
+        track['width'], track['height'] = width >> 16, height >> 16
+    elif box_type == 'mdhd':
+        if version == 1:
+            timescale, duration = struct.unpack_from('>IQ', payload, 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', payload, 12)
+        if timescale:
+            track['duration'] = duration / timescale
+    elif box_type == 'hdlr':
+        track['handler'] = payload[8:12].decode('latin-1')
+    elif box_type == 'stsd' and len(payload) >= 16:
+        track['codec'] = payload[12:16].decode('latin-1')
+        if len(payload) >= 44:
+            track['coded_width'], track['coded_height'] = struct.unpack_from('>HH', payload, 40)
+
+
+def _finish_mp4_track(info, track):
+    codec = track.get('codec')
+    codec = MP4_CODECS.get(codec, codec)
+    if track.get('handler') == 'vide' and info['video_codec'] is None:
+        info['video_codec'] = codec
+        info['width'] = track.get('width') or track.get('coded_width')
+        info['height'] = track.get('height') or track.get('coded_height')
+    elif track.get('handler') == 'soun' and info['audio_codec'] is None:
+        info['audio_codec'] = codec
+    if not info['duration'] and track.get('duration'):
+        info['duration'] = track['duration']
+
+
+def _read_vint(f, keep_marker=False):
+    first = f.read(1)
+    if not first:
+        raise ProbeError('unexpected end of file')
+    value = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not value & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ProbeError('invalid EBML variable-length integer')
+    rest = f.read(length - 1)
+    if len(rest) != length - 1:
+        raise ProbeError('unexpected end of file')
+    if not keep_marker:
+        value &= mask - 1
+    unknown = value == mask - 1
+    for byte in rest:
+        value = (value << 8) | byte
+        unknown = unknown and byte == 0xFF
+    return value, length, unknown and not keep_marker
+
+
+def _read_element_header(f):
+    element_id, id_length, _ = _read_vint(f, keep_marker=True)
+    size, size_length, unknown = _read_vint(f)
+    return element_id, None if unknown else size, id_length + size_length
+
+
+def _iter_ebml(data):
+    # Walks the children of an element that has already been read into memory
+    offset = 0
+    while offset < len(data):
+        first = data[offset]
+        id_length = 1
+        while id_length <= 4 and not first & (0x80 >> (id_length - 1)):
+            id_length += 1
+        element_id = int.from_bytes(data[offset:offset + id_length], 'big')
+        offset += id_length
+        if offset >= len(data):
+            return
+        first = data[offset]
+        size_length = 1
+        while size_length <= 8 and not first & (0x80 >> (size_length - 1)):
+            size_length += 1
+        size = int.from_bytes(data[offset:offset + size_length], 'big') & ((1 << (7 * size_length)) - 1)
+        offset += size_length
+        yield element_id, data[offset:offset + size]
+        offset += size
+
+
+def _ebml_uint(data):
+    return int.from_bytes(data, 'big')
+
+
+def _ebml_float(data):
+    if len(data) == 4:
+        return struct.unpack('>f', data)[0]
+    if len(data) == 8:
+        return struct.unpack('>d', data)[0]
+    return None
+
+
+def probe_matroska(f, file_size):
+    element_id, size, header_length = _read_element_header(f)
+    if element_id != EBML_HEADER or size is None:
+        raise ProbeError('not an EBML file')
+    if size > EBML_MAX_HEADER:
+        raise ProbeError('EBML header too large')
+    header = f.read(size)
+    if len(header) != size:
+        raise ProbeError('unexpected end of file')
+    info = _new_info('matroska')
+    for child_id, value in _iter_ebml(header):
+        if child_id == EBML_DOCTYPE and value.rstrip(b'\0') == b'webm':
+            info['container'] = 'webm'
+    element_id, segment_size, _ = _read_element_header(f)
+    if element_id != MKV_SEGMENT:
+        raise ProbeError('no Matroska segment')
+    segment_start = f.tell()
+    segment_end = file_size if segment_size is None else min(file_size, segment_start + segment_size)
+    found = {}
+    seeks = {}
+    offset = segment_start
+    # Info and Tracks normally precede the first cluster; otherwise the
+    # SeekHead says where they are
+    while offset < segment_end and not (MKV_INFO in found and MKV_TRACKS in found):
+        f.seek(offset)
+        element_id, size, header_length = _read_element_header(f)
+        if element_id == MKV_CLUSTER or size is None:
+            break
+        if element_id in (MKV_SEEKHEAD, MKV_INFO, MKV_TRACKS) and size <= MKV_MAX_ELEMENT:
+            data = f.read(size)
+            if element_id == MKV_SEEKHEAD:
+                seeks.update(_read_seek_head(data))
+            else:
+                found[element_id] = data
+        offset += header_length + size
+    for element_id in (MKV_INFO, MKV_TRACKS):
+        if element_id not in found and element_id in seeks:
+            f.seek(segment_start + seeks[element_id])
+            seek_id, size, _ = _read_element_header(f)
+            if seek_id == element_id and size is not None and size <= MKV_MAX_ELEMENT:
+                found[element_id] = f.read(size)
+    if MKV_INFO in found:
+        _read_mkv_info(info, found[MKV_INFO])
+    if MKV_TRACKS in found:
+        _read_mkv_tracks(info, found[MKV_TRACKS])
+    return info
+
+
+def _read_seek_head(data):
+    seeks = {}
+    for element_id, seek in _iter_ebml(data):
+        if element_id != MKV_SEEK:
+            continue
+        fields = dict(_iter_ebml(seek))
+        if MKV_SEEK_ID in fields and MKV_SEEK_POSITION in fields:
+            seeks[_ebml_uint(fields[MKV_SEEK_ID])] = _ebml_uint(fields[MKV_SEEK_POSITION])
+    return seeks
+
+
+def _read_mkv_info(info, data):
+    fields = dict(_iter_ebml(data))
+    scale = _ebml_uint(fields[MKV_TIMECODE_SCALE]) if MKV_TIMECODE_SCALE in fields else 1000000
+    duration = _ebml_float(fields[MKV_DURATION]) if MKV_DURATION in fields else None
+    if duration:
+        info['duration'] = duration * scale / 1e9
+
+
+def _read_mkv_tracks(info, data):
+    for element_id, entry in _iter_ebml(data):
+        if element_id != MKV_TRACK_ENTRY:
+            continue
+        fields = dict(_iter_ebml(entry))
+        track_type = _ebml_uint(fields.get(MKV_TRACK_TYPE, b''))
+        codec_id = fields.get(MKV_CODEC_ID, b'').rstrip(b'\0').decode('ascii', 'replace')
+        codec = MKV_CODECS.get(codec_id) or ('aac' if codec_id.startswith('A_AAC') else codec_id[2:].lower() or None)
+        if track_type == 1 and info['video_codec'] is None:
+            info['video_codec'] = codec
+            video = dict(_iter_ebml(fields.get(MKV_VIDEO, b'')))
+            if MKV_PIXEL_WIDTH in video and MKV_PIXEL_HEIGHT in video:
+                info['width'] = _ebml_uint(video[MKV_PIXEL_WIDTH])
+                info['height'] = _ebml_uint(video[MKV_PIXEL_HEIGHT])
+        elif track_type == 2 and info['audio_codec'] is None:
+            info['audio_codec'] = codec
+
+
+def probe_file(file_path):
+    with open(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        magic = f.read(12)
+        f.seek(0)
+        if magic[:4] == b'\x1a\x45\xdf\xa3':
+            info = probe_matroska(f, file_size)
+        elif magic[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+            info = probe_mp4(f, file_size)
+        else:
+            raise ProbeError('unrecognized container')
+    if info['duration']:
+        info['bitrate'] = int(file_size * 8 / info['duration'])
+        info['duration'] = round(info['duration'], 3)
+    return info
+
+
+def format_media_info(info):
+    if not info:
+        return ''
+    parts = []
+    if info.get('duration'):
+        seconds = int(info['duration'])
+        hours, minutes = seconds // 3600, seconds // 60 % 60
+        parts.append(f"{hours}:{minutes:02d}:{seconds % 60:02d}" if hours else f"{minutes}:{seconds % 60:02d}")
+    if info.get('width') and info.get('height'):
+        parts.append(f"{info['width']}x{info['height']}")
+    codecs = '/'.join(codec for codec in (info.get('video_codec'), info.get('audio_codec')) if codec)
+    if codecs:
+        parts.append(codecs)
+    return ' · '.join(parts)
+
+
+class MediaProber:
+    # Results are kept in one JSON file keyed by movie along with the file's
+    # size and mtime, so restarts do not re-read every header. Lookups never
+    # touch the disk: files are stat'ed by the worker pool when the library
+    # reports a change and at most once per MEDIA_INFO_RECHECK_INTERVAL
+    # otherwise, which catches files replaced under the same name.
+    def __init__(self, root, cache_file, workers):
+        self.root = root
+        self.cache_file = cache_file
+        self.workers = workers
+        self._entries = {}
+        self._verified = {}
+        self._pending = set()
+        self._dirty = False
+        self._last_save = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._executor = None
+        self.version = 0
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable media info cache {self.cache_file}: {e}")
+
+    def _save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._last_save = time.monotonic()
+            data = json.dumps(self._entries, separators=(',', ':'))
+        tmp_path = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            logging.warning(f"Could not write media info cache {self.cache_file}: {e}")
+
+    def lookup(self, movies):
+        result = {}
+        missing = []
+        with self._lock:
+            self._load()
+            stale = time.monotonic() - Config.MEDIA_INFO_RECHECK_INTERVAL
+            for movie in movies:
+                entry = self._entries.get(movie)
+                if entry is not None:
+                    result[movie] = entry['info']
+                if self._verified.get(movie, stale) <= stale and movie not in self._pending:
+                    self._pending.add(movie)
+                    missing.append(movie)
+            if missing and self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='media-probe')
+        for movie in missing:
+            self._executor.submit(self._probe, movie)
+        return result
+
+    def library_changed(self, previous_version, version, added, removed):
+        # Added names may replace a file that was probed before
+        with self._lock:
+            for movie in added + removed:
+                if self._entries.pop(movie, None) is not None:
+                    self._dirty = True
+                    self.version += 1
+                self._verified.pop(movie, None)
+
+    def _probe(self, movie):
+        path = os.path.join(self.root, movie)
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._pending.discard(movie)
+                self._verified[movie] = time.monotonic()
+            return
+        key = [stat_result.st_size, stat_result.st_mtime_ns]
+        with self._lock:
+            entry = self._entries.get(movie)
+        if entry is not None and entry['key'] == key:
+            with self._lock:
+                self._pending.discard(movie)
+                self._verified[movie] = time.monotonic()
+            return
+        try:
+            info = probe_file(path)
+        except (ProbeError, struct.error, IndexError, ValueError, OSError) as e:
+            # Failures are cached too, until the file changes
+            logging.getLogger('MovieApp').warning(f"Could not probe {movie}: {e}")
+            info = None
+        with self._lock:
+            self._pending.discard(movie)
+            self._verified[movie] = time.monotonic()
+            self._entries[movie] = {'key': key, 'info': info}
+            self._dirty = True
+            self.version += 1
+            due = not self._pending or time.monotonic() - self._last_save >= Config.MEDIA_INFO_SAVE_INTERVAL
+        if due:
+            self._save()
+
+
+media_prober = MediaProber(Config.MOVIE_FOLDER, Config.MEDIA_INFO_CACHE_FILE, Config.MEDIA_PROBE_WORKERS)
+movie_library.add_listener(media_prober.library_changed)
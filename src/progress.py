@@ -0,0 +1,94 @@
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from src.config import Config
+from src.timeline import playback_time
+
+
+class WatchProgress:
+    # Heartbeats only update the pending map; a background thread writes
+    # whatever changed every PROGRESS_FLUSH_INTERVAL in one transaction, so
+    # a room full of viewers costs one small write per interval.
+    def __init__(self, path, flush_interval):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._worker = None
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=Config.STATE_DB_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS watch_progress (username TEXT, movie TEXT, position REAL, '
+                         'updated_at REAL, PRIMARY KEY (username, movie))')
+            self._conn = conn
+        return self._conn
+
+    def record(self, username, movie, position):
+        position = playback_time(position)
+        # Positions near the start are not worth resuming from, and must not
+        # overwrite a later one saved before someone restarted the movie
+        if not username or not movie or position is None or position < Config.MIN_SAVE_TIME:
+            return
+        with self._lock:
+            self._pending[(username, movie)] = (position, time.time())
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='progress-flush', daemon=True)
+                self._worker.start()
+
+    def get(self, username, movie):
+        with self._lock:
+            pending = self._pending.get((username, movie))
+        if pending is not None:
+            return pending[0]
+        try:
+            with self._conn_lock:
+                row = self._connection().execute('SELECT position FROM watch_progress WHERE username = ? AND movie = ?',
+                                                 (username, movie)).fetchone()
+        except sqlite3.Error as e:
+            logging.getLogger('MovieApp').warning(f"Could not read watch progress: {e}")
+            return 0
+        return row[0] if row else 0
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return
+        rows = [(username, movie, position, updated_at) for (username, movie), (position, updated_at) in pending.items()]
+        try:
+            with self._conn_lock:
+                conn = self._connection()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    # Another worker may have saved a newer position meanwhile
+                    conn.executemany('INSERT INTO watch_progress (username, movie, position, updated_at) '
+                                     'VALUES (?, ?, ?, ?) ON CONFLICT (username, movie) DO UPDATE SET '
+                                     'position = excluded.position, updated_at = excluded.updated_at '
+                                     'WHERE excluded.updated_at >= watch_progress.updated_at', rows)
+                    conn.execute('COMMIT')
+                except sqlite3.Error:
+                    conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            logging.getLogger('MovieApp').warning(f"Could not save watch progress: {e}")
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending.setdefault(key, value)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+watch_progress = WatchProgress(Config.PROGRESS_DB_PATH, Config.PROGRESS_FLUSH_INTERVAL)
+atexit.register(watch_progress.flush)
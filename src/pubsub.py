@@ -0,0 +1,107 @@
+import asyncio
+import time
+import pickle
+import sqlite3
+import threading
+import socketio
+from socketio.asyncio_pubsub_manager import AsyncPubSubManager
+from src.config import Config
+from src.metrics import count_recipients, observe_emit
+from src.wire import WireManager, AsyncWireManager
+
+
+def _observe_delivery(manager, message):
+    # Measured from publication, so the latency includes the trip through
+    # the database and the listener's polling delay
+    recipients = count_recipients(manager, message.get('namespace'), message.get('room'), message.get('skip_sid'))
+    return lambda: observe_emit(message['event'], recipients, time.time() - message.get('published_at', time.time()))
+
+
+class SQLitePubSubManager(socketio.PubSubManager, WireManager):
+    name = 'sqlite'
+
+    def __init__(self, path, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+        self._published = 0
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS pubsub (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'channel TEXT, payload BLOB, created_at REAL)')
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=Config.STATE_DB_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _publish(self, data):
+        now = time.time()
+        if data.get('method') == 'emit':
+            data = dict(data, published_at=now)
+        payload = pickle.dumps(data)
+        with self._publish_lock:
+            if self._publish_conn is None:
+                self._publish_conn = self._connect()
+            self._publish_conn.execute('INSERT INTO pubsub (channel, payload, created_at) VALUES (?, ?, ?)',
+                                       (self.channel, payload, now))
+            self._published += 1
+            if self._published % 500 == 0:
+                self._publish_conn.execute('DELETE FROM pubsub WHERE created_at < ?', (now - Config.PUBSUB_RETENTION,))
+
+    def _handle_emit(self, message):
+        observe = _observe_delivery(self, message)
+        super()._handle_emit(message)
+        observe()
+
+    def _listen(self):
+        conn = self._connect()
+        row = conn.execute('SELECT MAX(id) FROM pubsub').fetchone()
+        last_id = row[0] or 0
+        while True:
+            rows = conn.execute('SELECT id, payload FROM pubsub WHERE id > ? AND channel = ? ORDER BY id',
+                                (last_id, self.channel)).fetchall()
+            for message_id, payload in rows:
+                last_id = message_id
+                yield pickle.loads(payload)
+            if not rows:
+                self.server.sleep(Config.PUBSUB_POLL_INTERVAL)
+
+
+class AsyncSQLitePubSubManager(AsyncPubSubManager, AsyncWireManager):
+    name = 'sqlite'
+
+    def __init__(self, path, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        # SQLite calls block, so they run on worker threads and the event
+        # loop only awaits their results.
+        self._sync = SQLitePubSubManager(path, channel=channel, write_only=True, logger=logger)
+
+    async def _publish(self, data):
+        await asyncio.to_thread(self._sync._publish, data)
+
+    async def _handle_emit(self, message):
+        observe = _observe_delivery(self, message)
+        await super()._handle_emit(message)
+        observe()
+
+    async def _listen(self):
+        conn = await asyncio.to_thread(self._sync._connect)
+        last_id = await asyncio.to_thread(self._last_id, conn)
+        while True:
+            rows = await asyncio.to_thread(self._fetch, conn, last_id)
+            for message_id, payload in rows:
+                last_id = message_id
+                yield pickle.loads(payload)
+            if not rows:
+                await asyncio.sleep(Config.PUBSUB_POLL_INTERVAL)
+
+    @staticmethod
+    def _last_id(conn):
+        return conn.execute('SELECT MAX(id) FROM pubsub').fetchone()[0] or 0
+
+    def _fetch(self, conn, last_id):
+        return conn.execute('SELECT id, payload FROM pubsub WHERE id > ? AND channel = ? ORDER BY id',
+                            (last_id, self.channel)).fetchall()
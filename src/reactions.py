@@ -0,0 +1,101 @@
+import time
+import threading
+from datetime import datetime
+from src.config import Config
+from src.backends import state_backend
+
+TIMELINE_ROOM = '~reactions'
+
+
+class ReactionTimeline:
+    # Counts per emoji in fixed slices of video time, one document per movie
+    # in the state backend so every worker adds to the same timeline.
+    def __init__(self, backend, resolution):
+        self.backend = backend
+        self.resolution = resolution
+
+    def slot(self, video_time):
+        return int(video_time // self.resolution)
+
+    def add(self, movie, counts):
+        def apply(timeline):
+            timeline = dict(timeline)
+            for slot, emojis in counts.items():
+                merged = dict(timeline.get(str(slot), {}))
+                for emoji, count in emojis.items():
+                    merged[emoji] = merged.get(emoji, 0) + count
+                timeline[str(slot)] = merged
+            return timeline
+        self.backend.update(TIMELINE_ROOM, movie, apply, {})
+
+    def query(self, movie, start=None, end=None):
+        timeline = self.backend.get(TIMELINE_ROOM, movie, {})
+        first = None if start is None else self.slot(start)
+        last = None if end is None else self.slot(end)
+        buckets = []
+        for slot in sorted(int(key) for key in timeline):
+            if (first is not None and slot < first) or (last is not None and slot > last):
+                continue
+            buckets.append({'time': slot * self.resolution, 'reactions': timeline[str(slot)]})
+        return buckets
+
+
+class ReactionAggregator:
+    # Reactions are collected per emoji and broadcast once per window as a
+    # single new_reaction carrying the count and who reacted. The first
+    # reactor's fields stay at the top level for clients that predate counts.
+    def __init__(self, socketio, state, room):
+        self.socketio = socketio
+        self.state = state
+        self.room = room
+        self._pending = {}
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def add(self, username, avatar, emoji, video_time):
+        movie = self.state.playback_state.get('current_movie')
+        # Worked out before any counter changes, so a bad time cannot leave
+        # the broadcast count and the timeline disagreeing
+        slot = (movie, reaction_timeline.slot(video_time)) if movie else None
+        with self._lock:
+            if self._opened is None:
+                self._opened = time.monotonic()
+            bucket = self._pending.get(emoji)
+            if bucket is None:
+                bucket = self._pending[emoji] = {
+                    'username': username,
+                    'avatar': avatar,
+                    'emoji': emoji,
+                    'timestamp': datetime.now().strftime('%H:%M:%S'),
+                    'video_time': video_time,
+                    'count': 0,
+                    'users': [],
+                    'slots': {}
+                }
+            bucket['count'] += 1
+            if username not in bucket['users'] and len(bucket['users']) < Config.REACTION_MAX_USERS:
+                bucket['users'].append(username)
+            if slot is not None:
+                bucket['slots'][slot] = bucket['slots'].get(slot, 0) + 1
+
+    def is_due(self):
+        opened = self._opened
+        return opened is not None and time.monotonic() - opened >= Config.REACTION_WINDOW
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._opened = None
+        timeline = {}
+        for bucket in pending.values():
+            for (movie, slot), count in bucket.pop('slots').items():
+                emojis = timeline.setdefault(movie, {}).setdefault(slot, {})
+                emojis[bucket['emoji']] = emojis.get(bucket['emoji'], 0) + count
+            self.state.add_reaction(bucket)
+            self.socketio.emit('new_reaction', bucket, to=self.room)
+        for movie, counts in timeline.items():
+            reaction_timeline.add(movie, counts)
+
+
+reaction_timeline = ReactionTimeline(state_backend, Config.REACTION_TIMELINE_RESOLUTION)
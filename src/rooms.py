@@ -0,0 +1,198 @@
+import re
+import time
+import threading
+from src.config import Config
+from src.state import AppState, app_state
+from src.backends import state_backend
+from src.presence import PresenceBroadcaster
+from src.arbiter import ControlArbiter
+from src.reactions import ReactionAggregator
+from src.chat import chat_archive
+from src.timeline import position_at
+from src.library import movie_library
+from src.moviefiles import movie_files, MovieNotFound, AccessDenied
+from src.mp4 import mp4_index_cache
+from src.blockcache import block_cache
+
+ROOM_NAME_RE = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+class RoomError(Exception):
+    pass
+
+
+class Room:
+    def __init__(self, name, state, socketio):
+        self.name = name
+        self.channel = f"room:{name}"
+        self.state = state
+        self.presence = PresenceBroadcaster(socketio, state, self.channel)
+        self.arbiter = ControlArbiter(socketio, state, self.channel)
+        self.reactions = ReactionAggregator(socketio, state, self.channel)
+        self.sids = set()
+
+    def summary(self):
+        return {
+            'name': self.name,
+            'users': len(self.state.active_users),
+            'current_movie': self.state.playback_state['current_movie'],
+            'is_playing': self.state.playback_state['is_playing']
+        }
+
+
+class RoomManager:
+    def __init__(self, backend):
+        self.socketio = None
+        self.backend = backend
+        self.rooms = {}
+        self.sid_rooms = {}
+        self._lock = threading.RLock()
+        self._task = None
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+        movie_library.add_listener(self.announce_library_change)
+        self.backend.add_room(Config.DEFAULT_ROOM)
+        with self._lock:
+            if Config.DEFAULT_ROOM not in self.rooms:
+                self.rooms[Config.DEFAULT_ROOM] = Room(Config.DEFAULT_ROOM, app_state, socketio)
+                app_state.restore_chat()
+
+    def announce_library_change(self, previous_version, version, added, removed):
+        # Every worker watches the movie folder itself, so the update only
+        # goes to this worker's clients instead of through the message queue
+        self.socketio.emit('library_updated', {
+            'previous_version': previous_version,
+            'version': version,
+            'added': added,
+            'removed': removed
+        }, ignore_queue=True)
+
+    def start(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        last_sweep = time.monotonic()
+        while True:
+            self.socketio.sleep(Config.PRESENCE_TICK_INTERVAL)
+            for room in list(self.rooms.values()):
+                if room.presence.is_dirty():
+                    room.presence.flush()
+                if room.reactions.is_due():
+                    room.reactions.flush()
+                if block_cache.enabled:
+                    self._follow_playback(room)
+            if time.monotonic() - last_sweep >= Config.ROOM_SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                self.backend.heartbeat()
+                self.evict_idle()
+
+    def _follow_playback(self, room):
+        # Warm the blocks just ahead of the room's position so viewers'
+        # range requests are served from memory
+        playback = room.state.playback_state
+        movie = playback.get('current_movie')
+        if not movie or not playback.get('is_playing'):
+            return
+        try:
+            movie_file = movie_files.get(movie)
+        except (MovieNotFound, AccessDenied):
+            return
+        index = mp4_index_cache.get(movie_file.path, movie_file.stat)
+        offset = index.offset_for_time(position_at(playback)) if index is not None else None
+        if offset is not None:
+            block_cache.prefetch(movie_file.path, offset, Config.ROOM_READAHEAD_BYTES)
+
+    @staticmethod
+    def is_valid_name(name):
+        return bool(name) and bool(ROOM_NAME_RE.match(name))
+
+    def get(self, name):
+        if not self.is_valid_name(name):
+            return None
+        with self._lock:
+            room = self.rooms.get(name)
+            # Other workers sharing the backend may have created or evicted the room
+            if not self.backend.has_room(name):
+                if name != Config.DEFAULT_ROOM:
+                    self.rooms.pop(name, None)
+                    return None
+                self.backend.add_room(name)
+            if room is None:
+                room = self.rooms[name] = Room(name, AppState(name, self.backend), self.socketio)
+                room.state.restore_chat()
+            return room
+
+    def create(self, name):
+        if not self.is_valid_name(name):
+            raise RoomError('Room names may only contain letters, numbers, "-" and "_" (max 32)')
+        with self._lock:
+            if len(self.backend.rooms()) >= Config.MAX_ROOMS:
+                raise RoomError('Too many rooms are open, try again later')
+            if not self.backend.add_room(name):
+                raise RoomError(f'Room "{name}" already exists')
+            self.rooms.pop(name, None)
+            return self.get(name)
+
+    def get_or_create(self, name):
+        with self._lock:
+            room = self.get(name)
+            if room is None:
+                room = self.create(name)
+            return room
+
+    def list_rooms(self):
+        rooms = (self.get(name) for name in self.backend.rooms())
+        return [room.summary() for room in rooms if room is not None]
+
+    def disconnect(self, sid):
+        # Flask-SocketIO exposes the python-socketio server it wraps, the
+        # async bridge forwards the call to the event loop itself
+        server = getattr(self.socketio, 'server', self.socketio)
+        server.disconnect(sid)
+
+    def room_for_viewer(self, username, movie):
+        for room in list(self.rooms.values()):
+            if room.state.playback_state.get('current_movie') == movie and username in room.state.active_users:
+                return room
+        return None
+
+    def room_for_sid(self, sid):
+        name = self.sid_rooms.get(sid)
+        return self.rooms.get(name) if name else None
+
+    def add_sid(self, sid, room):
+        with self._lock:
+            self.sid_rooms[sid] = room.name
+            room.sids.add(sid)
+        self.backend.touch_room(room.name)
+
+    def remove_sid(self, sid):
+        with self._lock:
+            room = self.room_for_sid(sid)
+            self.sid_rooms.pop(sid, None)
+            if room is not None:
+                room.sids.discard(sid)
+        if room is not None:
+            self.backend.touch_room(room.name)
+        return room
+
+    def evict_idle(self):
+        now = time.time()
+        with self._lock:
+            for name in self.backend.rooms():
+                if name == Config.DEFAULT_ROOM:
+                    continue
+                room = self.get(name)
+                if room is None or room.sids or room.state.active_users:
+                    continue
+                updated_at = self.backend.room_updated_at(name)
+                if updated_at is not None and now - updated_at >= Config.ROOM_IDLE_TIMEOUT:
+                    self.backend.delete_room(name)
+                    self.rooms.pop(name, None)
+                    if chat_archive is not None:
+                        chat_archive.close(name)
+
+
+room_manager = RoomManager(state_backend)
@@ -1,9 +1,19 @@
-from flask import render_template, request, session, redirect, url_for, send_from_directory, Response, send_file, jsonify
-import os
-import re
-import logging
+import hmac
+from flask import render_template, request, session, redirect, url_for, send_from_directory, Response, jsonify
 from src.config import Config
-from src.utils import (load_users, get_user_avatar_url, get_video_mime_type, get_movies_list)
+from src.utils import (load_users, get_video_mime_type)
+from src.avatars import avatar_registry
+from src.library import movie_library
+from src.rooms import room_manager, RoomError
+from src.streaming import if_range_matches, serve_partial_content, serve_full_content
+from src.moviefiles import movie_files, MovieNotFound, AccessDenied
+from src.mp4 import mp4_index_cache
+from src.throttle import open_stream, stream_scheduler
+from src.blockcache import block_cache
+from src.metrics import registry
+from src.wire import wire_codecs
+from src.reactions import reaction_timeline
+from src.probe import media_prober, format_media_info
 from src.logging_config import CustomRequestLogger
 
 def setup_routes(app, app_logger):
@@ -21,13 +31,22 @@ def setup_routes(app, app_logger):
         if 'username' not in session:
             return redirect(url_for('login'))
         app_logger.info(f"User {session['username']} accessed main page")
-        movies = get_movies_list()
+        library_version, movies = movie_library.snapshot()
         app_logger.info(f"Found {len(movies)} movies in library")
-        from src.state import app_state
+        room_name = request.args.get('room') or Config.DEFAULT_ROOM
+        if not room_manager.is_valid_name(room_name):
+            return redirect(url_for('index'))
+        room = room_manager.get(room_name)
+        current_movie = room.state.playback_state['current_movie'] if room else None
         return render_template('index.html', 
                              username=session['username'], 
                              movies=movies,
-                             current_movie=app_state.playback_state['current_movie'],
+                             movie_info=media_prober.lookup(movies),
+                             format_media_info=format_media_info,
+                             room=room_name,
+                             current_movie=current_movie,
+                             library_version=library_version,
+                             wire=wire_codecs.schema(),
                              get_video_mime_type=get_video_mime_type)
     
     @app.route('/login', methods=['GET', 'POST'])
@@ -65,38 +84,62 @@ def setup_routes(app, app_logger):
             app_logger.warning(f"Unauthorized movie access attempt for: {filename}")
             return "Unauthorized", 401
         app_logger.info(f"Movie request from {session['username']}: {filename}")
-        file_path = os.path.join(Config.MOVIE_FOLDER, filename)
-        if not os.path.exists(file_path):
+        try:
+            movie = movie_files.get(filename)
+        except MovieNotFound:
             app_logger.error(f"Movie file not found: {filename}")
             return "File not found", 404
-        real_path = os.path.realpath(file_path)
-        movies_path = os.path.realpath(Config.MOVIE_FOLDER)
-        if not real_path.startswith(movies_path):
+        except AccessDenied:
             app_logger.warning(f"Security violation - path traversal attempt: {filename}")
             return "Access denied", 403
-        file_size = os.path.getsize(file_path)
+        file_size = movie.size
+        mtime = movie.mtime
         mime_type = get_video_mime_type(filename)
         app_logger.info(f"Serving movie: {filename} (size: {file_size} bytes)")
+        etag = movie.etag
+        layout = mp4_index_cache.layout(movie.path, movie.stat) if Config.MP4_FASTSTART else None
+        if layout is not None:
+            # Served with the moov moved to the front, so it is a different representation
+            etag = f"{etag}-fs"
+            file_size = layout.size
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        room = room_manager.room_for_viewer(session['username'], filename)
+        stream = open_stream(session['username'], room.name if room else None, filename, movie.path, movie.stat)
         range_header = request.headers.get('Range')
-        if range_header:
-            return serve_partial_content(file_path, range_header, mime_type, file_size)
-        response = send_from_directory(Config.MOVIE_FOLDER, filename, 
-                                     as_attachment=False, 
-                                     mimetype=mime_type)
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Content-Type'] = mime_type
-        response.headers['Content-Disposition'] = 'inline'
-        return response
+        if range_header and if_range_matches(request.headers.get('If-Range'), etag, mtime):
+            response = serve_partial_content(movie, range_header, mime_type, file_size, mtime,
+                                             request.environ, etag, layout, stream)
+            if response is not None:
+                return response
+        return serve_full_content(movie, mime_type, file_size, mtime, etag, layout, request.environ, stream)
     
     @app.route('/avatars/<username>')
     def serve_avatar(username):
         if 'username' not in session:
             return "Unauthorized", 401
-        for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-            test_path = os.path.join(Config.AVATAR_FOLDER, f"{username}{ext}")
-            if os.path.exists(test_path):
-                return send_from_directory(Config.AVATAR_FOLDER, f"{username}{ext}")
-        return "Avatar not found", 404
+        avatar = avatar_registry.get(username)
+        if avatar is None:
+            return "Avatar not found", 404
+        if request.args.get('v') == avatar.etag:
+            cache_control = f'private, max-age={Config.AVATAR_CACHE_MAX_AGE}, immutable'
+        else:
+            cache_control = 'private, no-cache'
+        if request.if_none_match.contains(avatar.etag) or (
+                not request.if_none_match and request.if_modified_since
+                and request.if_modified_since.timestamp() >= int(avatar.mtime)):
+            response = Response(status=304)
+            response.set_etag(avatar.etag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        response = send_from_directory(Config.AVATAR_FOLDER, avatar.filename,
+                                     etag=avatar.etag,
+                                     last_modified=avatar.mtime,
+                                     conditional=False)
+        response.headers['Cache-Control'] = cache_control
+        return response
 
     @app.route('/api/login', methods=['POST'])
     def api_login():
@@ -110,52 +153,110 @@ def setup_routes(app, app_logger):
             return jsonify({'status': 'success', 'username': username}) 
         return jsonify({'status': 'error', 'message': 'Invalid credentials'}), 401
 
+    @app.route('/api/rooms', methods=['GET', 'POST'])
+    def api_rooms():
+        if 'username' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            try:
+                room = room_manager.create(data.get('room'))
+            except RoomError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 400
+            app_logger.info(f"User {session['username']} created room {room.name}")
+            return jsonify({'status': 'success', 'room': room.summary()}), 201
+        return jsonify({'rooms': room_manager.list_rooms()})
+
     @app.route('/api/movies')
     def api_movies():
         if 'username' not in session:
             return jsonify({'error': 'Unauthorized'}), 401
-        movies = get_movies_list()
-        return jsonify({'movies': movies})
+        # The listing only changes with the library or when a movie's media
+        # info arrives, so clients holding the current version get a 304
+        etag = f"{movie_library.current_version()}.{media_prober.version}"
+        if request.if_none_match.contains(etag):
+            return library_response(Response(status=304), etag)
+        since = request.args.get('since', type=int)
+        if since is not None:
+            changes = movie_library.changes_since(since)
+            if changes is not None:
+                version, added, removed = changes
+                return library_response(jsonify({
+                    'version': version,
+                    'since': since,
+                    'added': added,
+                    'removed': removed,
+                    'info': media_prober.lookup(added)
+                }), etag)
+        query = request.args.get('q', '').strip()
+        if not query and 'page' not in request.args and 'per_page' not in request.args:
+            version, movies = movie_library.snapshot()
+            return library_response(jsonify({
+                'version': version,
+                'full': True,
+                'movies': movies,
+                'info': media_prober.lookup(movies)
+            }), etag)
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = request.args.get('per_page', Config.LIBRARY_PAGE_SIZE, type=int)
+        per_page = min(max(1, per_page), Config.LIBRARY_MAX_PAGE_SIZE)
+        total, movies = movie_library.search(query, offset=(page - 1) * per_page, limit=per_page)
+        return library_response(jsonify({
+            'version': movie_library.version,
+            'movies': movies,
+            'info': media_prober.lookup(movies),
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'has_more': page * per_page < total
+        }), etag)
+
+    def library_response(response, etag):
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    @app.route('/api/reactions/<path:movie>')
+    def api_reactions(movie):
+        if 'username' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+        return jsonify({
+            'movie': movie,
+            'resolution': reaction_timeline.resolution,
+            'buckets': reaction_timeline.query(movie, start, end)
+        })
 
-def serve_partial_content(file_path, range_header, mime_type, file_size):
-    try:
-        byte_start = 0
-        byte_end = file_size - 1
-        if range_header:
-            match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-            if match:
-                byte_start = int(match.group(1))
-                if match.group(2):
-                    byte_end = int(match.group(2))
-        byte_start = max(0, byte_start)
-        byte_end = min(file_size - 1, byte_end)
-        content_length = byte_end - byte_start + 1
-        def generate():
-            with open(file_path, 'rb') as f:
-                f.seek(byte_start)
-                remaining = content_length
-                while remaining:
-                    chunk_size = min(8192, remaining)
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    yield chunk
-                    remaining -= len(chunk)
-        return Response(
-            generate(),
-            206,
-            headers={
-                'Content-Type': mime_type,
-                'Accept-Ranges': 'bytes',
-                'Content-Range': f'bytes {byte_start}-{byte_end}/{file_size}',
-                'Content-Length': str(content_length),
-                'Cache-Control': 'no-cache'
-            },
-            direct_passthrough=True
-        )
-    except Exception as e:
-        logging.error(f"Error serving partial content: {str(e)}")
-        response = send_file(file_path, mimetype=mime_type)
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Content-Length'] = str(file_size)
-        return response
\ No newline at end of file
+    def room_gauge(value):
+        def collect():
+            return {room.name: value(room) for room in list(room_manager.rooms.values())}
+        return collect
+
+    registry.gauge('syncinema_active_streams', 'Movie responses currently sending data.',
+                   collect=lambda: stream_scheduler.stats()['streams'])
+    registry.gauge('syncinema_block_cache_bytes', 'Movie data held in the block cache.',
+                   collect=lambda: block_cache.stats()['bytes'])
+    registry.gauge('syncinema_movie_open_files', 'Movie file descriptors held open for reuse.',
+                   collect=lambda: movie_files.stats()['open'])
+    registry.gauge('syncinema_room_connections', 'Socket.IO connections per room.', ('room',),
+                   room_gauge(lambda room: len(room.sids)))
+    registry.gauge('syncinema_room_users', 'Users in the presence list per room.', ('room',),
+                   room_gauge(lambda room: len(room.state.active_users)))
+    registry.gauge('syncinema_room_typing_users', 'Users currently typing per room.', ('room',),
+                   room_gauge(lambda room: len(room.state.typing_users)))
+    registry.gauge('syncinema_room_chat_messages', 'Chat messages held in memory per room.', ('room',),
+                   room_gauge(lambda room: len(room.state.chat_messages)))
+
+    @app.route('/metrics')
+    def metrics():
+        if not Config.METRICS_ENABLED:
+            return "Not found", 404
+        # Loopback is not trusted: behind a reverse proxy every request comes from it
+        token = Config.METRICS_TOKEN
+        authorized = 'username' in session or bool(
+            token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'))
+        if not authorized:
+            return "Unauthorized", 401
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
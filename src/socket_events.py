@@ -1,231 +1,356 @@
 from flask_socketio import emit, join_room, leave_room, disconnect
 from datetime import datetime
-import requests
-from src.utils import get_user_avatar_url
+import uuid
+from src.utils import get_user_avatar_url, get_user_avatar_display
 from src.config import Config
-from src.state import app_state
-
-def is_vpn(ip_address):
-    try:
-        if ip_address in ['127.0.0.1', '::1', 'localhost']:
-            return False
-
-        response = requests.get(
-            f"http://ip-api.com/json/{ip_address}?fields=status,proxy,hosting",
-            timeout=3
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'success':
-                return data.get('proxy', False) or data.get('hosting', False)
-    except Exception:
-        pass
-    return False
+from src.rooms import room_manager, RoomError
+from src.timeline import server_time, event_time, timeline_payload, playback_time
+from src.metrics import metered_handler
+from src.vpn import vpn_detector
+from src.wire import wire_codecs
+from src.progress import watch_progress
+from src.probe import media_prober
 
-def setup_socket_events(socketio, app_logger):
-    
-    @socketio.on('connect')
-    def handle_connect():
+class SocketContext:
+    # Handlers only use these attributes plus emit, join, leave and
+    # disconnect, which each server's context provides
+    def __init__(self, sid, username, remote_addr, args):
+        self.sid = sid
+        self.username = username
+        self.remote_addr = remote_addr
+        self.args = args
+
+
+class FlaskSocketContext(SocketContext):
+    @classmethod
+    def from_request(cls):
         from flask import session, request
-        
-        client_ip = request.remote_addr
-        if Config.VPN_DETECTION_ENABLED and is_vpn(client_ip):
-            app_logger.warning(f"Connection rejected for user {session.get('username', 'Unknown')} from IP {client_ip} (VPN Detected)")
-            disconnect()
+        return cls(request.sid, session.get('username'), request.remote_addr, request.args)
+
+    def emit(self, event, data, room=None, include_self=True):
+        emit(event, data, room=room, include_self=include_self)
+
+    def join(self, channel):
+        join_room(channel)
+
+    def leave(self, channel):
+        leave_room(channel)
+
+    def disconnect(self):
+        disconnect()
+
+
+def create_event_handlers(app_logger):
+    
+    def enter_room(ctx, room, username):
+        avatar_url = get_user_avatar_url(username)
+        avatar_display = get_user_avatar_display(username)
+        room.state.add_user(username, avatar_display, avatar_url)
+        ctx.join(room.channel)
+        room_manager.add_sid(ctx.sid, room)
+        app_logger.info(f"User {username} joined room {room.name} from IP: {ctx.remote_addr}")
+        ctx.emit('room_joined', {'room': room.name})
+        ctx.emit('user_joined', {
+            'username': username,
+            'avatar': avatar_display,
+            'timestamp': datetime.now().strftime('%H:%M:%S')
+        }, room=room.channel)
+        room.presence.flush()
+        ctx.emit('users_update', room.presence.snapshot())
+        send_sync_state(ctx, room.state.playback_state)
+        send_chat_page(ctx, room)
+
+    def send_sync_state(ctx, playback_state):
+        sync_state = dict(playback_state, **timeline_payload(playback_state))
+        sync_state['current_time'] = sync_state['time']
+        ctx.emit('sync_state', sync_state)
+    
+    def send_chat_page(ctx, room, before=None, limit=None):
+        messages, has_more = room.state.chat_page(before, limit)
+        ctx.emit('chat_history', {
+            'messages': messages,
+            'before': before,
+            'cursor': messages[0]['seq'] if messages else before,
+            'has_more': has_more
+        })
+    
+    def exit_room(ctx, username):
+        room = room_manager.remove_sid(ctx.sid)
+        if room is None:
             return
+        room.state.remove_typing_user(username)
+        ctx.emit('user_stopped_typing', {
+            'username': username
+        }, room=room.channel)
+        room.state.remove_user(username)
+        app_logger.info(f"User {username} left room {room.name} (IP: {ctx.remote_addr})")
+        ctx.emit('user_left', {
+            'username': username,
+            'timestamp': datetime.now().strftime('%H:%M:%S')
+        }, room=room.channel)
+        room.presence.mark_dirty()
+        ctx.leave(room.channel)
+    
+    def handle_connect(ctx, data):
+        client_ip = ctx.remote_addr
+        if Config.VPN_DETECTION_ENABLED:
+            def on_verdict(is_vpn):
+                if is_vpn:
+                    app_logger.warning(f"Disconnecting user {ctx.username or 'Unknown'} from IP {client_ip} (VPN Detected)")
+                    room_manager.disconnect(ctx.sid)
 
-        if 'username' in session:
-            avatar_url = get_user_avatar_url(session['username'])
-            avatar_display = avatar_url if avatar_url else Config.USER_AVATARS.get(session['username'], Config.USER_AVATARS['default'])
-            app_state.add_user(session['username'], avatar_display, avatar_url)
-            join_room('movie_room')
-            app_logger.info(f"User {session['username']} connected to movie room from IP: {client_ip}")
-            emit('user_joined', {
-                'username': session['username'],
-                'avatar': avatar_display,
-                'timestamp': datetime.now().strftime('%H:%M:%S')
-            }, room='movie_room')
-            emit('users_update', app_state.get_users_update_data(), room='movie_room')
-            emit('sync_state', app_state.playback_state)
-            chat_history = []
-            for msg in app_state.chat_messages:
-                if 'spoiler' not in msg:
-                    msg['spoiler'] = False
-                chat_history.append(msg)
-            emit('chat_history', chat_history)
-    
-    @socketio.on('disconnect')
-    def handle_disconnect():
-        from flask import session, request
-        if 'username' in session:
-            app_state.typing_users.discard(session['username'])
-            emit('user_stopped_typing', {
-                'username': session['username']
-            }, room='movie_room')
-            app_state.remove_user(session['username'])
-            app_logger.info(f"User {session['username']} disconnected from movie room (IP: {request.remote_addr})")
-            emit('user_left', {
-                'username': session['username'],
-                'timestamp': datetime.now().strftime('%H:%M:%S')
-            }, room='movie_room')
-            emit('users_update', app_state.get_users_update_data(), room='movie_room')
-            leave_room('movie_room')
-    
-    @socketio.on('play')
-    def handle_play(data):
-        from flask import session
-        if 'username' in session:
-            app_state.playback_state['is_playing'] = True
-            app_state.playback_state['current_time'] = data.get('time', 0)
-            app_state.update_user_status(session['username'], 
+            if vpn_detector.check(client_ip, on_verdict):
+                app_logger.warning(f"Connection rejected for user {ctx.username or 'Unknown'} from IP {client_ip} (VPN Detected)")
+                ctx.disconnect()
+                return
+
+        wire_codecs.negotiate(ctx.sid, ctx.args.get('wire'))
+        if ctx.username:
+            room_name = ctx.args.get('room') or Config.DEFAULT_ROOM
+            if not room_manager.is_valid_name(room_name):
+                room_name = Config.DEFAULT_ROOM
+            try:
+                room = room_manager.get_or_create(room_name)
+            except RoomError as e:
+                ctx.emit('room_error', {'message': str(e)})
+                room = room_manager.get(Config.DEFAULT_ROOM)
+            room_manager.start()
+            enter_room(ctx, room, ctx.username)
+    
+    def handle_disconnect(ctx, data):
+        if ctx.username:
+            exit_room(ctx, ctx.username)
+        wire_codecs.forget(ctx.sid)
+    
+    def handle_list_rooms(ctx, data):
+        if ctx.username:
+            ctx.emit('room_list', {'rooms': room_manager.list_rooms()})
+    
+    def handle_create_room(ctx, data):
+        if ctx.username:
+            try:
+                room = room_manager.create(data.get('room'))
+            except RoomError as e:
+                ctx.emit('room_error', {'message': str(e)})
+                return
+            app_logger.info(f"User {ctx.username} created room {room.name}")
+            exit_room(ctx, ctx.username)
+            enter_room(ctx, room, ctx.username)
+    
+    def handle_join_room(ctx, data):
+        if ctx.username:
+            room = room_manager.get(data.get('room'))
+            if room is None:
+                ctx.emit('room_error', {'message': f"Room \"{data.get('room')}\" does not exist"})
+                return
+            current = room_manager.room_for_sid(ctx.sid)
+            if current is room:
+                return
+            exit_room(ctx, ctx.username)
+            enter_room(ctx, room, ctx.username)
+    
+    def handle_play(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            position = playback_time(data.get('time', 0))
+            if position is None:
+                send_sync_state(ctx, room.state.playback_state)
+                return
+            playback_state, applied = room.arbiter.apply(event_time(data), is_playing=True,
+                                                         current_time=position)
+            if not applied:
+                # Someone else's newer action won; put the sender back in step
+                send_sync_state(ctx, playback_state)
+                return
+            room.state.update_user_status(ctx.username, 
                                        is_watching=True, 
-                                       current_time=data.get('time', 0))
-            emit('play_video', {
-                'time': app_state.playback_state['current_time'],
-                'username': session['username']
-            }, room='movie_room', include_self=False)
-            emit('users_update', app_state.get_users_update_data(), room='movie_room')
-    
-    @socketio.on('pause')
-    def handle_pause(data):
-        from flask import session
-        if 'username' in session:
-            app_state.playback_state['is_playing'] = False
-            app_state.playback_state['current_time'] = data.get('time', 0)
-            app_state.update_user_status(session['username'], 
+                                       current_time=position)
+            ctx.emit('play_video', dict(timeline_payload(playback_state), username=ctx.username),
+                     room=room.channel, include_self=False)
+            room.presence.mark_dirty()
+    
+    def handle_pause(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            position = playback_time(data.get('time', 0))
+            if position is None:
+                send_sync_state(ctx, room.state.playback_state)
+                return
+            playback_state, applied = room.arbiter.apply(event_time(data), is_playing=False,
+                                                         current_time=position)
+            if not applied:
+                # Someone else's newer action won; put the sender back in step
+                send_sync_state(ctx, playback_state)
+                return
+            room.state.update_user_status(ctx.username, 
                                        is_watching=False, 
-                                       current_time=data.get('time', 0))
-            emit('pause_video', {
-                'time': app_state.playback_state['current_time'],
-                'username': session['username']
-            }, room='movie_room', include_self=False)
-            emit('users_update', app_state.get_users_update_data(), room='movie_room')
-    
-    @socketio.on('seek')
-    def handle_seek(data):
-        from flask import session
-        if 'username' in session:
-            app_state.playback_state['current_time'] = data.get('time', 0)
-            emit('seek_video', {
-                'time': app_state.playback_state['current_time'],
-                'username': session['username']
-            }, room='movie_room', include_self=False)
-    
-    @socketio.on('change_movie')
-    def handle_change_movie(data):
-        from flask import session
-        if 'username' in session:
+                                       current_time=position)
+            ctx.emit('pause_video', dict(timeline_payload(playback_state), username=ctx.username),
+                     room=room.channel, include_self=False)
+            room.presence.mark_dirty()
+    
+    def handle_seek(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            position = playback_time(data.get('time', 0))
+            if position is None:
+                send_sync_state(ctx, room.state.playback_state)
+                return
+            playback_state, applied = room.arbiter.seek(position, event_time(data), ctx.username, ctx.sid)
+            if not applied:
+                send_sync_state(ctx, playback_state)
+    
+    def handle_change_movie(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
             new_movie = data.get('movie')
-            app_state.playback_state['current_movie'] = new_movie
-            app_state.playback_state['current_time'] = 0
-            app_state.playback_state['is_playing'] = False
-            emit('movie_changed', {
-                'movie': app_state.playback_state['current_movie'],
-                'time': app_state.playback_state['current_time'],
-                'username': session['username']
-            }, room='movie_room', include_self=True)
-    
-    @socketio.on('send_message')
-    def handle_message(data):
-        from flask import session
-        if 'username' in session:
-            message_id = f"{len(app_state.chat_messages)}_{session['username']}_{datetime.now().timestamp()}"
-            avatar_url = get_user_avatar_url(session['username'])
+            resume_time = watch_progress.get(ctx.username, new_movie) if new_movie else 0
+            playback_state, applied = room.arbiter.apply(None, current_movie=new_movie, current_time=resume_time,
+                                                         is_playing=False)
+            if not applied:
+                send_sync_state(ctx, playback_state)
+                return
+            ctx.emit('movie_changed', dict(timeline_payload(playback_state),
+                                           movie=playback_state['current_movie'],
+                                           username=ctx.username),
+                     room=room.channel, include_self=True)
+    
+    def handle_message(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            message_id = f"{uuid.uuid4().hex[:8]}_{ctx.username}_{datetime.now().timestamp()}"
+            avatar_url = get_user_avatar_url(ctx.username)
             message = {
                 'id': message_id,
-                'username': session['username'],
-                'avatar': avatar_url if avatar_url else Config.USER_AVATARS.get(session['username'], Config.USER_AVATARS['default']),
+                'username': ctx.username,
+                'avatar': get_user_avatar_display(ctx.username),
                 'avatar_url': avatar_url,
                 'message': data.get('message'),
                 'timestamp': datetime.now().strftime('%H:%M:%S'),
                 'reactions': {},
-                'spoiler': data.get('spoiler', False)
+                'spoiler': bool(data.get('spoiler', False))
             }
-            app_state.add_chat_message(message)
-            app_state.message_reactions[message_id] = {}
-            app_state.typing_users.discard(session['username'])
-            emit('user_stopped_typing', {
-                'username': session['username']
-            }, room='movie_room')
-            emit('new_message', message, room='movie_room', include_self=True)
-    
-    @socketio.on('typing')
-    def handle_typing():
-        from flask import session
-        if 'username' in session:
-            app_state.typing_users.add(session['username'])
-            avatar_url = get_user_avatar_url(session['username'])
-            avatar_display = avatar_url if avatar_url else Config.USER_AVATARS.get(session['username'], Config.USER_AVATARS['default'])
-            emit('user_typing', {
-                'username': session['username'],
+            message = room.state.add_chat_message(message)
+            room.state.remove_typing_user(ctx.username)
+            ctx.emit('user_stopped_typing', {
+                'username': ctx.username
+            }, room=room.channel)
+            ctx.emit('new_message', message, room=room.channel, include_self=True)
+    
+    def handle_chat_history(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            before = data.get('before')
+            limit = data.get('limit')
+            if not isinstance(before, int) or before < 0:
+                before = None
+            if not isinstance(limit, int) or limit <= 0:
+                limit = Config.CHAT_PAGE_SIZE
+            send_chat_page(ctx, room, before, min(limit, Config.MAX_CHAT_MESSAGES))
+    
+    def handle_typing(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            room.state.add_typing_user(ctx.username)
+            avatar_display = get_user_avatar_display(ctx.username)
+            ctx.emit('user_typing', {
+                'username': ctx.username,
                 'avatar': avatar_display
-            }, room='movie_room', include_self=False)
-            emit('users_update', app_state.get_users_update_data(), room='movie_room')
-    
-    @socketio.on('stop_typing')
-    def handle_stop_typing():
-        from flask import session
-        if 'username' in session:
-            app_state.typing_users.discard(session['username'])
-            emit('user_stopped_typing', {
-                'username': session['username']
-            }, room='movie_room')
-            emit('users_update', app_state.get_users_update_data(), room='movie_room')
-    
-    @socketio.on('heartbeat')
-    def handle_heartbeat(data):
-        from flask import session
-        if 'username' in session:
-            app_state.update_user_status(session['username'],
+            }, room=room.channel, include_self=False)
+            room.presence.mark_dirty()
+    
+    def handle_stop_typing(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            room.state.remove_typing_user(ctx.username)
+            ctx.emit('user_stopped_typing', {
+                'username': ctx.username
+            }, room=room.channel)
+            room.presence.mark_dirty()
+    
+    def handle_heartbeat(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            position = playback_time(data.get('time', 0))
+            if position is None:
+                return
+            room.state.update_user_status(ctx.username,
                                        is_watching=data.get('is_watching', False),
-                                       current_time=data.get('time', 0))
-            emit('users_update', app_state.get_users_update_data(), room='movie_room')
-    
-    @socketio.on('send_reaction')
-    def handle_reaction(data):
-        from flask import session
-        if 'username' in session:
-            avatar_url = get_user_avatar_url(session['username'])
-            avatar_display = avatar_url if avatar_url else Config.USER_AVATARS.get(session['username'], Config.USER_AVATARS['default'])
-            reaction = {
-                'username': session['username'],
-                'avatar': avatar_display,
-                'emoji': data.get('emoji'),
-                'timestamp': datetime.now().strftime('%H:%M:%S'),
-                'video_time': data.get('video_time', 0)
-            }
-            app_state.add_reaction(reaction)
-            emit('new_reaction', reaction, room='movie_room', include_self=True)
+                                       current_time=position)
+            room.presence.mark_dirty()
+            # Heartbeats name the movie they measured, so one sent while the
+            # client is still switching does not count against the new movie.
+            # Paused viewers are not watching from where their player sits.
+            movie = room.state.playback_state.get('current_movie')
+            if data.get('is_watching') and data.get('movie', movie) == movie:
+                watch_progress.record(ctx.username, movie, position)
     
-    @socketio.on('react_to_message')
-    def handle_message_reaction(data):
-        from flask import session
-        if 'username' in session:
+    def handle_clock_ping(ctx, data):
+        if ctx.username:
+            ctx.emit('clock_pong', {'t': data.get('t'), 'server_time': server_time()})
+    
+    def handle_presence_resync(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
+            ctx.emit('users_update', room.presence.snapshot())
+    
+    def handle_reaction(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        emoji = data.get('emoji')
+        if not isinstance(emoji, str) or not emoji or len(emoji) > Config.REACTION_MAX_EMOJI_LENGTH:
+            return
+        video_time = playback_time(data.get('video_time', 0)) or 0.0
+        if ctx.username and room:
+            # Clamped to the movie, so clients cannot open far-off timeline slots
+            movie = room.state.playback_state.get('current_movie')
+            info = media_prober.lookup([movie]).get(movie) if movie else None
+            video_time = min(video_time, (info or {}).get('duration') or Config.REACTION_MAX_VIDEO_TIME)
+            room.reactions.add(ctx.username, get_user_avatar_display(ctx.username), emoji, video_time)
+    
+    def handle_message_reaction(ctx, data):
+        room = room_manager.room_for_sid(ctx.sid)
+        if ctx.username and room:
             message_id = data.get('message_id')
             emoji = data.get('emoji')
             if message_id and emoji:
-                message = None
-                for msg in app_state.chat_messages:
-                    if msg.get('id') == message_id:
-                        message = msg
-                        break
+                message = room.state.toggle_message_reaction(message_id, emoji, ctx.username)
                 if message:
-                    if 'reactions' not in message:
-                        message['reactions'] = {}
-                    if message_id not in app_state.message_reactions:
-                        app_state.message_reactions[message_id] = {}
-                    if emoji in message['reactions']:
-                        if session['username'] in message['reactions'][emoji]:
-                            message['reactions'][emoji].remove(session['username'])
-                            if len(message['reactions'][emoji]) == 0:
-                                del message['reactions'][emoji]
-                        else:
-                            message['reactions'][emoji].append(session['username'])
-                    else:
-                        message['reactions'][emoji] = [session['username']]
-                    emit('message_reaction_update', {
+                    ctx.emit('message_reaction_update', {
                         'message_id': message_id,
                         'reactions': message['reactions'],
-                        'user': session['username']
-                    }, room='movie_room', include_self=True)
\ No newline at end of file
+                        'user': ctx.username
+                    }, room=room.channel, include_self=True)
+
+    handlers = {
+        'connect': handle_connect,
+        'disconnect': handle_disconnect,
+        'list_rooms': handle_list_rooms,
+        'create_room': handle_create_room,
+        'join_room': handle_join_room,
+        'play': handle_play,
+        'pause': handle_pause,
+        'seek': handle_seek,
+        'change_movie': handle_change_movie,
+        'send_message': handle_message,
+        'chat_history': handle_chat_history,
+        'typing': handle_typing,
+        'stop_typing': handle_stop_typing,
+        'heartbeat': handle_heartbeat,
+        'clock_ping': handle_clock_ping,
+        'presence_resync': handle_presence_resync,
+        'send_reaction': handle_reaction,
+        'react_to_message': handle_message_reaction
+    }
+    return {event: metered_handler(event, handler) for event, handler in handlers.items()}
+
+
+def setup_socket_events(socketio, app_logger):
+    room_manager.init_app(socketio)
+    for event, handler in create_event_handlers(app_logger).items():
+        socketio.on_event(event, _flask_handler(handler))
+
+
+def _flask_handler(handler):
+    def wrapper(data=None):
+        handler(FlaskSocketContext.from_request(), data if isinstance(data, dict) else {})
+    return wrapper
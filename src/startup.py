@@ -0,0 +1,41 @@
+import time
+import socket
+import threading
+
+
+class StartupTimer:
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = []
+        self._last = self.started
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        phases = ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        return f"Startup timing: {phases} (ready in {self._last - self.started:.2f}s)"
+
+    def wait_for_bind(self, host, port, on_ready, timeout=60):
+        # The servers block once they are started, so readiness is detected
+        # from the outside by connecting to the listening socket
+        if host in ('0.0.0.0', '', None):
+            host = '127.0.0.1'
+        elif host == '::':
+            host = '::1'
+
+        def poll():
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                try:
+                    socket.create_connection((host, port), timeout=1).close()
+                except OSError:
+                    time.sleep(0.01)
+                    continue
+                self.mark('bind')
+                on_ready(self)
+                return
+
+        threading.Thread(target=poll, daemon=True).start()
@@ -1,59 +1,176 @@
 from datetime import datetime
+from src.config import Config
+from src.backends import state_backend
+from src.chat import chat_archive
+from src.timeline import server_time, position_at
+
+DEFAULT_PLAYBACK_STATE = {
+    'is_playing': False,
+    'current_time': 0,
+    'current_movie': None,
+    'rate': 1.0,
+    'updated_at': None,
+    'seq': 0
+}
+
+DEFAULT_PRESENCE = {'version': 0, 'users': {}}
+
 
 class AppState:
-    def __init__(self):
-        self.playback_state = {
-            'is_playing': False,
-            'current_time': 0,
-            'current_movie': None
-        }
-        self.chat_messages = []
-        self.typing_users = set()
-        self.active_users = {}
-        self.recent_reactions = []
-        self.message_reactions = {}
-        
+    def __init__(self, room=None, backend=None):
+        self.room = room or Config.DEFAULT_ROOM
+        self.backend = backend or state_backend
+
+    @property
+    def playback_state(self):
+        return self.backend.get(self.room, 'playback', DEFAULT_PLAYBACK_STATE)
+
+    def update_playback(self, at=None, **fields):
+        # Returns (playback_state, applied). The state is the room's current
+        # one either way; applied is False when the event was stale and the
+        # state was left unchanged.
+        now = server_time()
+        at = now if at is None else at
+        result = {}
+
+        def apply(state):
+            updated_at = state.get('updated_at')
+            # An event that happened before the last applied one is stale. A
+            # stamp ahead of the clock was written before the clock was set
+            # back and must not block every later event.
+            if updated_at is not None and at < updated_at <= now:
+                result['state'] = state
+                return state
+            state = dict(state)
+            if 'current_time' not in fields:
+                state['current_time'] = position_at(state, at)
+            state.update(fields)
+            state['updated_at'] = at
+            state['seq'] = state.get('seq', 0) + 1
+            result['state'] = state
+            result['applied'] = True
+            return state
+        self.backend.update(self.room, 'playback', apply, DEFAULT_PLAYBACK_STATE)
+        return result['state'], result.get('applied', False)
+
+    @property
+    def active_users(self):
+        return self.backend.get(self.room, 'users', {})
+
+    @property
+    def typing_users(self):
+        return set(self.backend.get(self.room, 'typing', []))
+
+    @property
+    def chat_messages(self):
+        return self.backend.items(self.room, 'chat')
+
+    @property
+    def recent_reactions(self):
+        return self.backend.items(self.room, 'reactions')
+
     def add_user(self, username, avatar_display, avatar_url):
-        self.active_users[username] = {
-            'avatar': avatar_display,
-            'avatar_url': avatar_url,
-            'joined_at': datetime.now().strftime('%H:%M:%S'),
-            'is_watching': False,
-            'current_time': 0
-        }
-    
+        def apply(users):
+            users = dict(users)
+            users[username] = {
+                'avatar': avatar_display,
+                'avatar_url': avatar_url,
+                'joined_at': datetime.now().strftime('%H:%M:%S'),
+                'is_watching': False,
+                'current_time': 0
+            }
+            return users
+        self.backend.update(self.room, 'users', apply, {})
+
     def remove_user(self, username):
-        self.typing_users.discard(username)
-        if username in self.active_users:
-            del self.active_users[username]
-    
+        self.remove_typing_user(username)
+        def apply(users):
+            users = dict(users)
+            users.pop(username, None)
+            return users
+        self.backend.update(self.room, 'users', apply, {})
+
     def update_user_status(self, username, is_watching=None, current_time=None):
-        if username in self.active_users:
-            if is_watching is not None:
-                self.active_users[username]['is_watching'] = is_watching
-            if current_time is not None:
-                self.active_users[username]['current_time'] = current_time
-    
+        def apply(users):
+            if username in users:
+                user = dict(users[username])
+                if is_watching is not None:
+                    user['is_watching'] = is_watching
+                if current_time is not None:
+                    user['current_time'] = current_time
+                users = dict(users)
+                users[username] = user
+            return users
+        self.backend.update(self.room, 'users', apply, {})
+
+    def add_typing_user(self, username):
+        def apply(typing):
+            return typing if username in typing else typing + [username]
+        self.backend.update(self.room, 'typing', apply, [])
+
+    def remove_typing_user(self, username):
+        def apply(typing):
+            return [u for u in typing if u != username]
+        self.backend.update(self.room, 'typing', apply, [])
+
     def add_chat_message(self, message):
-        from src.config import Config
-        self.chat_messages.append(message)
-        if len(self.chat_messages) > Config.MAX_CHAT_MESSAGES:
-            removed_message = self.chat_messages.pop(0)
-            if removed_message.get('id') in self.message_reactions:
-                del self.message_reactions[removed_message['id']]
-    
+        message = self.backend.append(self.room, 'chat', message, Config.MAX_CHAT_MESSAGES)
+        if chat_archive is not None:
+            chat_archive.append(self.room, 'add', message)
+        return message
+
+    def chat_page(self, before=None, limit=None):
+        return self.backend.page(self.room, 'chat', before, limit or Config.CHAT_PAGE_SIZE)
+
+    def restore_chat(self):
+        if chat_archive is None:
+            return
+
+        claimed = {}
+
+        # Only the first worker to see the room restores it from the archive
+        def claim(restored):
+            claimed['value'] = not restored
+            return True
+        self.backend.update(self.room, 'chat_restored', claim, False)
+        if not claimed['value'] or self.backend.items(self.room, 'chat'):
+            return
+        for message in chat_archive.load(self.room, Config.MAX_CHAT_MESSAGES):
+            self.backend.append(self.room, 'chat', message, Config.MAX_CHAT_MESSAGES)
+
+    def toggle_message_reaction(self, message_id, emoji, username):
+        def apply(message):
+            reactions = message.setdefault('reactions', {})
+            users = reactions.setdefault(emoji, [])
+            if username in users:
+                users.remove(username)
+                if not users:
+                    del reactions[emoji]
+            else:
+                users.append(username)
+            return message
+        message = self.backend.update_item(self.room, 'chat', message_id, apply)
+        if message is not None and chat_archive is not None:
+            chat_archive.append(self.room, 'update', message)
+        return message
+
     def add_reaction(self, reaction):
-        from src.config import Config
-        self.recent_reactions.append(reaction)
-        if len(self.recent_reactions) > Config.MAX_REACTIONS:
-            self.recent_reactions.pop(0)
-    
+        self.backend.append(self.room, 'reactions', reaction, Config.MAX_REACTIONS)
+
+    def update_presence(self, fn):
+        return self.backend.update(self.room, 'presence', fn, DEFAULT_PRESENCE)
+
+    def get_presence(self):
+        return self.backend.get(self.room, 'presence', DEFAULT_PRESENCE)
+
     def get_users_update_data(self):
+        active_users = self.active_users
         return {
-            'users': list(self.active_users.keys()),
-            'count': len(self.active_users),
-            'user_details': self.active_users,
+            'users': list(active_users.keys()),
+            'count': len(active_users),
+            'user_details': active_users,
             'typing_users': list(self.typing_users)
         }
 
-app_state = AppState()
\ No newline at end of file
+
+app_state = AppState()
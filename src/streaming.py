@@ -0,0 +1,218 @@
+import os
+import re
+import select
+import uuid
+import logging
+from flask import Response
+from werkzeug.http import quote_etag, unquote_etag, http_date, parse_date
+from src.config import Config
+from src.blockcache import block_cache, read_block
+from src.moviefiles import make_etag
+
+SENDFILE_AVAILABLE = hasattr(os, 'sendfile')
+RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(range_header, file_size):
+    if not range_header:
+        return None
+    unit, _, specs = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        if not spec.strip():
+            continue
+        match = RANGE_SPEC_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.group(1), match.group(2)
+        if not first and not last:
+            return None
+        if not first:
+            suffix_length = int(last)
+            if suffix_length == 0 or file_size == 0:
+                continue
+            ranges.append((max(0, file_size - suffix_length), file_size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else None
+        if end is not None and end < start:
+            return None
+        if start >= file_size:
+            continue
+        ranges.append((start, file_size - 1 if end is None else min(end, file_size - 1)))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return coalesce_ranges(ranges)[:Config.STREAM_MAX_RANGES]
+
+
+def coalesce_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(if_range, etag, mtime):
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('W/'):
+        return False
+    if if_range.startswith('"'):
+        return unquote_etag(if_range)[0] == etag
+    date = parse_date(if_range)
+    return date is not None and int(date.timestamp()) == int(mtime)
+
+
+def send_range(fd, key, start, length, environ=None, chunk_size=None, stream=None):
+    chunk_size = chunk_size or Config.STREAM_CHUNK_SIZE
+    sock = environ.get('werkzeug.socket') if environ else None
+    if sock is not None and SENDFILE_AVAILABLE and Config.STREAM_USE_SENDFILE:
+        return _sendfile_range(sock, fd, start, length, stream)
+    if block_cache.enabled:
+        chunks = block_cache.iter_range(fd, key, start, length)
+    else:
+        chunks = _read_range(fd, start, length, chunk_size)
+    return stream.paced(chunks) if stream is not None else chunks
+
+
+def _sendfile_range(sock, in_fd, start, length, stream=None):
+    # An empty chunk makes the server flush the status line and headers
+    # so the kernel can copy the body straight from the page cache.
+    yield b''
+    out_fd = sock.fileno()
+    offset = start
+    remaining = length
+    # Paced streams send smaller pieces so the rate stays smooth
+    max_chunk = Config.STREAM_CHUNK_SIZE if stream is not None and stream.limited else Config.STREAM_SENDFILE_CHUNK_SIZE
+    while remaining > 0:
+        count = min(remaining, max_chunk)
+        try:
+            sent = os.sendfile(out_fd, in_fd, offset, count)
+        except BlockingIOError:
+            select.select([], [out_fd], [])
+            continue
+        if sent == 0:
+            break
+        offset += sent
+        remaining -= sent
+        # Pace what actually went out; a partial send is not charged twice
+        if stream is not None:
+            stream.pace(sent)
+
+
+def _read_range(fd, start, length, chunk_size):
+    offset = start
+    end = start + length
+    while offset < end:
+        chunk = read_block(fd, offset, min(chunk_size, end - offset))
+        if not chunk:
+            break
+        yield chunk
+        offset += len(chunk)
+
+
+def iter_segments(movie, segments, environ=None, stream=None):
+    try:
+        with movie.open() as fd:
+            for segment in segments:
+                if isinstance(segment, bytes):
+                    if stream is not None:
+                        stream.pace(len(segment))
+                    yield segment
+                else:
+                    yield from send_range(fd, movie.key, segment[0], segment[1], environ, stream=stream)
+    finally:
+        if stream is not None:
+            stream.close()
+
+
+def range_not_satisfiable(file_size):
+    return Response(
+        'Requested range not satisfiable',
+        416,
+        headers={
+            'Content-Range': f'bytes */{file_size}',
+            'Accept-Ranges': 'bytes'
+        }
+    )
+
+
+def plan_partial_content(range_header, mime_type, file_size, mtime, etag=None):
+    ranges = parse_range_header(range_header, file_size)
+    if ranges is None:
+        return None
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': quote_etag(etag or make_etag(file_size, mtime)),
+        'Last-Modified': http_date(mtime),
+        'Cache-Control': 'no-cache'
+    }
+    if len(ranges) == 1:
+        byte_start, byte_end = ranges[0]
+        content_length = byte_end - byte_start + 1
+        headers['Content-Type'] = mime_type
+        headers['Content-Range'] = f'bytes {byte_start}-{byte_end}/{file_size}'
+        headers['Content-Length'] = str(content_length)
+        return headers, [(byte_start, content_length)]
+    boundary = uuid.uuid4().hex
+    segments = []
+    for byte_start, byte_end in ranges:
+        segments.append((
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {mime_type}\r\n"
+            f"Content-Range: bytes {byte_start}-{byte_end}/{file_size}\r\n\r\n"
+        ).encode())
+        segments.append((byte_start, byte_end - byte_start + 1))
+    segments.append(f"\r\n--{boundary}--\r\n".encode())
+    content_length = sum(len(s) if isinstance(s, bytes) else s[1] for s in segments)
+    headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    headers['Content-Length'] = str(content_length)
+    return headers, segments
+
+
+def serve_partial_content(movie, range_header, mime_type, file_size, mtime, environ=None, etag=None, layout=None,
+                          stream=None):
+    try:
+        plan = plan_partial_content(range_header, mime_type, file_size, mtime, etag)
+    except RangeNotSatisfiable:
+        return range_not_satisfiable(file_size)
+    if plan is None:
+        return None
+    headers, segments = plan
+    if layout is not None:
+        segments = layout.map_segments(segments)
+    try:
+        return Response(iter_segments(movie, segments, environ, stream), 206, headers=headers, direct_passthrough=True)
+    except Exception as e:
+        logging.error(f"Error serving partial content: {str(e)}")
+        return None
+
+
+def full_content_headers(mime_type, file_size, mtime, etag):
+    return {
+        'Content-Type': mime_type,
+        'Content-Length': str(file_size),
+        'Content-Disposition': 'inline',
+        'Accept-Ranges': 'bytes',
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(mtime),
+        'Cache-Control': 'no-cache'
+    }
+
+
+def serve_full_content(movie, mime_type, file_size, mtime, etag, layout, environ=None, stream=None):
+    segments = [(0, file_size)]
+    if layout is not None:
+        segments = layout.map_segments(segments)
+    headers = full_content_headers(mime_type, file_size, mtime, etag)
+    return Response(iter_segments(movie, segments, environ, stream), 200, headers=headers, direct_passthrough=True)
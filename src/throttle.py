@@ -0,0 +1,188 @@
+import time
+import threading
+from src.config import Config
+from src.mp4 import mp4_index_cache
+from src.metrics import stream_bytes, stream_latency
+
+MBIT = 125000
+
+
+class TokenBucket:
+    def __init__(self, rate, burst_seconds):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.tokens = None
+        self.updated = time.monotonic()
+        self.streams = 0
+        self.last_used = 0
+
+    def reserve(self, amount, now):
+        # The balance may go negative; the debt is how long the caller waits,
+        # so chunks larger than the burst still average out to the rate.
+        if not self.rate:
+            return 0.0
+        burst = self.rate * self.burst_seconds
+        if self.tokens is None:
+            self.tokens = burst
+        self.tokens = min(burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_idle(self, now):
+        # An unused bucket that has refilled behaves like a new one, so it
+        # can be dropped without handing out a fresh burst early
+        if self.streams or now - self.last_used <= Config.STREAM_ACTIVE_WINDOW:
+            return False
+        if not self.rate or self.tokens is None:
+            return True
+        return self.tokens + (now - self.updated) * self.rate >= self.rate * self.burst_seconds
+
+
+class Stream:
+    def __init__(self, scheduler, session, room, movie, rate):
+        self.scheduler = scheduler
+        self.session = session
+        self.room = room
+        self.movie = movie
+        self.started = time.perf_counter()
+        self.bucket = TokenBucket(rate, scheduler.burst_seconds) if rate else None
+        self.opened = False
+        self.closed = False
+
+    @property
+    def limited(self):
+        return self.scheduler.enabled
+
+    def reserve(self, amount):
+        return self.scheduler.reserve(self, amount)
+
+    def pace(self, amount):
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    def paced(self, chunks):
+        for chunk in chunks:
+            self.pace(len(chunk))
+            yield chunk
+
+    def close(self):
+        self.scheduler.release(self)
+
+
+class StreamScheduler:
+    # Buckets are kept per session and per room. The total uplink is split
+    # evenly between sessions that sent data recently, so a client opening
+    # many parallel ranges still only gets one share.
+    def __init__(self, total_rate, session_rate, room_rate, bitrate_multiple, burst_seconds):
+        self.total_rate = total_rate
+        self.session_rate = session_rate
+        self.room_rate = room_rate
+        self.bitrate_multiple = bitrate_multiple
+        self.burst_seconds = burst_seconds
+        self.enabled = bool(total_rate or session_rate or room_rate or bitrate_multiple)
+        self._sessions = {}
+        self._rooms = {}
+        self._total = TokenBucket(total_rate, burst_seconds)
+        self._lock = threading.Lock()
+        self._last_prune = 0
+
+    def open(self, session, room=None, movie=None, bitrate=None):
+        rate = bitrate * self.bitrate_multiple if bitrate and self.bitrate_multiple else None
+        return Stream(self, session, room, movie, rate)
+
+    def _share(self, now):
+        active = sum(1 for bucket in self._sessions.values()
+                     if bucket.streams and now - bucket.last_used <= Config.STREAM_ACTIVE_WINDOW)
+        return self.total_rate / max(1, active) if self.total_rate else None
+
+    def _acquire(self, stream):
+        # Streams are only counted once they send data, so responses that are
+        # never iterated do not need to be released
+        stream.opened = True
+        self._prune(time.monotonic())
+        session = self._sessions.get(stream.session)
+        if session is None:
+            session = self._sessions[stream.session] = TokenBucket(self.session_rate, self.burst_seconds)
+        session.streams += 1
+        if stream.room is not None:
+            room = self._rooms.get(stream.room)
+            if room is None:
+                room = self._rooms[stream.room] = TokenBucket(self.room_rate, self.burst_seconds)
+            room.streams += 1
+
+    def reserve(self, stream, amount):
+        if not stream.opened:
+            stream_latency.observe(time.perf_counter() - stream.started, stream.movie)
+        stream_bytes.inc(stream.movie, amount=amount)
+        now = time.monotonic()
+        with self._lock:
+            if stream.closed:
+                return 0.0
+            if not stream.opened:
+                self._acquire(stream)
+            if not self.enabled:
+                return 0.0
+            session = self._sessions[stream.session]
+            session.last_used = now
+            limits = [rate for rate in (self.session_rate, self._share(now)) if rate]
+            session.rate = min(limits) if limits else None
+            delay = max(session.reserve(amount, now), self._total.reserve(amount, now))
+            if stream.room is not None:
+                room = self._rooms[stream.room]
+                room.last_used = now
+                delay = max(delay, room.reserve(amount, now))
+            if stream.bucket is not None:
+                delay = max(delay, stream.bucket.reserve(amount, now))
+            return delay
+
+    def release(self, stream):
+        with self._lock:
+            if stream.closed:
+                return
+            stream.closed = True
+            if not stream.opened:
+                return
+            # Buckets outlive their last stream, otherwise closing and
+            # reopening a range would start over with a full burst
+            for buckets, key in ((self._sessions, stream.session), (self._rooms, stream.room)):
+                bucket = buckets.get(key)
+                if bucket is not None:
+                    bucket.streams -= 1
+
+    def _prune(self, now):
+        if now - self._last_prune < Config.STREAM_ACTIVE_WINDOW:
+            return
+        self._last_prune = now
+        for buckets in (self._sessions, self._rooms):
+            for key in [key for key, bucket in buckets.items() if bucket.is_idle(now)]:
+                del buckets[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'streams': sum(bucket.streams for bucket in self._sessions.values()),
+                'sessions': sum(1 for bucket in self._sessions.values() if bucket.streams)
+            }
+
+
+def movie_bitrate(file_path, stat_result):
+    index = mp4_index_cache.get(file_path, stat_result)
+    if index is None or not index.duration:
+        return None
+    return stat_result.st_size / index.duration
+
+
+def open_stream(username, room, movie, file_path, stat_result):
+    bitrate = movie_bitrate(file_path, stat_result) if stream_scheduler.bitrate_multiple else None
+    return stream_scheduler.open(username, room, movie, bitrate)
+
+
+stream_scheduler = StreamScheduler(
+    Config.STREAM_TOTAL_MBPS * MBIT,
+    Config.STREAM_SESSION_MBPS * MBIT,
+    Config.STREAM_ROOM_MBPS * MBIT,
+    Config.STREAM_BITRATE_MULTIPLE,
+    Config.STREAM_BURST_SECONDS
+)
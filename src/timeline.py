@@ -0,0 +1,49 @@
+import math
+import time
+from src.config import Config
+
+
+def server_time():
+    # Wall-clock time, because playback stamps are stored by the sqlite
+    # backend and have to stay meaningful across workers and reboots.
+    return time.time()
+
+
+def playback_time(value):
+    # Positions sent by clients; anything but a finite, non-negative number
+    # is rejected so it never reaches the stored playback state
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    position = float(value)
+    return position if math.isfinite(position) and position >= 0 else None
+
+
+def position_at(playback, at=None):
+    # A bad value written before positions were checked reads as the start
+    position = playback_time(playback.get('current_time')) or 0.0
+    updated_at = playback.get('updated_at')
+    if playback.get('is_playing') and updated_at is not None:
+        elapsed = (server_time() if at is None else at) - updated_at
+        position += max(0.0, elapsed) * playback.get('rate', 1.0)
+    return position
+
+
+def event_time(data):
+    # Clients stamp control events with their estimate of the server clock,
+    # which removes the uplink latency from the stored reference time.
+    now = server_time()
+    at = data.get('at')
+    if isinstance(at, (int, float)) and now - Config.CLOCK_MAX_EVENT_AGE <= at <= now:
+        return at
+    return now
+
+
+def timeline_payload(playback):
+    now = server_time()
+    return {
+        'time': position_at(playback, now),
+        'is_playing': playback.get('is_playing', False),
+        'rate': playback.get('rate', 1.0),
+        'seq': playback.get('seq', 0),
+        'server_time': now
+    }
@@ -15,28 +15,17 @@ def load_users():
         return default_users
 
 def get_user_avatar_url(username):
-    if not os.path.exists(Config.AVATAR_FOLDER):
-        return None
-    
-    for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-        avatar_path = os.path.join(Config.AVATAR_FOLDER, f"{username}{ext}")
-        if os.path.exists(avatar_path):
-            return f"/avatars/{username}"
-    
-    return None
+    from src.avatars import avatar_registry
+    return avatar_registry.get_url(username)
+
+def get_user_avatar_display(username):
+    from src.avatars import avatar_registry
+    return avatar_registry.get_display(username)
 
 def get_video_mime_type(filename):
     file_ext = os.path.splitext(filename)[1].lower()
     return Config.VIDEO_MIME_TYPES.get(file_ext, 'video/mp4')
 
 def get_movies_list():
-    if not os.path.exists(Config.MOVIE_FOLDER):
-        return []
-    
-    all_files = [f for f in os.listdir(Config.MOVIE_FOLDER) 
-                 if f.endswith(Config.VIDEO_EXTENSIONS)]
-    
-    supported_formats = [f for f in all_files if f.endswith(('.mp4', '.webm', '.m4v', '.mkv'))]
-    other_formats = [f for f in all_files if not f.endswith(('.mp4', '.webm', '.m4v', '.mkv'))]
-    
-    return sorted(supported_formats) + sorted(other_formats)
\ No newline at end of file
+    from src.library import movie_library
+    return movie_library.get_movies()
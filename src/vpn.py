@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+import ipaddress
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from src.config import Config
+
+
+class CidrIndex:
+    # Ranges are merged into sorted, non-overlapping intervals per address
+    # family, so a lookup is one bisect over the interval starts.
+    def __init__(self, networks=()):
+        self._starts = {4: [], 6: []}
+        self._ends = {4: [], 6: []}
+        intervals = {4: [], 6: []}
+        for network in networks:
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        for version, ranges in intervals.items():
+            for start, end in sorted(ranges):
+                ends = self._ends[version]
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    self._starts[version].append(start)
+                    ends.append(end)
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    @classmethod
+    def load(cls, path):
+        networks = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                try:
+                    networks.append(ipaddress.ip_network(line, strict=False))
+                except ValueError:
+                    logging.warning(f"Ignoring invalid range in {path}: {line}")
+        return cls(networks)
+
+    def contains(self, address):
+        value = int(address)
+        starts = self._starts[address.version]
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= self._ends[address.version][index]
+
+
+class VpnDetector:
+    def __init__(self, mode, cidr_file):
+        self.mode = mode
+        self.cidr_file = cidr_file
+        self._index = CidrIndex()
+        self._index_mtime = None
+        self._index_checked = 0
+        self._verdicts = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _offline_index(self):
+        now = time.monotonic()
+        if now - self._index_checked < Config.VPN_CIDR_RELOAD_INTERVAL:
+            return self._index
+        self._index_checked = now
+        try:
+            mtime = os.stat(self.cidr_file).st_mtime
+        except OSError:
+            return self._index
+        if mtime != self._index_mtime:
+            self._index = CidrIndex.load(self.cidr_file)
+            self._index_mtime = mtime
+            logging.getLogger('MovieApp').info(f"Loaded {len(self._index)} VPN/hosting ranges from {self.cidr_file}")
+        return self._index
+
+    def _cached(self, ip):
+        with self._lock:
+            entry = self._verdicts.get(ip)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._verdicts[ip]
+                return None
+            self._verdicts.move_to_end(ip)
+            return entry[0]
+
+    def _remember(self, ip, verdict, ttl):
+        with self._lock:
+            self._verdicts[ip] = (verdict, time.monotonic() + ttl)
+            self._verdicts.move_to_end(ip)
+            while len(self._verdicts) > Config.VPN_CACHE_SIZE:
+                self._verdicts.popitem(last=False)
+
+    def check(self, ip, on_verdict=None):
+        # Returns True or False when the answer is known right away. Otherwise
+        # returns None, looks the address up on a worker thread and calls
+        # on_verdict(is_vpn) when the answer arrives.
+        try:
+            address = ipaddress.ip_address(ip)
+        except (TypeError, ValueError):
+            return False
+        if address.is_private or address.is_loopback or address.is_link_local:
+            return False
+        if self.mode in ('offline', 'both') and self._offline_index().contains(address):
+            return True
+        if self.mode == 'offline':
+            return False
+        verdict = self._cached(ip)
+        if verdict is not None:
+            return verdict
+        with self._lock:
+            future = self._pending.get(ip)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=Config.VPN_LOOKUP_WORKERS,
+                                                        thread_name_prefix='vpn-lookup')
+                future = self._pending[ip] = self._executor.submit(self._lookup, ip)
+        if on_verdict is not None:
+            future.add_done_callback(lambda f: on_verdict(f.result()))
+        return None
+
+    def _lookup(self, ip):
+        import requests
+        try:
+            verdict = query_ip_api(ip)
+            self._remember(ip, verdict, Config.VPN_CACHE_TTL if verdict else Config.VPN_NEGATIVE_CACHE_TTL)
+        except (requests.RequestException, ValueError) as e:
+            # Lookups fail open, and the failure is remembered briefly so an
+            # outage does not turn every reconnect into another request
+            logging.getLogger('MovieApp').warning(f"VPN lookup failed for {ip}: {e}")
+            verdict = False
+            self._remember(ip, verdict, Config.VPN_ERROR_CACHE_TTL)
+        finally:
+            with self._lock:
+                self._pending.pop(ip, None)
+        return verdict
+
+
+def query_ip_api(ip):
+    import requests
+    response = requests.get(f"http://ip-api.com/json/{ip}?fields=status,proxy,hosting", timeout=3)
+    response.raise_for_status()
+    data = response.json()
+    if data.get('status') != 'success':
+        raise ValueError(f"lookup status {data.get('status')}")
+    return bool(data.get('proxy', False) or data.get('hosting', False))
+
+
+vpn_detector = VpnDetector(Config.VPN_DETECTION_MODE, Config.VPN_CIDR_FILE)
@@ -0,0 +1,156 @@
+import json
+import zlib
+import threading
+import socketio
+from src.config import Config
+
+COMPRESSED_KEY = '$z'
+
+# A schema maps payload fields to their short names. A field whose value is
+# itself structured maps to [short_name, nested], where nested is
+# {'items': schema} for lists of objects or {'values': schema} for objects
+# keyed by data such as usernames. Fields that are not listed are sent as-is.
+MESSAGE = {
+    'id': 'i', 'seq': 'q', 'username': 'u', 'avatar': 'a', 'avatar_url': 'au', 'message': 'm',
+    'timestamp': 'ts', 'reactions': 'r', 'spoiler': 'sp'
+}
+USER = {
+    'avatar': 'a', 'avatar_url': 'au', 'joined_at': 'j', 'is_watching': 'w', 'current_time': 't', 'typing': 'ty'
+}
+TIMELINE = {
+    'time': 't', 'is_playing': 'p', 'rate': 'r', 'seq': 'q', 'server_time': 'st', 'username': 'u', 'movie': 'm',
+    'current_movie': 'cm', 'current_time': 'ct', 'updated_at': 'ua'
+}
+REACTION = {
+    'username': 'u', 'avatar': 'a', 'emoji': 'e', 'timestamp': 'ts', 'video_time': 'vt', 'count': 'n', 'users': 'us'
+}
+
+SCHEMAS = {
+    'chat_history': {
+        'messages': ['ms', {'items': MESSAGE}], 'before': 'b', 'cursor': 'c', 'has_more': 'h'
+    },
+    'new_message': MESSAGE,
+    'users_update': {
+        'users': 'us', 'count': 'n', 'user_details': ['d', {'values': USER}], 'typing_users': 'ty', 'version': 'v'
+    },
+    'presence_delta': {
+        'version': 'v', 'joined': ['j', {'values': USER}], 'left': 'l', 'changed': ['c', {'values': USER}],
+        'count': 'n'
+    },
+    'sync_state': TIMELINE,
+    'play_video': TIMELINE,
+    'pause_video': TIMELINE,
+    'seek_video': TIMELINE,
+    'movie_changed': TIMELINE,
+    'new_reaction': REACTION,
+    'message_reaction_update': {'message_id': 'i', 'reactions': 'r', 'user': 'u'}
+}
+
+
+def shorten(value, schema):
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for key, item in value.items():
+        rule = schema.get(key)
+        if rule is None:
+            result[key] = item
+        elif isinstance(rule, str):
+            result[rule] = item
+        else:
+            short, nested = rule
+            if 'items' in nested and isinstance(item, list):
+                item = [shorten(entry, nested['items']) for entry in item]
+            elif 'values' in nested and isinstance(item, dict):
+                item = {name: shorten(entry, nested['values']) for name, entry in item.items()}
+            result[short] = item
+    return result
+
+
+class WireCodec:
+    # Negotiated per connection through the `wire` query argument, e.g.
+    # ?wire=short,deflate. Clients that do not ask get plain JSON.
+    def __init__(self, short_keys, deflate):
+        self.short_keys = short_keys
+        self.deflate = deflate
+
+    @staticmethod
+    def from_query(value):
+        options = {option.strip() for option in (value or '').split(',')}
+        return CODECS.get(('short' in options, 'deflate' in options))
+
+    def encode(self, event, data):
+        if not isinstance(data, dict):
+            return data
+        schema = SCHEMAS.get(event)
+        if self.short_keys and schema is not None:
+            data = shorten(data, schema)
+        if self.deflate:
+            # Large payloads such as chat history and presence snapshots go
+            # out as one deflated binary attachment
+            raw = json.dumps(data, separators=(',', ':')).encode()
+            if len(raw) >= Config.WIRE_COMPRESS_MIN_BYTES:
+                return {COMPRESSED_KEY: zlib.compress(raw, Config.WIRE_COMPRESS_LEVEL)}
+        return data
+
+
+# Shared instances, so recipients that negotiated the same options are
+# grouped together and their payload is encoded once
+CODECS = {options: WireCodec(*options) for options in ((True, False), (False, True), (True, True))}
+
+
+class WireCodecs:
+    def __init__(self):
+        self._codecs = {}
+        self._lock = threading.Lock()
+
+    def negotiate(self, sid, value):
+        codec = WireCodec.from_query(value) if Config.WIRE_COMPACT_ENABLED else None
+        with self._lock:
+            if codec is None:
+                self._codecs.pop(sid, None)
+            else:
+                self._codecs[sid] = codec
+        return codec
+
+    def forget(self, sid):
+        with self._lock:
+            self._codecs.pop(sid, None)
+
+    def split(self, manager, event, data, namespace, room, skip_sid):
+        # Yields one (payload, skip_sid) pair per codec used by the
+        # recipients, so each payload is encoded once however many clients
+        # receive it
+        if not self._codecs or namespace not in manager.rooms:
+            yield data, skip_sid
+            return
+        skip = skip_sid if isinstance(skip_sid, list) else [skip_sid]
+        groups = {}
+        for sid, _ in manager.get_participants(namespace, room):
+            if sid not in skip:
+                groups.setdefault(self._codecs.get(sid), []).append(sid)
+        if len(groups) <= 1:
+            codec = next(iter(groups), None)
+            yield (data if codec is None else codec.encode(event, data)), skip_sid
+            return
+        for codec, sids in groups.items():
+            others = [sid for other, members in groups.items() if other is not codec for sid in members]
+            yield (data if codec is None else codec.encode(event, data)), skip + others
+
+    def schema(self):
+        return {'enabled': Config.WIRE_COMPACT_ENABLED, 'compressed_key': COMPRESSED_KEY, 'events': SCHEMAS}
+
+
+class WireManager(socketio.BaseManager):
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        for payload, skip in wire_codecs.split(self, event, data, namespace, room, skip_sid):
+            super().emit(event, payload, namespace, room=room, skip_sid=skip, callback=callback, **kwargs)
+
+
+class AsyncWireManager(socketio.AsyncManager):
+    async def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        for payload, skip in wire_codecs.split(self, event, data, namespace, room, skip_sid):
+            await super().emit(event, payload, namespace, room=room, skip_sid=skip, callback=callback, **kwargs)
+
+
+wire_codecs = WireCodecs()
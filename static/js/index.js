@@ -1,4 +1,15 @@
-const socket = io();
+const wireOptions = [];
+if (WIRE.enabled) {
+    wireOptions.push('short');
+    if (typeof DecompressionStream !== 'undefined') {
+        wireOptions.push('deflate');
+    }
+}
+const socketQuery = { room: CURRENT_ROOM };
+if (wireOptions.length) {
+    socketQuery.wire = wireOptions.join(',');
+}
+const socket = io({ query: socketQuery });
 const video = document.getElementById('videoPlayer');
 const chatMessages = document.getElementById('chatMessages');
 const messageInput = document.getElementById('messageInput');
@@ -14,6 +25,95 @@ let isTyping = false;
 let heartbeatInterval = null;
 let userScrolledUp = false;
 let autoScrollEnabled = true;
+let presenceVersion = -1;
+let presenceUsers = {};
+let chatCursor = null;
+let chatHasMore = false;
+let chatLoading = false;
+let timeline = null;
+let playbackSeq = 0;
+let clockPingInterval = null;
+let driftInterval = null;
+let libraryVersion = LIBRARY_VERSION;
+let libraryLoaded = false;
+const clock = { offset: null, samples: [] };
+
+const CLOCK_SAMPLES = 8;
+const CLOCK_PING_INTERVAL = 10000;
+const DRIFT_CHECK_INTERVAL = 1000;
+const DRIFT_TOLERANCE = 0.05;
+const DRIFT_HARD_SEEK = 1.5;
+const MAX_RATE_CORRECTION = 0.08;
+const MAX_REACTION_ANIMATIONS = 8;
+
+// Compact payloads use short field names from the server's schemas and
+// large ones arrive deflated; they are decoded in order before the handlers run.
+function invertSchema(schema) {
+    const inverse = {};
+    for (const [name, rule] of Object.entries(schema)) {
+        if (typeof rule === 'string') {
+            inverse[rule] = [name, null];
+        } else {
+            const nested = rule[1].items ? { items: invertSchema(rule[1].items) } : { values: invertSchema(rule[1].values) };
+            inverse[rule[0]] = [name, nested];
+        }
+    }
+    return inverse;
+}
+
+const wireSchemas = {};
+for (const [event, schema] of Object.entries(WIRE.events)) {
+    wireSchemas[event] = invertSchema(schema);
+}
+
+function expandPayload(value, inverse) {
+    if (!value || typeof value !== 'object' || Array.isArray(value)) {
+        return value;
+    }
+    const result = {};
+    for (const [key, item] of Object.entries(value)) {
+        const rule = inverse[key];
+        if (!rule) {
+            result[key] = item;
+            continue;
+        }
+        const [name, nested] = rule;
+        if (nested && nested.items && Array.isArray(item)) {
+            result[name] = item.map((entry) => expandPayload(entry, nested.items));
+        } else if (nested && nested.values && item && typeof item === 'object') {
+            result[name] = {};
+            for (const [entryKey, entry] of Object.entries(item)) {
+                result[name][entryKey] = expandPayload(entry, nested.values);
+            }
+        } else {
+            result[name] = item;
+        }
+    }
+    return result;
+}
+
+async function inflatePayload(data) {
+    const stream = new Blob([data]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return JSON.parse(await new Response(stream).text());
+}
+
+let wireQueue = Promise.resolve();
+const socketOn = socket.on.bind(socket);
+socket.on = (event, handler) => socketOn(event, (payload) => {
+    if (!wireOptions.length) {
+        return handler(payload);
+    }
+    wireQueue = wireQueue.then(async () => {
+        let data = payload;
+        if (data && data[WIRE.compressed_key] !== undefined) {
+            data = await inflatePayload(data[WIRE.compressed_key]);
+        }
+        if (wireSchemas[event]) {
+            data = expandPayload(data, wireSchemas[event]);
+        }
+        handler(data);
+    }).catch((error) => console.error(`Failed to decode ${event}:`, error));
+});
 
 socket.on('connect', () => {
     status.textContent = 'Connected';
@@ -25,14 +125,30 @@ socket.on('connect', () => {
         connStatus.classList.remove('disconnected');
     }
     
+    clock.samples = [];
+    for (let i = 0; i < 4; i++) {
+        setTimeout(sendClockPing, i * 250);
+    }
+    clockPingInterval = setInterval(sendClockPing, CLOCK_PING_INTERVAL);
+    if (!driftInterval) {
+        driftInterval = setInterval(correctDrift, DRIFT_CHECK_INTERVAL);
+    }
+
     heartbeatInterval = setInterval(() => {
         if (video) {
             socket.emit('heartbeat', {
                 time: video.currentTime,
-                is_watching: !video.paused
+                is_watching: !video.paused,
+                movie: movieSelector.value
             });
         }
     }, 5000);
+
+    // Catch up on library changes announced while disconnected
+    if (libraryLoaded) {
+        syncLibrary();
+    }
+    libraryLoaded = true;
 });
 
 socket.on('disconnect', () => {
@@ -49,18 +165,62 @@ socket.on('disconnect', () => {
         clearInterval(heartbeatInterval);
         heartbeatInterval = null;
     }
+    if (clockPingInterval) {
+        clearInterval(clockPingInterval);
+        clockPingInterval = null;
+    }
+    presenceVersion = -1;
+});
+
+socket.on('room_joined', (data) => {
+    const roomName = document.getElementById('roomName');
+    if (roomName) {
+        roomName.textContent = data.room;
+    }
+    chatMessages.innerHTML = '';
+    chatCursor = null;
+    chatHasMore = false;
+    chatLoading = false;
+});
+
+socket.on('room_error', (data) => {
+    addSystemMessage(data.message);
+});
+
+socket.on('clock_pong', (data) => {
+    const now = performance.now() / 1000;
+    const rtt = now - data.t;
+    if (rtt < 0) {
+        return;
+    }
+    clock.samples.push({ rtt: rtt, offset: data.server_time + rtt / 2 - now });
+    if (clock.samples.length > CLOCK_SAMPLES) {
+        clock.samples.shift();
+    }
+    // The sample with the shortest round trip has the least asymmetric delay
+    const best = clock.samples.reduce((a, b) => (b.rtt < a.rtt ? b : a));
+    clock.offset = best.offset;
 });
 
 socket.on('sync_state', (state) => {
+    timeline = state;
+    playbackSeq = state.seq;
     if (video && state.current_time) {
-        video.currentTime = state.current_time;
+        video.currentTime = expectedPosition();
     }
 });
 
 socket.on('play_video', (data) => {
+    if (!acceptControl(data)) {
+        return;
+    }
     if (video && !isSyncing) {
         isSyncing = true;
-        video.currentTime = data.time;
+        timeline = data;
+        const target = expectedPosition();
+        if (Math.abs(video.currentTime - target) > DRIFT_HARD_SEEK) {
+            video.currentTime = target;
+        }
         video.play();
         addSystemMessage(`${data.username} played the video`);
         setTimeout(() => isSyncing = false, 100);
@@ -68,30 +228,110 @@ socket.on('play_video', (data) => {
 });
 
 socket.on('pause_video', (data) => {
+    if (!acceptControl(data)) {
+        return;
+    }
     if (video && !isSyncing) {
         isSyncing = true;
-        video.currentTime = data.time;
+        timeline = data;
         video.pause();
+        video.playbackRate = 1;
+        if (Math.abs(video.currentTime - data.time) > DRIFT_TOLERANCE) {
+            video.currentTime = data.time;
+        }
         addSystemMessage(`${data.username} paused the video`);
         setTimeout(() => isSyncing = false, 100);
     }
 });
 
 socket.on('seek_video', (data) => {
+    if (!acceptControl(data)) {
+        return;
+    }
     if (video && !isSyncing) {
         isSyncing = true;
-        lastSeekTime = data.time;
-        video.currentTime = data.time;
+        timeline = data;
+        const target = expectedPosition();
+        lastSeekTime = target;
+        if (Math.abs(video.currentTime - target) > DRIFT_TOLERANCE) {
+            video.currentTime = target;
+        }
         addSystemMessage(`${data.username} seeked to ${formatTime(data.time)}`);
         setTimeout(() => isSyncing = false, 500);
     }
 });
 
+function acceptControl(data) {
+    // Broadcasts can arrive out of order or twice when several workers
+    // relay them; anything older than the state already applied is dropped
+    if (data.seq <= playbackSeq) {
+        return false;
+    }
+    playbackSeq = data.seq;
+    return true;
+}
+
+function sendClockPing() {
+    socket.emit('clock_ping', { t: performance.now() / 1000 });
+}
+
+function serverNow() {
+    return clock.offset === null ? null : performance.now() / 1000 + clock.offset;
+}
+
+function expectedPosition() {
+    const now = serverNow();
+    if (!timeline.is_playing || now === null) {
+        return timeline.time;
+    }
+    return timeline.time + Math.max(0, now - timeline.server_time) * timeline.rate;
+}
+
+function setLocalTimeline(isPlaying) {
+    const now = serverNow();
+    if (now !== null) {
+        timeline = { time: video.currentTime, is_playing: isPlaying, rate: 1, server_time: now };
+    }
+}
+
+function controlEvent(data) {
+    const now = serverNow();
+    if (now !== null) {
+        data.at = now;
+    }
+    return data;
+}
+
+function correctDrift() {
+    if (!video || !timeline || isSyncing || video.paused || video.seeking || !timeline.is_playing || clock.offset === null) {
+        return;
+    }
+    const drift = video.currentTime - expectedPosition();
+    if (Math.abs(drift) > DRIFT_HARD_SEEK) {
+        isSyncing = true;
+        video.playbackRate = timeline.rate;
+        lastSeekTime = expectedPosition();
+        video.currentTime = lastSeekTime;
+        setTimeout(() => isSyncing = false, 500);
+    } else if (Math.abs(drift) > DRIFT_TOLERANCE) {
+        // Nudge the rate so small drift closes over a few seconds instead of
+        // seeking, which would throw away the buffer and refetch the range
+        const correction = Math.max(-MAX_RATE_CORRECTION, Math.min(MAX_RATE_CORRECTION, drift / 2));
+        video.playbackRate = timeline.rate * (1 - correction);
+    } else {
+        video.playbackRate = timeline.rate;
+    }
+}
+
 socket.on('movie_changed', (data) => {
+    if (!acceptControl(data)) {
+        return;
+    }
     if (!isSyncing) {
         addSystemMessage(`${data.username} changed the movie to: ${data.movie}`);
         
         movieSelector.value = data.movie;
+        timeline = data;
 
         if (video && data.movie) {
             const newSrc = `/movies/${encodeURIComponent(data.movie)}`;
@@ -122,9 +362,42 @@ socket.on('movie_changed', (data) => {
 });
 
 socket.on('users_update', (data) => {
+    if (typeof data.version === 'number') {
+        presenceVersion = data.version;
+        presenceUsers = {};
+        data.users.forEach(username => {
+            presenceUsers[username] = Object.assign({}, data.user_details[username]);
+        });
+    }
     updateUserList(data.users, data.count, data.user_details, data.typing_users || []);
 });
 
+socket.on('presence_delta', (delta) => {
+    if (presenceVersion < 0 || delta.version <= presenceVersion) {
+        return;
+    }
+    if (delta.version !== presenceVersion + 1) {
+        presenceVersion = -1;
+        socket.emit('presence_resync');
+        return;
+    }
+    presenceVersion = delta.version;
+    for (const [username, details] of Object.entries(delta.joined)) {
+        presenceUsers[username] = Object.assign({}, details);
+    }
+    delta.left.forEach(username => {
+        delete presenceUsers[username];
+    });
+    for (const [username, fields] of Object.entries(delta.changed)) {
+        if (presenceUsers[username]) {
+            Object.assign(presenceUsers[username], fields);
+        }
+    }
+    const users = Object.keys(presenceUsers);
+    const typingUsers = users.filter(username => presenceUsers[username].typing);
+    updateUserList(users, users.length, presenceUsers, typingUsers);
+});
+
 socket.on('user_joined', (data) => {
     // Only show username for join messages, avatar is handled in user list
     addSystemMessage(`${data.username} joined the room`);
@@ -139,11 +412,26 @@ socket.on('new_message', (data) => {
     addMessage(data.username, data.message, data.timestamp, data.avatar, data.id, data.reactions, true, isSpoiler);
 });
 
-socket.on('chat_history', (messages) => {
-    messages.forEach(msg => {
+socket.on('chat_history', (page) => {
+    chatLoading = false;
+    chatHasMore = page.has_more;
+    chatCursor = page.cursor;
+    if (page.before === null) {
+        page.messages.forEach(msg => {
+            const isSpoiler = typeof msg.spoiler === 'boolean' ? msg.spoiler : false;
+            addMessage(msg.username, msg.message, msg.timestamp, msg.avatar, msg.id, msg.reactions, false, isSpoiler);
+        });
+        smartScroll();
+        return;
+    }
+    const previousHeight = chatMessages.scrollHeight;
+    const fragment = document.createDocumentFragment();
+    page.messages.forEach(msg => {
         const isSpoiler = typeof msg.spoiler === 'boolean' ? msg.spoiler : false;
-        addMessage(msg.username, msg.message, msg.timestamp, msg.avatar, msg.id, msg.reactions, false, isSpoiler);
+        fragment.appendChild(createMessageElement(msg.username, msg.message, msg.timestamp, msg.avatar, msg.id, msg.reactions, isSpoiler));
     });
+    chatMessages.insertBefore(fragment, chatMessages.firstChild);
+    chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
 });
 
 socket.on('message_reaction_update', (data) => {
@@ -159,8 +447,14 @@ socket.on('user_stopped_typing', (data) => {
 });
 
 socket.on('new_reaction', (data) => {
-    showReactionAnimation(data);
-    addSystemMessage(`${data.username} reacted with ${data.emoji} at ${formatTime(data.video_time)}`);
+    // Reactions arrive summarized per emoji over a short window
+    const count = data.count || 1;
+    for (let i = 0; i < Math.min(count, MAX_REACTION_ANIMATIONS); i++) {
+        setTimeout(() => showReactionAnimation(data), i * 150);
+    }
+    const users = data.users && data.users.length ? data.users : [data.username];
+    const times = count > 1 ? ` ×${count}` : '';
+    addSystemMessage(`${users.join(', ')} reacted with ${data.emoji}${times} at ${formatTime(data.video_time)}`);
 });
 
 if (video) {
@@ -194,13 +488,16 @@ if (video) {
     
     video.addEventListener('play', () => {
         if (!isSyncing) {
-            socket.emit('play', { time: video.currentTime });
+            socket.emit('play', controlEvent({ time: video.currentTime }));
+            setLocalTimeline(true);
         }
     });
     
     video.addEventListener('pause', () => {
         if (!isSyncing) {
-            socket.emit('pause', { time: video.currentTime });
+            video.playbackRate = 1;
+            socket.emit('pause', controlEvent({ time: video.currentTime }));
+            setLocalTimeline(false);
         }
     });
     
@@ -208,11 +505,13 @@ if (video) {
         if (!isSyncing) {
             const currentTime = video.currentTime;
             if (Math.abs(currentTime - lastSeekTime) > 0.5) {
+                const event = controlEvent({ time: currentTime });
                 clearTimeout(seekTimeout);
                 seekTimeout = setTimeout(() => {
-                    socket.emit('seek', { time: currentTime });
+                    socket.emit('seek', event);
                     lastSeekTime = currentTime;
                 }, 200);
+                setLocalTimeline(!video.paused);
             }
         }
     });
@@ -225,6 +524,59 @@ movieSelector.addEventListener('change', (e) => {
     }
 });
 
+function movieOptions() {
+    return Array.from(movieSelector.options).filter(option => option.value);
+}
+
+function applyLibraryChanges(added, removed) {
+    const removedSet = new Set(removed);
+    movieOptions().forEach(option => {
+        if (removedSet.has(option.value) && option.value !== movieSelector.value) {
+            option.remove();
+        }
+    });
+    const existing = new Set(movieOptions().map(option => option.value));
+    added.forEach(movie => {
+        if (existing.has(movie)) {
+            return;
+        }
+        const option = document.createElement('option');
+        option.value = movie;
+        option.textContent = movie;
+        const next = movieOptions().find(other => other.value.localeCompare(movie) > 0);
+        movieSelector.insertBefore(option, next || null);
+    });
+}
+
+async function syncLibrary() {
+    try {
+        const response = await fetch(`/api/movies?since=${libraryVersion}`);
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+        if (data.full) {
+            const current = new Set(data.movies);
+            applyLibraryChanges(data.movies, movieOptions().map(option => option.value).filter(movie => !current.has(movie)));
+        } else {
+            applyLibraryChanges(data.added, data.removed);
+        }
+        libraryVersion = data.version;
+    } catch (error) {
+        console.error('Could not refresh the movie list:', error);
+    }
+}
+
+socket.on('library_updated', (data) => {
+    if (data.previous_version === libraryVersion) {
+        applyLibraryChanges(data.added, data.removed);
+        libraryVersion = data.version;
+    } else if (data.version !== libraryVersion) {
+        // Missed an update, so ask for everything since the version we have
+        syncLibrary();
+    }
+});
+
 function toggleTheaterMode() {
     isTheaterMode = !isTheaterMode;
     document.body.classList.toggle('theater-mode', isTheaterMode);
@@ -299,10 +651,21 @@ if (chatMessages) {
         const isAtBottom = chatMessages.scrollHeight - chatMessages.scrollTop - chatMessages.clientHeight < 50;
         userScrolledUp = !isAtBottom;
         autoScrollEnabled = isAtBottom;
+        if (chatMessages.scrollTop < 50 && chatHasMore && !chatLoading) {
+            chatLoading = true;
+            socket.emit('chat_history', { before: chatCursor });
+        }
     });
 }
 
 function addMessage(username, message, timestamp, avatar, messageId, reactions = {}, scroll = true, spoiler = false) {
+    chatMessages.appendChild(createMessageElement(username, message, timestamp, avatar, messageId, reactions, spoiler));
+    if (scroll) {
+        smartScroll();
+    }
+}
+
+function createMessageElement(username, message, timestamp, avatar, messageId, reactions = {}, spoiler = false) {
     const div = document.createElement('div');
     div.className = 'message';
     div.dataset.messageId = messageId;
@@ -345,10 +708,7 @@ function addMessage(username, message, timestamp, avatar, messageId, reactions =
             <button onclick="reactToMessage('${messageId}', '😢')">😢</button>
         </div>
     `;
-    chatMessages.appendChild(div);
-    if (scroll) {
-        smartScroll();
-    }
+    return div;
 }
 
 function showTypingIndicator(username, avatar) {
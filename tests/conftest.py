@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+# Config is read at import time, so point every path at a scratch folder
+# before any src module is imported
+SCRATCH = tempfile.mkdtemp(prefix='syncinema-tests-')
+os.environ.update({
+    'SECRET_KEY': 'tests',
+    'STATE_BACKEND': 'memory',
+    'MOVIE_FOLDER': os.path.join(SCRATCH, 'movies'),
+    'AVATAR_FOLDER': os.path.join(SCRATCH, 'pfp'),
+    'MEDIA_INFO_CACHE_FILE': os.path.join(SCRATCH, 'media_info.json'),
+    'PROGRESS_DB_PATH': os.path.join(SCRATCH, 'progress.db'),
+    'STATE_DB_PATH': os.path.join(SCRATCH, 'state.db'),
+    'CHAT_LOG_ENABLED': 'false'
+})
+os.makedirs(os.environ['MOVIE_FOLDER'], exist_ok=True)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
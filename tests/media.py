@@ -0,0 +1,64 @@
+import struct
+
+# Builders for small but structurally complete media files
+
+
+def box(box_type, body=b''):
+    return struct.pack('>I4s', 8 + len(body), box_type.encode('latin-1')) + body
+
+
+def full_box(box_type, body=b'', version=0):
+    return box(box_type, bytes([version, 0, 0, 0]) + body)
+
+
+def sample_sizes(count):
+    return [1000 + (i * 37) % 500 for i in range(count)]
+
+
+def make_moov(data_start, sizes, samples_per_chunk=10, timescale=30000, delta=1000, keyframe_every=30):
+    offsets = []
+    offset = data_start
+    for first in range(0, len(sizes), samples_per_chunk):
+        offsets.append(offset)
+        offset += sum(sizes[first:first + samples_per_chunk])
+    keyframes = list(range(1, len(sizes) + 1, keyframe_every))
+    stbl = box('stbl',
+               full_box('stsd', struct.pack('>I', 0)) +
+               full_box('stts', struct.pack('>III', 1, len(sizes), delta)) +
+               full_box('stss', struct.pack('>I', len(keyframes)) + b''.join(struct.pack('>I', k) for k in keyframes)) +
+               full_box('stsc', struct.pack('>IIII', 1, 1, samples_per_chunk, 1)) +
+               full_box('stsz', struct.pack('>II', 0, len(sizes)) + b''.join(struct.pack('>I', s) for s in sizes)) +
+               full_box('stco', struct.pack('>I', len(offsets)) + b''.join(struct.pack('>I', o) for o in offsets)))
+    mdhd = full_box('mdhd', struct.pack('>IIII', 0, 0, timescale, len(sizes) * delta) + b'\0' * 4)
+    hdlr = full_box('hdlr', struct.pack('>I', 0) + b'vide' + b'\0' * 12 + b'v\0')
+    mvhd = full_box('mvhd', struct.pack('>IIII', 0, 0, timescale, len(sizes) * delta) + b'\0' * 80)
+    tkhd = full_box('tkhd', b'\0' * 72 + struct.pack('>II', 640 << 16, 360 << 16))
+    return box('moov', mvhd + box('trak', tkhd + box('mdia', mdhd + hdlr + box('minf', stbl))))
+
+
+def make_mp4(count=120, moov_last=True):
+    # Returns the file and the payload of every sample, which is its index
+    # repeated, so a sample can be recognised at any offset
+    sizes = sample_sizes(count)
+    samples = [bytes([i % 256]) * size for i, size in enumerate(sizes)]
+    ftyp = box('ftyp', b'isom\0\0\2\0isomiso2mp41')
+    mdat = struct.pack('>I4s', 8 + sum(sizes), b'mdat') + b''.join(samples)
+    if moov_last:
+        return ftyp + mdat + make_moov(len(ftyp) + 8, sizes), samples
+    moov_size = len(make_moov(0, sizes))
+    return ftyp + make_moov(len(ftyp) + moov_size + 8, sizes) + mdat, samples
+
+
+def vint(value):
+    for length in range(1, 9):
+        if value < (1 << (7 * length)) - 1:
+            return (value | (1 << (7 * length))).to_bytes(length, 'big')
+    raise ValueError(value)
+
+
+def element(element_id, data):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + vint(len(data)) + data
+
+
+def uint_element(element_id, value, length=2):
+    return element(element_id, value.to_bytes(length, 'big'))
@@ -0,0 +1,93 @@
+import os
+import threading
+import pytest
+from src import blockcache
+from src.blockcache import BlockCache
+
+BLOCK = 64
+
+
+@pytest.fixture
+def movie(tmp_path):
+    data = os.urandom(BLOCK * 10 + 17)
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(data)
+    fd = os.open(path, os.O_RDONLY)
+    yield fd, BlockCache.file_key(str(path), os.fstat(fd)), data
+    os.close(fd)
+
+
+def read(cache, movie, start, length):
+    fd, key, _ = movie
+    return b''.join(cache.iter_range(fd, key, start, length))
+
+
+@pytest.mark.parametrize('start, length', [
+    (0, BLOCK),                   # exactly one block
+    (10, 20),                     # inside one block
+    (BLOCK - 1, 2),               # across a block boundary
+    (5, BLOCK * 4),               # unaligned over several blocks
+    (BLOCK * 10, 17),             # the short last block
+    (BLOCK * 10 + 10, 100),       # past the end of the file
+])
+def test_ranges_match_the_file(movie, start, length):
+    cache = BlockCache(BLOCK * 100, BLOCK, 0)
+    assert read(cache, movie, start, length) == movie[2][start:start + length]
+
+
+def test_range_starting_past_the_end_is_empty(movie):
+    cache = BlockCache(BLOCK * 100, BLOCK, 0)
+    assert read(cache, movie, BLOCK * 20, 10) == b''
+
+
+def test_blocks_are_shared_between_reads(movie):
+    cache = BlockCache(BLOCK * 100, BLOCK, 0)
+    read(cache, movie, 0, BLOCK * 3)
+    read(cache, movie, 10, BLOCK * 2)
+    stats = cache.stats()
+    assert (stats['misses'], stats['hits']) == (3, 3)
+
+
+def test_size_limit_evicts_least_recently_used(movie):
+    cache = BlockCache(BLOCK * 3, BLOCK, 0)
+    read(cache, movie, 0, BLOCK * 3)
+    read(cache, movie, 0, 1)
+    read(cache, movie, BLOCK * 5, 1)
+    assert cache.stats()['bytes'] <= BLOCK * 3
+    fd, key, _ = movie
+    assert (key, 0) in cache._blocks and (key, 1) not in cache._blocks
+
+
+def test_changed_file_gets_new_blocks(movie):
+    cache = BlockCache(BLOCK * 100, BLOCK, 0)
+    fd, key, _ = movie
+    read(cache, movie, 0, BLOCK)
+    changed_key = (key[0], key[1], key[2] + 1)
+    list(cache.iter_range(fd, changed_key, 0, BLOCK))
+    assert cache.stats()['misses'] == 2
+
+
+def test_concurrent_readers_load_a_block_once(movie, monkeypatch):
+    cache = BlockCache(BLOCK * 100, BLOCK, 0)
+    release = threading.Event()
+    reads = []
+
+    def slow_read(fd, offset, size):
+        reads.append(offset)
+        release.wait(5)
+        return os.pread(fd, size, offset)
+    monkeypatch.setattr(blockcache, 'read_block', slow_read)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(read(cache, movie, 0, BLOCK))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert reads == [0]
+    assert results == [movie[2][:BLOCK]] * 4
+
+
+def test_disabled_when_smaller_than_a_block():
+    assert not BlockCache(BLOCK - 1, BLOCK, 0).enabled
+    assert not BlockCache(BLOCK, 0, 0).enabled
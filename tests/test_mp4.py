@@ -0,0 +1,125 @@
+import io
+import os
+import struct
+import pytest
+from src.mp4 import (parse_boxes, scan_top_level, Mp4Error, Mp4Index, Mp4IndexCache, Track, VirtualLayout,
+                     read_chunk_offsets)
+from media import box, full_box, make_mp4
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def scan_top_level_bytes(data):
+    return scan_top_level(io.BytesIO(data), len(data))
+
+
+def build(path):
+    stat_result = os.stat(path)
+    return Mp4Index.build(path, stat_result.st_size, stat_result.st_mtime)
+
+
+@pytest.mark.parametrize('data', [
+    b'\x00\x00\x00\x10fre',                           # header cut short
+    struct.pack('>I4s', 4, b'free'),                   # size smaller than the header
+    struct.pack('>I4s', 64, b'free') + b'\0' * 8,      # size past the end
+    struct.pack('>I4s', 1, b'free') + b'\0' * 4,       # 64-bit size cut short
+    struct.pack('>I4sQ', 1, b'free', 12),              # 64-bit size smaller than its header
+])
+def test_malformed_box_headers(data):
+    with pytest.raises(Mp4Error):
+        parse_boxes(data, 0, len(data))
+
+
+def test_container_children_must_fit_their_parent():
+    data = box('moov', struct.pack('>I4s', 100, b'trak'))
+    with pytest.raises(Mp4Error):
+        parse_boxes(data, 0, len(data))
+
+
+def test_special_sizes():
+    data = struct.pack('>I4sQ', 1, b'wide', 20) + b'abcd' + struct.pack('>I4s', 0, b'free') + b'rest'
+    boxes = parse_boxes(data, 0, len(data))
+    assert [(b.type, bytes(b.payload)) for b in boxes] == [('wide', b'abcd'), ('free', b'rest')]
+
+
+def test_serialize_round_trip():
+    data, _ = make_mp4(count=20)
+    moov_offset = next(offset for box_type, offset, _ in scan_top_level_bytes(data) if box_type == 'moov')
+    moov = parse_boxes(data, moov_offset, len(data))[0]
+    assert moov.serialize() == data[moov_offset:]
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    data, _ = make_mp4(count=20)
+    path = write(tmp_path, 'cut.mp4', data[:-50])
+    with pytest.raises(Mp4Error):
+        build(path)
+
+
+def test_truncated_sample_table_is_rejected():
+    stbl = box('stbl', full_box('stco', struct.pack('>I', 1000) + struct.pack('>I', 0)))
+    with pytest.raises(Mp4Error):
+        read_chunk_offsets(parse_boxes(stbl, 0, len(stbl))[0])
+
+
+def test_track_without_sample_table_is_rejected():
+    trak = box('trak', box('mdia', full_box('mdhd', b'\0' * 20) + full_box('hdlr', b'\0' * 20)))
+    with pytest.raises(Mp4Error):
+        Track(parse_boxes(trak, 0, len(trak))[0])
+
+
+def test_index_cache_caches_failures(tmp_path):
+    path = write(tmp_path, 'broken.mp4', b'\x00\x00\x00\x18ftypisom' + b'\0' * 100)
+    cache = Mp4IndexCache(4)
+    stat_result = os.stat(path)
+    assert cache.get(path, stat_result) is None
+    assert cache.layout(path, stat_result) is None
+    assert len(cache._entries) == 1
+    assert cache.get(write(tmp_path, 'clip.mkv', b''), stat_result) is None
+
+
+def test_moov_first_file_needs_no_layout(tmp_path):
+    data, _ = make_mp4(moov_last=False)
+    index = build(write(tmp_path, 'fast.mp4', data))
+    assert index.layout is None
+    assert index.duration == pytest.approx(4.0)
+
+
+def test_faststart_layout_moves_moov_and_rewrites_offsets(tmp_path):
+    data, samples = make_mp4(moov_last=True)
+    index = build(write(tmp_path, 'late.mp4', data))
+    layout = index.layout
+    assert layout is not None and layout.size == len(data)
+    virtual = b''.join(piece if isinstance(piece, bytes) else data[piece[0]:piece[0] + piece[1]]
+                       for piece in layout.map_range(0, layout.size))
+    assert [box_type for box_type, _, _ in scan_top_level_bytes(virtual)] == ['ftyp', 'moov', 'mdat']
+    moov_offset = next(offset for box_type, offset, _ in scan_top_level_bytes(virtual) if box_type == 'moov')
+    track = Track(parse_boxes(virtual, moov_offset, len(virtual))[0].find('trak'))
+    # Every chunk offset in the rewritten moov points at the same samples
+    for first_sample, count, offset in track.iter_chunks():
+        for sample in range(first_sample, first_sample + count):
+            payload = samples[sample - 1]
+            assert virtual[offset:offset + len(payload)] == payload
+            offset += len(payload)
+
+
+def test_layout_ranges_cross_segment_boundaries():
+    layout = VirtualLayout([(10, None, 0), (5, b'HELLO', None), (10, None, 100)])
+    assert layout.size == 25
+    assert layout.map_range(8, 9) == [(8, 2), b'HELLO', (100, 2)]
+    assert layout.map_range(12, 2) == [b'LL']
+    assert layout.map_range(24, 10) == [(109, 1)]
+    assert layout.map_segments([b'--', (0, 1)]) == [b'--', (0, 1)]
+
+
+def test_keyframe_lookup(tmp_path):
+    data, _ = make_mp4(moov_last=False)
+    index = build(write(tmp_path, 'fast.mp4', data))
+    # One keyframe every 30 samples of 1/30 s
+    assert [round(t, 6) for t, _ in index.keyframes] == [0.0, 1.0, 2.0, 3.0]
+    assert index.offset_for_time(1.5) == index.keyframes[1][1]
+    assert index.offset_for_time(-1) is None
@@ -0,0 +1,160 @@
+import os
+import time
+import struct
+import pytest
+from src.config import Config
+from src.probe import (probe_file, format_media_info, MediaProber, ProbeError, EBML_HEADER, EBML_DOCTYPE,
+                       EBML_MAX_HEADER, MKV_SEGMENT, MKV_SEEKHEAD, MKV_SEEK, MKV_SEEK_ID, MKV_SEEK_POSITION,
+                       MKV_INFO, MKV_TIMECODE_SCALE, MKV_DURATION, MKV_TRACKS, MKV_TRACK_ENTRY, MKV_TRACK_TYPE,
+                       MKV_CODEC_ID, MKV_VIDEO, MKV_PIXEL_WIDTH, MKV_PIXEL_HEIGHT, MKV_CLUSTER)
+from media import box, element, uint_element, make_mp4
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def ebml_header(doctype=b'matroska'):
+    return element(EBML_HEADER, element(EBML_DOCTYPE, doctype))
+
+
+def mkv_info(seconds):
+    return element(MKV_INFO, uint_element(MKV_TIMECODE_SCALE, 1000000, 3) +
+                   element(MKV_DURATION, struct.pack('>d', seconds * 1000)))
+
+
+def mkv_tracks():
+    video = element(MKV_TRACK_ENTRY, uint_element(MKV_TRACK_TYPE, 1, 1) + element(MKV_CODEC_ID, b'V_VP9') +
+                    element(MKV_VIDEO, uint_element(MKV_PIXEL_WIDTH, 1280) + uint_element(MKV_PIXEL_HEIGHT, 720)))
+    audio = element(MKV_TRACK_ENTRY, uint_element(MKV_TRACK_TYPE, 2, 1) + element(MKV_CODEC_ID, b'A_OPUS'))
+    return element(MKV_TRACKS, video + audio)
+
+
+def seek_head(positions):
+    return element(MKV_SEEKHEAD, b''.join(
+        element(MKV_SEEK, element(MKV_SEEK_ID, element_id.to_bytes(4, 'big')) +
+                uint_element(MKV_SEEK_POSITION, position, 4))
+        for element_id, position in positions.items()))
+
+
+def test_webm_with_info_before_the_first_cluster(tmp_path):
+    segment = element(MKV_SEGMENT, mkv_info(90.5) + mkv_tracks() + element(MKV_CLUSTER, b'\0' * 32))
+    info = probe_file(write(tmp_path, 'clip.webm', ebml_header(b'webm') + segment))
+    assert info['container'] == 'webm'
+    assert info['duration'] == 90.5
+    assert (info['width'], info['height']) == (1280, 720)
+    assert (info['video_codec'], info['audio_codec']) == ('vp9', 'opus')
+    assert info['bitrate'] > 0
+
+
+def test_mkv_with_info_after_the_clusters_uses_the_seek_head(tmp_path):
+    cluster = element(MKV_CLUSTER, b'\0' * 32)
+    info, tracks = mkv_info(10), mkv_tracks()
+    head_size = len(seek_head({MKV_INFO: 0, MKV_TRACKS: 0}))
+    head = seek_head({MKV_INFO: head_size + len(cluster), MKV_TRACKS: head_size + len(cluster) + len(info)})
+    segment = element(MKV_SEGMENT, head + cluster + info + tracks)
+    result = probe_file(write(tmp_path, 'clip.mkv', ebml_header() + segment))
+    assert result['container'] == 'matroska'
+    assert result['duration'] == 10
+    assert result['video_codec'] == 'vp9'
+
+
+def test_truncated_ebml_header(tmp_path):
+    data = ebml_header()
+    path = write(tmp_path, 'cut.mkv', data[:-3])
+    with pytest.raises(ProbeError, match='unexpected end of file'):
+        probe_file(path)
+
+
+def test_oversized_ebml_header_is_not_read(tmp_path):
+    data = element(EBML_HEADER, b'\0' * (EBML_MAX_HEADER + 1))
+    with pytest.raises(ProbeError, match='EBML header too large'):
+        probe_file(write(tmp_path, 'big.mkv', data))
+
+
+def test_ebml_file_without_a_segment(tmp_path):
+    with pytest.raises(ProbeError, match='no Matroska segment'):
+        probe_file(write(tmp_path, 'empty.mkv', ebml_header() + element(MKV_INFO, b'')))
+
+
+def test_mp4(tmp_path):
+    data, _ = make_mp4(count=120)
+    info = probe_file(write(tmp_path, 'clip.mp4', data))
+    assert info['container'] == 'mp4'
+    assert info['duration'] == 4.0
+    assert (info['width'], info['height']) == (640, 360)
+    assert info['bitrate'] == int(len(data) * 8 / 4.0)
+
+
+def test_mp4_without_moov(tmp_path):
+    data = box('ftyp', b'isom\0\0\2\0') + box('mdat', b'\0' * 64)
+    with pytest.raises(ProbeError, match='no moov box'):
+        probe_file(write(tmp_path, 'clip.mp4', data))
+
+
+def test_mp4_with_a_truncated_box(tmp_path):
+    data = box('ftyp', b'isom\0\0\2\0') + struct.pack('>I4s', 500, b'moov') + b'\0' * 20
+    with pytest.raises(ProbeError):
+        probe_file(write(tmp_path, 'clip.mp4', data))
+
+
+@pytest.mark.parametrize('data', [b'', b'plain text, not a movie'])
+def test_unrecognized_container(tmp_path, data):
+    with pytest.raises(ProbeError, match='unrecognized container'):
+        probe_file(write(tmp_path, 'clip.avi', data))
+
+
+def test_format_media_info():
+    assert format_media_info(None) == ''
+    assert format_media_info({'duration': 65.9}) == '1:05'
+    assert format_media_info({'duration': 3725.4, 'width': 1920, 'height': 1080, 'video_codec': 'h264',
+                              'audio_codec': 'aac'}) == '1:02:05 · 1920x1080 · h264/aac'
+    assert format_media_info({'width': 640, 'height': None, 'audio_codec': 'opus'}) == 'opus'
+
+
+def test_prober_caches_results_until_the_file_changes(tmp_path):
+    data, _ = make_mp4(count=30)
+    write(tmp_path, 'clip.mp4', data)
+    write(tmp_path, 'broken.mp4', b'plain text, not a movie')
+    cache_file = str(tmp_path / 'media_info.json')
+    prober = MediaProber(str(tmp_path), cache_file, 1)
+    prober._probe('clip.mp4')
+    prober._probe('broken.mp4')
+    prober._save()
+    assert prober._entries['clip.mp4']['info']['duration'] == 1.0
+    assert prober._entries['broken.mp4']['info'] is None
+
+    # A new prober trusts the saved entries until its worker has checked them
+    reloaded = MediaProber(str(tmp_path), cache_file, 1)
+    reloaded._load()
+    assert set(reloaded._entries) == {'clip.mp4', 'broken.mp4'}
+    version = reloaded.version
+    reloaded._probe('clip.mp4')
+    assert reloaded.version == version
+
+    os.utime(tmp_path / 'clip.mp4', ns=(0, 0))
+    reloaded._probe('clip.mp4')
+    assert reloaded.version == version + 1
+    reloaded.library_changed(1, 2, ['clip.mp4'], [])
+    assert 'clip.mp4' not in reloaded._entries
+
+
+def test_file_replaced_under_the_same_name_is_probed_again(tmp_path, monkeypatch):
+    data, _ = make_mp4(count=30)
+    write(tmp_path, 'clip.mp4', data)
+    prober = MediaProber(str(tmp_path), str(tmp_path / 'media_info.json'), 1)
+    prober._probe('clip.mp4')
+    data, _ = make_mp4(count=60)
+    write(tmp_path, 'clip.mp4', data)
+    # Recently verified entries are served without queueing a check
+    assert prober.lookup(['clip.mp4'])['clip.mp4']['duration'] == 1.0
+    assert not prober._pending
+
+    monkeypatch.setattr(Config, 'MEDIA_INFO_RECHECK_INTERVAL', 0)
+    prober.lookup(['clip.mp4'])
+    deadline = time.monotonic() + 5
+    while prober._pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert prober.lookup(['clip.mp4'])['clip.mp4']['duration'] == 2.0
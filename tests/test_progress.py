@@ -0,0 +1,24 @@
+import pytest
+from src.config import Config
+from src.progress import WatchProgress
+
+
+@pytest.fixture
+def progress(tmp_path):
+    return WatchProgress(str(tmp_path / 'progress.db'), 3600)
+
+
+def test_saved_position_survives_a_flush(progress, tmp_path):
+    progress.record('ann', 'clip.mp4', 3000.5)
+    progress.flush()
+    assert WatchProgress(str(tmp_path / 'progress.db'), 3600).get('ann', 'clip.mp4') == 3000.5
+    assert progress.get('bob', 'clip.mp4') == 0
+
+
+@pytest.mark.parametrize('position', [0, Config.MIN_SAVE_TIME - 1, -5, float('nan'), float('inf'), 'abc', None])
+def test_positions_that_are_not_saved(progress, position):
+    progress.record('ann', 'clip.mp4', 3000)
+    progress.flush()
+    progress.record('ann', 'clip.mp4', position)
+    progress.flush()
+    assert progress.get('ann', 'clip.mp4') == 3000
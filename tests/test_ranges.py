@@ -0,0 +1,113 @@
+import os
+import pytest
+from src.config import Config
+from src.moviefiles import MovieFileCache
+from src.streaming import (parse_range_header, coalesce_ranges, if_range_matches, plan_partial_content,
+                           iter_segments, RangeNotSatisfiable)
+from werkzeug.http import http_date
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=900-', [(900, 999)]),
+    ('bytes=-100', [(900, 999)]),
+    ('bytes=-5000', [(0, 999)]),
+    ('bytes=990-5000', [(990, 999)]),
+    ('bytes = 0 - 0', [(0, 0)]),
+    ('BYTES=0-9', [(0, 9)]),
+    ('bytes=0-9,,20-29', [(0, 9), (20, 29)]),
+])
+def test_single_and_suffix_ranges(header, expected):
+    assert parse_range_header(header, SIZE) == expected
+
+
+@pytest.mark.parametrize('header', [None, '', 'items=0-9', 'bytes=', 'bytes=abc', 'bytes=-', 'bytes=9-0'])
+def test_invalid_headers_are_ignored(header):
+    # An invalid Range header means the full file is served
+    assert parse_range_header(header, SIZE) is None
+
+
+@pytest.mark.parametrize('header, size', [('bytes=1000-', SIZE), ('bytes=5000-6000', SIZE), ('bytes=-0', SIZE),
+                                          ('bytes=0-', 0), ('bytes=-10', 0)])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, size)
+
+
+def test_unsatisfiable_parts_are_dropped():
+    assert parse_range_header('bytes=5000-,0-9', SIZE) == [(0, 9)]
+
+
+def test_overlapping_and_adjacent_ranges_are_merged():
+    assert parse_range_header('bytes=50-99,0-49,200-299,250-260', SIZE) == [(0, 99), (200, 299)]
+    assert coalesce_ranges([(10, 20), (0, 5), (6, 9)]) == [(0, 20)]
+    assert coalesce_ranges([(0, 5), (7, 9)]) == [(0, 5), (7, 9)]
+
+
+def test_range_count_is_capped():
+    header = 'bytes=' + ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(Config.STREAM_MAX_RANGES + 5))
+    assert len(parse_range_header(header, 10 ** 6)) == Config.STREAM_MAX_RANGES
+
+
+def test_if_range():
+    assert if_range_matches(None, 'abc', 1000)
+    assert if_range_matches('"abc"', 'abc', 1000)
+    assert not if_range_matches('"other"', 'abc', 1000)
+    assert not if_range_matches('W/"abc"', 'abc', 1000)
+    assert if_range_matches(http_date(1000), 'abc', 1000.5)
+    assert not if_range_matches(http_date(999), 'abc', 1000)
+    assert not if_range_matches('not a date', 'abc', 1000)
+
+
+@pytest.fixture
+def movie(tmp_path):
+    data = bytes(range(256)) * 4
+    (tmp_path / 'clip.mp4').write_bytes(data)
+    cache = MovieFileCache(str(tmp_path), 4, 4, 60)
+    return cache.get('clip.mp4'), data
+
+
+def body(movie, segments):
+    return b''.join(iter_segments(movie, segments))
+
+
+def test_single_range_body(movie):
+    movie, data = movie
+    headers, segments = plan_partial_content('bytes=-24', 'video/mp4', len(data), movie.mtime, movie.etag)
+    assert headers['Content-Range'] == f'bytes 1000-1023/{len(data)}'
+    assert headers['Content-Length'] == '24'
+    assert body(movie, segments) == data[1000:]
+
+
+def test_multipart_body_matches_headers(movie):
+    movie, data = movie
+    headers, segments = plan_partial_content('bytes=0-9,500-509,1020-', 'video/mp4', len(data), movie.mtime,
+                                             movie.etag)
+    boundary = headers['Content-Type'].split('boundary=')[1]
+    content = body(movie, segments)
+    assert len(content) == int(headers['Content-Length'])
+    parts = content.split(f'--{boundary}'.encode())
+    assert parts[-1] == b'--\r\n'
+    payloads = [part.split(b'\r\n\r\n', 1)[1][:-2] for part in parts[1:-1]]
+    assert payloads == [data[0:10], data[500:510], data[1020:]]
+    assert b'Content-Range: bytes 500-509/1024' in parts[2]
+
+
+def test_file_shrinking_mid_stream_ends_the_body(movie):
+    movie, data = movie
+    with movie.open():
+        with open(movie.path, 'r+b') as f:
+            f.truncate(100)
+        # Later segments reuse the open descriptor and stop at the new end
+        assert body(movie, [(90, 50)]) == data[90:100]
+
+
+def test_replaced_file_is_not_served_from_a_stale_entry(movie):
+    movie, _ = movie
+    os.remove(movie.path)
+    with open(movie.path, 'wb') as f:
+        f.write(b'new content')
+    with pytest.raises(OSError):
+        body(movie, [(0, 10)])
@@ -0,0 +1,90 @@
+import pytest
+from src import reactions
+from src.backends import MemoryBackend
+from src.config import Config
+from src.reactions import ReactionAggregator, ReactionTimeline
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, to=None):
+        self.emitted.append((event, data, to))
+
+
+class FakeState:
+    def __init__(self, movie='clip.mp4'):
+        self.playback_state = {'current_movie': movie}
+        self.reactions = []
+
+    def add_reaction(self, reaction):
+        self.reactions.append(reaction)
+
+
+@pytest.fixture
+def timeline(monkeypatch):
+    timeline = ReactionTimeline(MemoryBackend(), 10)
+    monkeypatch.setattr(reactions, 'reaction_timeline', timeline)
+    return timeline
+
+
+def test_timeline_sums_counts_per_slot():
+    timeline = ReactionTimeline(MemoryBackend(), 10)
+    timeline.add('clip.mp4', {0: {'👍': 2}, 3: {'🎉': 1}})
+    timeline.add('clip.mp4', {0: {'👍': 1, '😂': 1}})
+    timeline.add('other.mp4', {0: {'👍': 5}})
+    assert timeline.query('clip.mp4') == [
+        {'time': 0, 'reactions': {'👍': 3, '😂': 1}},
+        {'time': 30, 'reactions': {'🎉': 1}},
+    ]
+    assert timeline.query('clip.mp4', start=5, end=29) == [{'time': 0, 'reactions': {'👍': 3, '😂': 1}}]
+    assert timeline.query('clip.mp4', start=10) == [{'time': 30, 'reactions': {'🎉': 1}}]
+    assert timeline.query('missing.mp4') == []
+
+
+def test_flush_emits_one_event_per_emoji(timeline, monkeypatch):
+    monkeypatch.setattr(Config, 'REACTION_MAX_USERS', 2)
+    socketio, state = FakeSocketIO(), FakeState()
+    aggregator = ReactionAggregator(socketio, state, 'room')
+    assert not aggregator.is_due()
+    for username in ('ann', 'bob', 'ann', 'cy'):
+        aggregator.add(username, f'{username}.png', '👍', 12.0)
+    aggregator.add('bob', 'bob.png', '🎉', 25.0)
+    aggregator.flush()
+
+    events = {data['emoji']: data for event, data, to in socketio.emitted}
+    assert [(event, to) for event, _, to in socketio.emitted] == [('new_reaction', 'room')] * 2
+    # The first reactor stays at the top level and the user list is capped
+    assert events['👍']['username'] == 'ann' and events['👍']['count'] == 4
+    assert events['👍']['users'] == ['ann', 'bob']
+    assert events['🎉']['count'] == 1 and 'slots' not in events['🎉']
+    assert state.reactions == list(events.values())
+    assert timeline.query('clip.mp4') == [{'time': 10, 'reactions': {'👍': 4}},
+                                          {'time': 20, 'reactions': {'🎉': 1}}]
+
+
+def test_flush_resets_the_window(timeline, monkeypatch):
+    monkeypatch.setattr(Config, 'REACTION_WINDOW', 0)
+    socketio = FakeSocketIO()
+    aggregator = ReactionAggregator(socketio, FakeState(), 'room')
+    aggregator.add('ann', 'ann.png', '👍', 1.0)
+    assert aggregator.is_due()
+    aggregator.flush()
+    assert not aggregator.is_due()
+    aggregator.flush()
+    assert len(socketio.emitted) == 1
+
+
+def test_reactions_without_a_movie_skip_the_timeline(timeline):
+    aggregator = ReactionAggregator(FakeSocketIO(), FakeState(movie=None), 'room')
+    aggregator.add('ann', 'ann.png', '👍', 1.0)
+    aggregator.flush()
+    assert timeline.backend._docs == {}
+
+
+def test_bad_video_time_leaves_no_partial_count(timeline):
+    aggregator = ReactionAggregator(FakeSocketIO(), FakeState(), 'room')
+    with pytest.raises(ValueError):
+        aggregator.add('ann', 'ann.png', '👍', float('nan'))
+    assert aggregator._pending == {} and not aggregator.is_due()
@@ -0,0 +1,87 @@
+import pytest
+from src.backends import RingBuffer, MemoryBackend, SQLiteBackend
+
+
+def fill(buffer, count, start=1):
+    for i in range(start, start + count):
+        buffer.append({'id': f'm{i}', 'text': i})
+
+
+def texts(items):
+    return [item['text'] for item in items]
+
+
+def test_items_keep_their_sequence_numbers():
+    buffer = RingBuffer(4)
+    fill(buffer, 3)
+    assert [item['seq'] for item in buffer.items()] == [1, 2, 3]
+    assert len(buffer) == 3
+
+
+def test_oldest_items_are_evicted_after_wraparound():
+    buffer = RingBuffer(4)
+    fill(buffer, 10)
+    assert texts(buffer.items()) == [7, 8, 9, 10]
+    assert len(buffer) == 4
+    assert buffer.get('m6') is None
+    assert buffer.get('m7')['seq'] == 7
+
+
+def test_paging_backwards_across_the_wrap():
+    buffer = RingBuffer(5)
+    fill(buffer, 12)
+    page, has_more = buffer.page(limit=2)
+    assert texts(page) == [11, 12] and has_more
+    page, has_more = buffer.page(before=page[0]['seq'], limit=2)
+    assert texts(page) == [9, 10] and has_more
+    # Only part of the last page is still held
+    page, has_more = buffer.page(before=page[0]['seq'], limit=2)
+    assert texts(page) == [8] and not has_more
+
+
+def test_page_cursor_older_than_the_buffer_returns_nothing():
+    buffer = RingBuffer(3)
+    fill(buffer, 9)
+    assert buffer.page(before=2, limit=5) == ([], False)
+
+
+def test_page_cursor_past_the_end_is_clamped():
+    buffer = RingBuffer(3)
+    fill(buffer, 5)
+    page, has_more = buffer.page(before=100, limit=2)
+    assert texts(page) == [4, 5] and has_more
+
+
+def test_page_without_limit_returns_everything_held():
+    buffer = RingBuffer(3)
+    fill(buffer, 7)
+    assert buffer.page() == (buffer.items(), False)
+
+
+def test_items_without_id_are_not_indexed():
+    buffer = RingBuffer(2)
+    buffer.append({'text': 'no id'})
+    fill(buffer, 2)
+    assert texts(buffer.items()) == [1, 2]
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'state.db'))
+
+
+def test_backends_page_and_update_by_id(backend):
+    for i in range(1, 8):
+        backend.append('room', 'chat', {'id': f'm{i}', 'text': i}, 5)
+    assert texts(backend.items('room', 'chat')) == [3, 4, 5, 6, 7]
+    page, has_more = backend.page('room', 'chat', before=5, limit=10)
+    assert texts(page) == [3, 4] and not has_more
+
+    def edit(item):
+        item['text'] = 'edited'
+        return item
+    assert backend.update_item('room', 'chat', 'm4', edit)['text'] == 'edited'
+    assert backend.update_item('room', 'chat', 'm1', edit) is None
+    assert backend.page('other', 'chat', limit=5) == ([], False)
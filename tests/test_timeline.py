@@ -0,0 +1,26 @@
+import pytest
+from src.timeline import playback_time, position_at
+
+
+@pytest.mark.parametrize('value, expected', [(0, 0.0), (12, 12.0), (3.5, 3.5)])
+def test_valid_positions(value, expected):
+    assert playback_time(value) == expected
+
+
+@pytest.mark.parametrize('value', ['abc', '12', None, True, [], -1, float('nan'), float('inf'), float('-inf')])
+def test_invalid_positions_are_rejected(value):
+    assert playback_time(value) is None
+
+
+def test_position_advances_while_playing():
+    playback = {'current_time': 10.0, 'is_playing': True, 'updated_at': 100.0, 'rate': 2.0}
+    assert position_at(playback, 103.0) == 16.0
+    assert position_at(dict(playback, is_playing=False), 103.0) == 10.0
+    # Stamps slightly ahead of the server clock never move it backwards
+    assert position_at(playback, 99.0) == 10.0
+
+
+@pytest.mark.parametrize('stored', ['abc', None, float('nan'), float('inf'), -5])
+def test_bad_stored_position_reads_as_the_start(stored):
+    playback = {'current_time': stored, 'is_playing': True, 'updated_at': 100.0}
+    assert position_at(playback, 101.0) == 1.0
@@ -0,0 +1,146 @@
+import json
+import zlib
+import pytest
+from src.config import Config
+from src.wire import SCHEMAS, COMPRESSED_KEY, CODECS, WireCodec, WireCodecs, shorten
+
+
+def expand(value, schema):
+    # The inverse of shorten, as the browser applies it
+    if not isinstance(value, dict):
+        return value
+    names = {(rule if isinstance(rule, str) else rule[0]): (key, rule) for key, rule in schema.items()}
+    result = {}
+    for short, item in value.items():
+        if short not in names:
+            result[short] = item
+            continue
+        key, rule = names[short]
+        if not isinstance(rule, str):
+            nested = rule[1]
+            if 'items' in nested and isinstance(item, list):
+                item = [expand(entry, nested['items']) for entry in item]
+            elif 'values' in nested and isinstance(item, dict):
+                item = {name: expand(entry, nested['values']) for name, entry in item.items()}
+        result[key] = item
+    return result
+
+
+def decode(payload):
+    if isinstance(payload, dict) and COMPRESSED_KEY in payload:
+        return json.loads(zlib.decompress(payload[COMPRESSED_KEY]))
+    return payload
+
+
+MESSAGE = {'id': 'm1', 'seq': 4, 'username': 'ann', 'avatar': 'a.png', 'message': 'hi', 'timestamp': 1.5,
+           'reactions': {'👍': ['bob']}, 'spoiler': False, 'extra': 'kept'}
+
+PAYLOADS = {
+    'chat_history': {'messages': [MESSAGE, dict(MESSAGE, id='m2')], 'before': None, 'cursor': 3, 'has_more': True},
+    'users_update': {'users': ['ann', 'bob'], 'count': 2, 'typing_users': [], 'version': 9,
+                     'user_details': {'ann': {'avatar': 'a.png', 'is_watching': True, 'current_time': 12.5},
+                                      # A username that happens to equal a short key stays as it is
+                                      'u': {'typing': True}}},
+    'presence_delta': {'version': 10, 'joined': {'cy': {'joined_at': 1.0}}, 'left': ['bob'], 'changed': {},
+                       'count': 2},
+    'sync_state': {'time': 3.0, 'is_playing': True, 'rate': 1.0, 'seq': 2, 'server_time': 100.0,
+                   'current_movie': 'clip.mp4'},
+    'new_reaction': {'emoji': '🎉', 'count': 3, 'users': ['ann', 'bob'], 'video_time': 4.0},
+    'unknown_event': {'anything': [1, 2]},
+}
+
+
+@pytest.mark.parametrize('event', sorted(PAYLOADS))
+def test_round_trip(event):
+    data = PAYLOADS[event]
+    schema = SCHEMAS.get(event, {})
+    for codec in CODECS.values():
+        payload = decode(codec.encode(event, data))
+        assert (expand(payload, schema) if codec.short_keys else payload) == data
+
+
+def test_short_names_are_unique_within_a_schema():
+    def check(schema):
+        shorts = [rule if isinstance(rule, str) else rule[0] for rule in schema.values()]
+        assert len(shorts) == len(set(shorts))
+        for rule in schema.values():
+            if not isinstance(rule, str):
+                check(next(iter(rule[1].values())))
+    for schema in SCHEMAS.values():
+        check(schema)
+
+
+def test_nested_values_are_shortened():
+    payload = shorten(PAYLOADS['users_update'], SCHEMAS['users_update'])
+    assert payload['d']['ann'] == {'a': 'a.png', 'w': True, 't': 12.5}
+    assert payload['d']['u'] == {'ty': True}
+    assert shorten(['not', 'a', 'dict'], SCHEMAS['new_message']) == ['not', 'a', 'dict']
+
+
+def test_deflate_only_above_the_threshold():
+    codec = CODECS[(False, True)]
+    small = {'message': 'hi'}
+    assert codec.encode('new_message', small) == small
+    large = {'message': 'x' * Config.WIRE_COMPRESS_MIN_BYTES}
+    payload = codec.encode('new_message', large)
+    assert set(payload) == {COMPRESSED_KEY} and isinstance(payload[COMPRESSED_KEY], bytes)
+    assert decode(payload) == large
+
+
+def test_non_dict_payloads_pass_through():
+    for codec in CODECS.values():
+        assert codec.encode('sync_state', 'text') == 'text'
+
+
+@pytest.mark.parametrize('value, options', [
+    ('short', (True, False)),
+    ('deflate', (False, True)),
+    ('short, deflate', (True, True)),
+    ('deflate,short,unknown', (True, True)),
+])
+def test_from_query_returns_shared_codecs(value, options):
+    assert WireCodec.from_query(value) is CODECS[options]
+
+
+@pytest.mark.parametrize('value', [None, '', 'json', ','])
+def test_from_query_without_options(value):
+    assert WireCodec.from_query(value) is None
+
+
+class FakeManager:
+    def __init__(self, sids):
+        self.rooms = {'/': {'room': dict.fromkeys(sids)}}
+
+    def get_participants(self, namespace, room):
+        for sid in self.rooms[namespace][room]:
+            yield sid, sid
+
+
+def test_split_encodes_once_per_codec():
+    codecs = WireCodecs()
+    codecs.negotiate('a', 'short')
+    codecs.negotiate('b', 'short')
+    codecs.negotiate('c', 'deflate')
+    manager = FakeManager(['a', 'b', 'c', 'd', 'sender'])
+    data = {'message': 'hi', 'username': 'ann'}
+    sent = list(codecs.split(manager, 'new_message', data, '/', 'room', 'sender'))
+    assert len(sent) == 3
+    recipients = set('abcd')
+    for payload, skip in sent:
+        receiving = recipients - set(skip)
+        assert 'sender' in skip
+        if receiving == {'a', 'b'}:
+            assert payload == {'m': 'hi', 'u': 'ann'}
+        else:
+            assert receiving in ({'c'}, {'d'}) and payload == data
+
+
+def test_split_with_a_single_codec_keeps_skip_sid():
+    codecs = WireCodecs()
+    codecs.negotiate('a', 'short')
+    manager = FakeManager(['a', 'sender'])
+    assert list(codecs.split(manager, 'new_message', {'message': 'hi'}, '/', 'room', 'sender')) == \
+        [({'m': 'hi'}, 'sender')]
+    codecs.forget('a')
+    assert list(codecs.split(manager, 'new_message', {'message': 'hi'}, '/', 'room', None)) == \
+        [({'message': 'hi'}, None)]